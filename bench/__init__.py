@@ -0,0 +1,84 @@
+# This file is part of python-rwhoisd
+#
+# Copyright (C) 2003, David E. Blacka
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+"""Benchmarks for python-rwhoisd.
+
+  generate.py    writes a synthetic registry (schema, data and query
+                 files) of any size
+  harness.py     runs a query workload against a database, in process
+                 or over TCP, and reports throughput and latency
+  loadgen.py     drives a running server with many concurrent
+                 connections at a target rate, and writes a JSON report
+  replay.py      replays a capture of real traffic (see
+                 config.capture_file), in process or over TCP, and
+                 compares the responses with an earlier replay
+  load_bench.py  compares the data file parsers
+
+The scripts can be run directly (e.g., "python bench/harness.py") or
+as modules ("python -m bench.harness").  Importing this package puts
+the rwhoisd modules on sys.path."""
+
+import os
+import sys
+
+rwhoisd_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "rwhoisd")
+if rwhoisd_path not in sys.path:
+    sys.path.insert(0, rwhoisd_path)
+
+# the latency histogram is the one the server keeps its statistics in.
+from Stats import Histogram  # noqa: E402,F401
+
+
+def percentile(sorted_values, p):
+    """Return the 'p'th percentile (0 < p <= 100) of a sorted list,
+    using the nearest rank method."""
+
+    if not sorted_values:
+        return 0.0
+    rank = int(len(sorted_values) * p / 100.0 + 0.999999)
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+def summarize(latencies, elapsed):
+    """Summarize a list of per-query latencies (in seconds), measured
+    over 'elapsed' seconds of wall time, as a dictionary."""
+
+    latencies = sorted(latencies)
+    res = {"queries": len(latencies), "elapsed": elapsed, "qps": 0.0}
+    if elapsed > 0:
+        res["qps"] = len(latencies) / elapsed
+    for p in (50, 90, 99, 99.9):
+        res["p%s" % str(p).replace(".", "")] = percentile(latencies, p)
+    if latencies:
+        res["max"] = latencies[-1]
+    return res
+
+
+def format_summary(label, summary):
+    """Format a summary from summarize() as a line of text."""
+
+    return "%-12s %8d queries  %7.2f s  %9.0f q/s  p50 %7.3f ms  p99 %7.3f ms  p999 %7.3f ms" % (
+        label,
+        summary["queries"],
+        summary["elapsed"],
+        summary["qps"],
+        summary["p50"] * 1000,
+        summary["p99"] * 1000,
+        summary["p999"] * 1000,
+    )
@@ -0,0 +1,102 @@
+# This file is part of python-rwhoisd
+#
+# Copyright (C) 2003, David E. Blacka
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+"""A minimal RWhois client, for the benchmarks."""
+
+import socket
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class Response:
+    """The lines of one response, and how it ended."""
+
+    def __init__(self, lines, status):
+        self.lines = lines
+        # the terminating line: "%ok" or "%error ...".
+        self.status = status
+
+    def ok(self):
+        return self.status == "%ok"
+
+    def error_code(self):
+        """Return the error code of an error response, or None."""
+
+        if self.status.startswith("%error"):
+            return int(self.status.split()[1])
+        return None
+
+    def __len__(self):
+        return len(self.lines)
+
+
+class Connection:
+    """A connection to an RWhois server.  After connecting, the
+    server's banner is in 'banner'."""
+
+    def __init__(self, host, port, timeout=30):
+        self.sock = socket.create_connection((host, port), timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.rfile = self.sock.makefile("rb")
+        self.banner = self.readline()
+        if not self.banner.startswith("%rwhois"):
+            raise ProtocolError("unexpected banner: %r" % self.banner)
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+    def readline(self):
+        line = self.rfile.readline()
+        if not line:
+            raise ProtocolError("connection closed by server")
+        return line.decode("utf-8", "replace").rstrip("\r\n")
+
+    def send(self, line):
+        """Send a query or directive line, without waiting for the
+        response."""
+
+        self.sock.sendall(line.encode("utf-8") + b"\r\n")
+
+    def read_response(self):
+        """Read one response, up to its "%ok" or "%error" line."""
+
+        lines = []
+        while True:
+            line = self.readline()
+            if line == "%ok" or line.startswith("%error"):
+                return Response(lines, line)
+            lines.append(line)
+
+    def request(self, line):
+        """Send a line and return its Response."""
+
+        self.send(line)
+        return self.read_response()
+
+    def holdconnect(self, on=True):
+        """Ask the server to keep the connection open between
+        queries."""
+
+        res = self.request("-holdconnect %s" % (on and "on" or "off"))
+        if not res.ok():
+            raise ProtocolError("-holdconnect failed: %s" % res.status)
+        return res
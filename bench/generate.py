@@ -0,0 +1,408 @@
+#! /usr/bin/env python
+
+# This file is part of python-rwhoisd
+#
+# Copyright (C) 2003, David E. Blacka
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+"""Generate a synthetic registry for benchmarking.
+
+usage: generate.py [-n objects] [-s seed] [-q queries] [-m mix] [-z] directory
+
+Writes 'schema', 'data' (or 'data.gz' with -z) and 'queries' files to
+'directory'.  The registry holds IPv4 networks (nested /20s and /24s),
+IPv6 networks, netblocks that aren't CIDR aligned, hosts, contacts,
+organizations, domains and referrals (for both domains and IPv4
+space), in roughly the proportions of a regional registry.  The query
+file is a mix of lookups of those objects, plus some misses; -m
+changes the mix, e.g. "-m ip=50,domain=50".
+
+Every object is a function of its number and the seed alone, so the
+output is the same from run to run, and queries can be made for
+objects without keeping them in memory.  Generating 10^7 objects
+takes a few minutes and about 2.5GB of disk."""
+
+import getopt
+import gzip
+import ipaddress
+import os
+import random
+import sys
+
+# the object kinds, as (kind, first slot, last slot) in each run of
+# 20 consecutive object numbers.
+layout = [
+    ("net4", 0, 6),
+    ("net6", 7, 8),
+    ("netblock", 9, 9),
+    ("contact", 10, 14),
+    ("domain", 15, 16),
+    ("host", 17, 17),
+    ("org", 18, 18),
+    ("referral", 19, 19),
+]
+cycle = 20
+
+_slot_kinds = []
+for _kind, _first, _last in layout:
+    for _slot in range(_first, _last + 1):
+        _slot_kinds.append((_kind, _first, _last - _first + 1))
+
+schema = """## generated by bench/generate.py
+domain-name   = N
+email         = N
+host-name     = N
+ip-address    = C
+ip-network    = C
+network-block = C
+last-name     = N
+name          = N
+network-name  = N
+org-name      = N
+"""
+
+first_names = (
+    "Ada Alan Barbara Brian Carol Claude Dennis Donald Edsger Frances Grace "
+    "Guido Hedy Ivan John Ken Leslie Linus Margaret Niklaus Radia Richard "
+    "Robin Sophie Tim Vint Whitfield Yukihiro"
+).split()
+last_names = (
+    "Allen Backus Cerf Dijkstra Engelbart Floyd Goldberg Hamilton Hopper "
+    "Iverson Kahn Knuth Lamport Liskov McCarthy Milner Naur Perlman Postel "
+    "Ritchie Shannon Stallman Thompson Torvalds Turing Wirth Wilson"
+).split()
+words = (
+    "alpha amber anchor arrow aspen atlas basin beacon birch bolt brook "
+    "canyon cedar cinder comet coral delta drift ember falcon fern fjord "
+    "garnet glacier harbor hazel heron indigo iris jasper juniper kestrel "
+    "lagoon laurel lotus maple meadow mesa nimbus oasis onyx orbit pebble "
+    "pine prairie quartz raven ridge river sable sage sierra slate summit "
+    "tundra umber vale willow zephyr"
+).split()
+tlds = ["com", "net", "org", "info", "example"]
+
+auth_area = "example.net"
+v4_base = 1 << 24  # 1.0.0.0, networks and hosts
+netblock_base = 128 << 24  # 128.0.0.0, netblocks
+referral_base = 64 << 24  # 64.0.0.0, referred IPv4 space
+v6_base = 0x2001 << 112
+
+
+def _hash(i, seed):
+    """A cheap, well mixed 32 bit hash of an object number."""
+
+    x = (i * 0x9E3779B1 + seed * 0x85EBCA6B) & 0xFFFFFFFF
+    x ^= x >> 15
+    x = (x * 0x2C1B3C6D) & 0xFFFFFFFF
+    x ^= x >> 12
+    return x
+
+
+def kind_of(i):
+    """Return (kind, serial) for object number 'i', where serial is
+    the object's number among objects of its kind."""
+
+    kind, first, width = _slot_kinds[i % cycle]
+    return kind, (i // cycle) * width + (i % cycle - first)
+
+
+def kind_count(kind, n):
+    """Return the number of objects of 'kind' in a registry of 'n'
+    objects."""
+
+    for k, first, last in layout:
+        if k == kind:
+            width = last - first + 1
+            return (n // cycle) * width + max(0, min(n % cycle, last + 1) - first)
+    raise KeyError(kind)
+
+
+def v4(num):
+    return str(ipaddress.IPv4Address(num))
+
+
+def v6(num):
+    return str(ipaddress.IPv6Address(num))
+
+
+def net4(s):
+    """The network of the s'th IPv4 network object.  Every 16th one is
+    a /20 enclosing the next 15 /24s."""
+
+    if s % 16 == 0:
+        return v4(v4_base + s * 256) + "/20"
+    return v4(v4_base + s * 256) + "/24"
+
+
+def net6(s):
+    if s % 16 == 0:
+        return v6(v6_base + (s << 80)) + "/44"
+    return v6(v6_base + (s << 80)) + "/48"
+
+
+def netblock(s):
+    start = netblock_base + s * 512
+    return v4(start), v4(start + 383)
+
+
+def contact_name(s, seed):
+    h = _hash(s, seed)
+    return first_names[h % len(first_names)], last_names[(h >> 8) % len(last_names)]
+
+
+def domain_name(s, seed):
+    h = _hash(s, seed + 1)
+    return "%s%s%d.%s" % (words[h % len(words)], words[(h >> 8) % len(words)], s, tlds[(h >> 16) % len(tlds)])
+
+
+def referral_area(s):
+    if s % 2:
+        return v4(referral_base + (s // 2) * 256) + "/24"
+    return "sub%d.%s" % (s // 2, auth_area)
+
+
+def make_object(i, seed):
+    """Return the text of object number 'i'."""
+
+    kind, s = kind_of(i)
+    h = _hash(i, seed)
+    updated = "2003%02d%02d" % (h % 12 + 1, (h >> 4) % 28 + 1)
+    org = "%d.org.%s" % ((h >> 8) % max(1, kind_count("org", i + 1)), auth_area)
+    contact = "%d.contact.%s" % ((h >> 12) % max(1, kind_count("contact", i + 1)), auth_area)
+
+    lines = []
+    if kind == "net4":
+        lines += [
+            "ID: %d.net4.%s" % (s, auth_area),
+            "Class-Name: network",
+            "Auth-Area: %s" % auth_area,
+            "Network-Name: NET4-%d" % s,
+            "IP-Network: %s" % net4(s),
+            "Organization: %s" % org,
+            "Tech-Contact: %s" % contact,
+        ]
+    elif kind == "net6":
+        lines += [
+            "ID: %d.net6.%s" % (s, auth_area),
+            "Class-Name: network",
+            "Auth-Area: %s" % auth_area,
+            "Network-Name: NET6-%d" % s,
+            "IP-Network: %s" % net6(s),
+            "Organization: %s" % org,
+            "Tech-Contact: %s" % contact,
+        ]
+    elif kind == "netblock":
+        start, end = netblock(s)
+        lines += [
+            "ID: %d.block.%s" % (s, auth_area),
+            "Class-Name: network",
+            "Auth-Area: %s" % auth_area,
+            "Network-Name: BLOCK-%d" % s,
+            "Network-Block: %s - %s" % (start, end),
+            "Organization: %s" % org,
+        ]
+    elif kind == "contact":
+        first, last = contact_name(s, seed)
+        lines += [
+            "ID: %d.contact.%s" % (s, auth_area),
+            "Class-Name: contact",
+            "Auth-Area: %s" % auth_area,
+            "Name: %s, %s" % (last, first),
+            "First-Name: %s" % first,
+            "Last-Name: %s" % last,
+            "Email: %s.%s.%d@%s" % (first.lower(), last.lower(), s, auth_area),
+            "Type: I",
+            "Phone: +1 555 %07d" % (h % 10000000),
+            "Organization: %s" % org,
+        ]
+    elif kind == "domain":
+        lines += [
+            "ID: %d.domain.%s" % (s, auth_area),
+            "Class-Name: domain",
+            "Auth-Area: %s" % auth_area,
+            "Domain-Name: %s" % domain_name(s, seed),
+            "Organization: %s" % org,
+            "Admin-Contact: %s" % contact,
+            "Tech-Contact: %s" % contact,
+        ]
+    elif kind == "host":
+        lines += [
+            "ID: %d.host.%s" % (s, auth_area),
+            "Class-Name: host",
+            "Auth-Area: %s" % auth_area,
+            "Host-Name: ns%d.%s" % (s, auth_area),
+            "IP-Address: %s" % v4(v4_base + s * 256 + 1),
+        ]
+    elif kind == "org":
+        lines += [
+            "ID: %d.org.%s" % (s, auth_area),
+            "Class-Name: organization",
+            "Auth-Area: %s" % auth_area,
+            "Org-Name: %s %s Networks %d" % (words[h % len(words)].capitalize(), words[(h >> 8) % len(words)].capitalize(), s),
+            "Country-Code: %s" % ["US", "CA", "NL", "DE", "JP", "BR"][(h >> 16) % 6],
+        ]
+    else:
+        area = referral_area(s)
+        lines += [
+            "ID: %d.referral.%s" % (s, auth_area),
+            "Class-Name: referral",
+            "Auth-Area: %s" % auth_area,
+            "Referred-Auth-Area: %s" % area,
+            "Referral: rwhois://rwhois%d.%s:4321/Auth-Area=%s" % (s, auth_area, area),
+        ]
+    lines.append("Updated: %s" % updated)
+    return "\n".join(lines) + "\n"
+
+
+# the default query mix, as relative weights.
+default_mix = {
+    "ip": 30,
+    "cidr": 10,
+    "ip6": 10,
+    "subnets": 5,
+    "contact": 10,
+    "domain": 15,
+    "prefix": 5,
+    "handle": 5,
+    "referral": 5,
+    "miss": 5,
+}
+
+
+def make_query(kind, n, rnd, seed):
+    """Return a query of type 'kind' against a registry of 'n'
+    objects, using the random.Random instance 'rnd'."""
+
+    def pick(k):
+        return rnd.randrange(max(1, kind_count(k, n)))
+
+    if kind == "ip":
+        s = pick("net4")
+        return v4(v4_base + s * 256 + rnd.randrange(1, 255))
+    if kind == "cidr":
+        return "network %s" % net4(pick("net4"))
+    if kind == "ip6":
+        s = pick("net6")
+        return v6(v6_base + (s << 80) + rnd.randrange(1, 1 << 64))
+    if kind == "subnets":
+        s = pick("net4") & ~15
+        return "network ip-network=%s**" % net4(s)
+    if kind == "contact":
+        return "contact %s" % contact_name(pick("contact"), seed)[1]
+    if kind == "domain":
+        return "domain %s" % domain_name(pick("domain"), seed)
+    if kind == "prefix":
+        return "domain domain-name=%s*" % domain_name(pick("domain"), seed)[:6]
+    if kind == "handle":
+        return "%d.contact.%s" % (pick("contact"), auth_area)
+    if kind == "referral":
+        return "www.sub%d.%s" % (pick("referral") // 2, auth_area)
+    return "missing%d.example.org" % rnd.randrange(1 << 30)
+
+
+def parse_mix(text):
+    """Parse a query mix given as "kind=weight,kind=weight"."""
+
+    mix = {}
+    for item in text.split(","):
+        kind, weight = item.split("=")
+        if kind not in default_mix:
+            raise ValueError("unknown query kind: %s" % kind)
+        mix[kind] = float(weight)
+    return mix
+
+
+def make_queries(n, count, seed=1, mix=None):
+    """Return a list of 'count' queries against a registry of 'n'
+    objects, drawn according to 'mix' (a dictionary of relative
+    weights)."""
+
+    if mix is None:
+        mix = default_mix
+    rnd = random.Random(seed)
+    kinds = sorted(mix.keys())
+    weights = [mix[k] for k in kinds]
+    return [make_query(k, n, rnd, seed) for k in rnd.choices(kinds, weights, k=count)]
+
+
+def generate(directory, n, seed=1, queries=10000, mix=None, compress=False):
+    """Write a registry of 'n' objects to 'directory'.  Returns the
+    (schema, data, queries) file names."""
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    schema_file = os.path.join(directory, "schema")
+    f = open(schema_file, "w")
+    f.write(schema)
+    f.close()
+
+    data_file = os.path.join(directory, "data")
+    if compress:
+        data_file += ".gz"
+        f = gzip.open(data_file, "wt", compresslevel=6)
+    else:
+        f = open(data_file, "w")
+    batch = []
+    for i in range(n):
+        batch.append(make_object(i, seed))
+        if len(batch) >= 10000:
+            f.write("\n".join(batch))
+            f.write("\n")
+            batch = []
+    if batch:
+        f.write("\n".join(batch))
+    f.close()
+
+    query_file = os.path.join(directory, "queries")
+    f = open(query_file, "w")
+    for q in make_queries(n, queries, seed, mix):
+        f.write(q + "\n")
+    f.close()
+
+    return schema_file, data_file, query_file
+
+
+def main(argv):
+    opts, args = getopt.getopt(argv[1:], "n:s:q:m:z")
+    n = 10000
+    seed = 1
+    queries = 10000
+    mix = None
+    compress = False
+    for o, a in opts:
+        if o == "-n":
+            n = int(float(a))
+        elif o == "-s":
+            seed = int(a)
+        elif o == "-q":
+            queries = int(a)
+        elif o == "-m":
+            mix = parse_mix(a)
+        elif o == "-z":
+            compress = True
+    if len(args) != 1:
+        print(__doc__)
+        return 64
+
+    for fn in generate(args[0], n, seed, queries, mix, compress):
+        print("wrote", fn)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,295 @@
+#! /usr/bin/env python
+
+# This file is part of python-rwhoisd
+#
+# Copyright (C) 2003, David E. Blacka
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+"""Run a query workload and report throughput and latency.
+
+usage: harness.py [options]
+
+  -d dir        use the registry in 'dir' (see generate.py), generating
+                it first if it doesn't exist.  Without -d, a registry
+                is generated in a temporary directory.
+  -n objects    the size of a generated registry (default 10000)
+  -q queries    the number of queries in a generated workload
+                (default 10000)
+  -s seed       the seed for a generated registry (default 1)
+  -m mix        the query mix for a generated workload (see generate.py)
+  -b backend    the storage backend (default config.storage_backend)
+  -w count      the number of warm-up queries, not measured (default 1000)
+  -t            also run the workload over TCP, against a server
+                started in this process
+  -H host:port  run the workload over TCP against a running server,
+                instead of in process
+  -c clients    the number of concurrent TCP connections (default 4)
+  -T            time the phases of each query (see config.query_timing),
+                and report where the time went
+
+The in-process run sends each query through QueryProcessor exactly as
+a session would, minus the socket, so it measures the query engine
+alone.  The TCP runs use one connection per client, with holdconnect
+on, and measure each query from send to "%ok" (or "%error")."""
+
+import getopt
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import bench  # noqa: E402
+from bench import client, generate  # noqa: E402
+
+
+class Sink:
+    """A write-only file that just counts what is written to it."""
+
+    def __init__(self):
+        self.bytes = 0
+
+    def write(self, s):
+        self.bytes += len(s)
+
+    def flush(self):
+        pass
+
+
+def read_queries(query_file):
+    f = open(query_file)
+    res = [x.strip() for x in f if x.strip() and not x.startswith("#")]
+    f.close()
+    return res
+
+
+def load(schema_file, data_files, backend=None):
+    """Load a database, returning it and the time taken."""
+
+    import Backend
+
+    start = time.perf_counter()
+    db = Backend.load(schema_file, data_files, True, backend)
+    return db, time.perf_counter() - start
+
+
+def run_in_process(db, queries, warmup):
+    """Run 'queries' through a QueryProcessor, one after another.
+    Returns a summary (see bench.summarize())."""
+
+    import QueryParser
+    import QueryProcessor
+    import Session
+
+    QueryParser.db = db
+    QueryParser.init_parsers()
+    processor = QueryProcessor.QueryProcessor(db)
+    session = Session.Context()
+    session.wfile = Sink()
+
+    for q in queries[:warmup]:
+        processor.process_query(session, q)
+
+    latencies = []
+    clock = time.perf_counter
+    start = clock()
+    for q in queries:
+        t = clock()
+        processor.process_query(session, q)
+        latencies.append(clock() - t)
+    res = bench.summarize(latencies, clock() - start)
+    res["bytes"] = session.wfile.bytes
+    return res
+
+
+def print_phases():
+    import Stats
+
+    for p, h in sorted(Stats.phase_histograms().items(), key=lambda x: Stats.phases.index(x[0])):
+        if h.count:
+            print(
+                "  %-8s mean %8.3f ms  p50 %8.3f ms  p99 %8.3f ms  max %8.3f ms"
+                % (p, h.mean() * 1000, h.percentile(50) * 1000, h.percentile(99) * 1000, h.max * 1000)
+            )
+
+
+def start_server(db):
+    """Start a server for 'db' on a free local port, in a background
+    thread.  Returns the server."""
+
+    import QueryParser
+    import RwhoisServer
+
+    RwhoisServer.install_db(db)
+    QueryParser.init_parsers()
+    server = RwhoisServer.RwhoisTCPServer(("127.0.0.1", 0), RwhoisServer.RwhoisHandler)
+    t = threading.Thread(target=server.serve_forever, name="server")
+    t.daemon = True
+    t.start()
+    return server
+
+
+def run_tcp(host, port, queries, clients, warmup):
+    """Run 'queries' over TCP, split between 'clients' concurrent
+    connections.  Returns a summary (see bench.summarize()), with the
+    counts of error responses by code added.  "No objects found"
+    (230) responses are answers, not errors, so aren't counted."""
+
+    def worker(qs, warm, latencies, errors):
+        conn = None
+        try:
+            try:
+                conn = client.Connection(host, port)
+                conn.holdconnect()
+                for q in warm:
+                    conn.request(q)
+            except (OSError, client.ProtocolError) as e:
+                errors[str(e)] = 1
+                barrier.abort()
+                return
+            barrier.wait()
+            clock = time.perf_counter
+            for q in qs:
+                t = clock()
+                res = conn.request(q)
+                latencies.append(clock() - t)
+                code = res.error_code()
+                if code and code != 230:
+                    errors[code] = errors.get(code, 0) + 1
+        except threading.BrokenBarrierError:
+            # another client failed to connect.
+            errors["aborted"] = 1
+        except (OSError, client.ProtocolError) as e:
+            errors[str(e)] = errors.get(str(e), 0) + 1
+        finally:
+            if conn:
+                conn.close()
+
+    barrier = threading.Barrier(clients + 1)
+    results = []
+    threads = []
+    for i in range(clients):
+        latencies, errors = [], {}
+        results.append((latencies, errors))
+        t = threading.Thread(target=worker, args=(queries[i::clients], queries[i:warmup:clients], latencies, errors))
+        t.daemon = True
+        t.start()
+        threads.append(t)
+
+    try:
+        barrier.wait()
+    except threading.BrokenBarrierError:
+        pass
+    start = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    res = bench.summarize([x for lat, err in results for x in lat], elapsed)
+    errors = {}
+    for lat, err in results:
+        for code, count in err.items():
+            errors[code] = errors.get(code, 0) + count
+    res["errors"] = errors
+    return res
+
+
+def main(argv):
+    opts, args = getopt.getopt(argv[1:], "d:n:q:s:m:b:w:tH:c:T")
+    directory = None
+    n = 10000
+    nqueries = 10000
+    seed = 1
+    mix = None
+    backend = None
+    warmup = 1000
+    tcp = False
+    remote = None
+    clients = 4
+    phases = False
+    for o, a in opts:
+        if o == "-d":
+            directory = a
+        elif o == "-n":
+            n = int(float(a))
+        elif o == "-q":
+            nqueries = int(a)
+        elif o == "-s":
+            seed = int(a)
+        elif o == "-m":
+            mix = generate.parse_mix(a)
+        elif o == "-b":
+            backend = a
+        elif o == "-w":
+            warmup = int(a)
+        elif o == "-t":
+            tcp = True
+        elif o == "-H":
+            remote = a
+        elif o == "-c":
+            clients = int(a)
+        elif o == "-T":
+            phases = True
+
+    tmpdir = None
+    if not directory:
+        directory = tmpdir = tempfile.mkdtemp(prefix="rwhoisd_bench_")
+    try:
+        schema_file = os.path.join(directory, "schema")
+        query_file = os.path.join(directory, "queries")
+        data_files = [os.path.join(directory, x) for x in ("data", "data.gz")]
+        data_files = [x for x in data_files if os.path.exists(x)]
+        if not os.path.exists(schema_file) or not data_files:
+            print("generating %d objects in %s" % (n, directory))
+            schema_file, data_file, query_file = generate.generate(directory, n, seed, nqueries, mix)
+            data_files = [data_file]
+        queries = read_queries(query_file)
+
+        if remote:
+            host, port = remote.rsplit(":", 1)
+            print(bench.format_summary("tcp x%d" % clients, run_tcp(host, int(port), queries, clients, warmup)))
+            return 0
+
+        db, elapsed = load(schema_file, data_files, backend)
+        print("loaded %d objects in %.2f s" % (db.object_count(), elapsed))
+
+        if phases:
+            import Stats
+
+            Stats.timing = True
+        print(bench.format_summary("in-process", run_in_process(db, queries, warmup)))
+        if phases:
+            print_phases()
+        if tcp:
+            server = start_server(db)
+            host, port = server.server_address[:2]
+            res = run_tcp(host, port, queries, clients, warmup)
+            server.shutdown()
+            print(bench.format_summary("tcp x%d" % clients, res))
+            if res["errors"]:
+                print("errors:", res["errors"])
+    finally:
+        if tmpdir:
+            shutil.rmtree(tmpdir)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
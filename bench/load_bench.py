@@ -0,0 +1,128 @@
+#! /usr/bin/env python
+
+# This file is part of python-rwhoisd
+#
+# Copyright (C) 2003, David E. Blacka
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+"""Compare the speed of the block-based DataFile record parser with
+the original line-at-a-time loader.
+
+usage: load_bench.py [-n records] [-r repeat] [data_file ...]
+
+With no data files, a file of 'records' synthetic contact records is
+generated and used."""
+
+import getopt
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "rwhoisd"))
+
+import DataFile  # noqa: E402
+import MemDB  # noqa: E402
+from Rwhois import rwhoisobject  # noqa: E402
+
+
+def legacy_read_objects(data_file):
+    """The original MemDB.load_data() parsing loop, kept as the
+    baseline."""
+
+    df = open(data_file)
+    obj = rwhoisobject()
+
+    for line in df:
+        line = line.strip()
+        if line.startswith("#"):
+            continue
+        if not line or line.startswith("---"):
+            yield obj
+            obj = rwhoisobject()
+            continue
+
+        a, v = line.split(":", 1)
+        obj.add_attr(a, v.lstrip())
+
+    yield obj
+    df.close()
+
+
+def block_read_objects(data_file):
+    for rec in DataFile.read_records(data_file):
+        yield MemDB.record_to_object(rec)
+
+
+def synthesize(n):
+    fd, fn = tempfile.mkstemp(prefix="load_bench_")
+    f = os.fdopen(fd, "w")
+    for i in range(n):
+        f.write("ID: %d.bench.example\n" % i)
+        f.write("Auth-Area: bench.example\n")
+        f.write("Class-Name: contact\n")
+        f.write("Name: Contact Number %d\n" % i)
+        f.write("Email: contact%d@bench.example\n" % i)
+        f.write("Phone: +1 555 %07d\n" % i)
+        f.write("Updated: 20030101000000000\n")
+        f.write("---\n")
+    f.close()
+    return fn
+
+
+def run(label, func, files, repeat):
+    best = None
+    count = 0
+    for r in range(repeat):
+        start = time.perf_counter()
+        count = 0
+        for fn in files:
+            for obj in func(fn):
+                count += 1
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    print("%-8s %9d records  %8.3f s  %10.0f records/s" % (label, count, best, count / best))
+    return best
+
+
+def main(argv):
+    opts, args = getopt.getopt(argv[1:], "n:r:")
+    n = 100000
+    repeat = 3
+    for o, a in opts:
+        if o == "-n":
+            n = int(a)
+        elif o == "-r":
+            repeat = int(a)
+
+    tmp = None
+    if not args:
+        tmp = synthesize(n)
+        args = [tmp]
+
+    try:
+        legacy = run("legacy", legacy_read_objects, args, repeat)
+        block = run("block", block_read_objects, args, repeat)
+        print("speedup: %.2fx" % (legacy / block))
+    finally:
+        if tmp:
+            os.unlink(tmp)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,350 @@
+#! /usr/bin/env python
+
+# This file is part of python-rwhoisd
+#
+# Copyright (C) 2003, David E. Blacka
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+"""Drive an RWhois server with concurrent connections.
+
+usage: loadgen.py [options] query_file
+
+  -H host:port  the server (default 127.0.0.1:4321)
+  -c conns      the number of concurrent connections (default 8)
+  -r rate       the total target rate, in requests per second.  0 (the
+                default) sends as fast as the server answers.
+  -n requests   the total number of requests (default: the number of
+                lines in query_file)
+  -t seconds    stop after this long, instead of after -n requests
+  -p depth      the number of requests each connection pipelines,
+                i.e., sends before reading the responses (default 1)
+  -l limit      send "-limit <limit>" at the start of each connection
+  -x every      make every Nth request "-xfer <area>"
+  -a area       the authority area for -x (default example.net)
+  -k            don't use holdconnect: open a new connection, and read
+                the banner, for every request (-p is ignored)
+  -o file       write the JSON report to 'file' (default: stdout)
+
+Lines in query_file starting with "-" are sent as directives, and
+the rest as queries.  Every response must end with "%ok" or "%error";
+anything else (including the connection closing) is counted as a
+protocol error.
+
+When a rate is given, requests are scheduled on a fixed timetable,
+and latency is measured from when a request was due to be sent, not
+when it was sent, so a server that falls behind shows its queueing
+delay rather than hiding it."""
+
+import getopt
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import bench  # noqa: E402
+from bench import client  # noqa: E402
+
+
+def request_kind(line):
+    if line.startswith("-xfer"):
+        return "xfer"
+    if line.startswith("-"):
+        return "directive"
+    return "query"
+
+
+class Results:
+    """The latencies and outcomes of one connection's requests."""
+
+    def __init__(self):
+        # keys are request kinds, values are bench.Histograms.
+        self.latency = {}
+        # counts of responses by terminating status ("ok", or the
+        # error code).
+        self.statuses = {}
+        # counts of protocol errors by description.
+        self.errors = {}
+        self.connect = bench.Histogram()
+
+    def record(self, kind, seconds, res):
+        h = self.latency.get(kind)
+        if h is None:
+            h = self.latency[kind] = bench.Histogram()
+        h.add(seconds)
+        if res.ok():
+            status = "ok"
+        else:
+            status = str(res.error_code())
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def error(self, e):
+        desc = str(e) or e.__class__.__name__
+        self.errors[desc] = self.errors.get(desc, 0) + 1
+
+    def merge(self, other):
+        for kind, h in other.latency.items():
+            self.latency.setdefault(kind, bench.Histogram()).merge(h)
+        for d, o in ((self.statuses, other.statuses), (self.errors, other.errors)):
+            for k, n in o.items():
+                d[k] = d.get(k, 0) + n
+        self.connect.merge(other.connect)
+
+    def count(self):
+        return sum([h.count for h in self.latency.values()])
+
+
+class LoadGenerator:
+    def __init__(self, host, port, lines, conns=8, rate=0, requests=None, duration=None, depth=1, limit=None, hold=True):
+        self.host = host
+        self.port = port
+        self.lines = lines
+        self.conns = conns
+        self.rate = rate
+        self.requests = requests or len(lines)
+        self.duration = duration
+        self.depth = max(1, depth)
+        self.limit = limit
+        self.hold = hold
+
+    def _schedule(self, n, start):
+        """Yield (due time, line) for connection number 'n'."""
+
+        interval = 0
+        if self.rate:
+            interval = float(self.conns) / self.rate
+        k = 0
+        i = n
+        while True:
+            if self.duration is None and i >= self.requests:
+                return
+            due = start + k * interval
+            if self.duration is not None and due - start >= self.duration:
+                return
+            yield due, self.lines[i % len(self.lines)]
+            k += 1
+            i += self.conns
+
+    def _wait_until(self, due):
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _open(self, results):
+        t = time.perf_counter()
+        conn = client.Connection(self.host, self.port)
+        results.connect.add(time.perf_counter() - t)
+        return conn
+
+    def _run_hold(self, n, start, results):
+        """Send connection n's requests over one connection, with up to
+        'depth' of them outstanding."""
+
+        conn = self._open(results)
+        conn.holdconnect()
+        if self.limit is not None:
+            conn.request("-limit %d" % self.limit)
+
+        inflight = queue.Queue()
+        slots = threading.Semaphore(self.depth)
+
+        def reader():
+            while True:
+                item = inflight.get()
+                if item is None:
+                    return
+                kind, sent = item
+                try:
+                    res = conn.read_response()
+                except (OSError, client.ProtocolError) as e:
+                    results.error(e)
+                    return
+                finally:
+                    slots.release()
+                results.record(kind, time.perf_counter() - sent, res)
+
+        rt = threading.Thread(target=reader)
+        rt.daemon = True
+        rt.start()
+        try:
+            for due, line in self._schedule(n, start):
+                self._wait_until(due)
+                slots.acquire()
+                if not rt.is_alive():
+                    break
+                sent = time.perf_counter()
+                if self.rate:
+                    sent = due
+                inflight.put((request_kind(line), sent))
+                conn.send(line)
+        except OSError as e:
+            results.error(e)
+        inflight.put(None)
+        rt.join()
+        conn.close()
+
+    def _run_single(self, n, start, results):
+        """Send each of connection n's requests on a new connection."""
+
+        for due, line in self._schedule(n, start):
+            self._wait_until(due)
+            sent = time.perf_counter()
+            if self.rate:
+                sent = due
+            try:
+                conn = self._open(results)
+                try:
+                    if self.limit is not None:
+                        conn.request("-limit %d" % self.limit)
+                    res = conn.request(line)
+                finally:
+                    conn.close()
+            except (OSError, client.ProtocolError) as e:
+                results.error(e)
+                continue
+            results.record(request_kind(line), time.perf_counter() - sent, res)
+
+    def run(self):
+        """Run the load, returning (elapsed seconds, merged Results)."""
+
+        run = self._run_single
+        if self.hold:
+            run = self._run_hold
+
+        def worker(n, results):
+            try:
+                run(n, start, results)
+            except (OSError, client.ProtocolError) as e:
+                results.error(e)
+
+        # give the threads a moment to start before the first request
+        # is due.
+        start = time.perf_counter() + 0.1
+        threads = []
+        all_results = []
+        for n in range(self.conns):
+            results = Results()
+            t = threading.Thread(target=worker, args=(n, results))
+            t.daemon = True
+            t.start()
+            threads.append(t)
+            all_results.append(results)
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+
+        res = Results()
+        for r in all_results:
+            res.merge(r)
+        return elapsed, res
+
+
+def report(gen, elapsed, results):
+    """Build the JSON report for a run."""
+
+    return {
+        "server": "%s:%d" % (gen.host, gen.port),
+        "connections": gen.conns,
+        "target_rate": gen.rate,
+        "pipeline_depth": gen.depth,
+        "holdconnect": gen.hold,
+        "limit": gen.limit,
+        "elapsed": elapsed,
+        "requests": results.count(),
+        "rate": results.count() / elapsed if elapsed > 0 else 0.0,
+        "statuses": results.statuses,
+        "protocol_errors": results.errors,
+        "latency_ms": dict([(k, h.to_dict()) for k, h in results.latency.items()]),
+        "connect_ms": results.connect.to_dict(),
+    }
+
+
+def main(argv):
+    opts, args = getopt.getopt(argv[1:], "H:c:r:n:t:p:l:x:a:ko:")
+    host, port = "127.0.0.1", 4321
+    conns = 8
+    rate = 0
+    requests = None
+    duration = None
+    depth = 1
+    limit = None
+    xfer_every = 0
+    area = "example.net"
+    hold = True
+    output = None
+    for o, a in opts:
+        if o == "-H":
+            host, port = a.rsplit(":", 1)
+            port = int(port)
+        elif o == "-c":
+            conns = int(a)
+        elif o == "-r":
+            rate = float(a)
+        elif o == "-n":
+            requests = int(a)
+        elif o == "-t":
+            duration = float(a)
+        elif o == "-p":
+            depth = int(a)
+        elif o == "-l":
+            limit = int(a)
+        elif o == "-x":
+            xfer_every = int(a)
+        elif o == "-a":
+            area = a
+        elif o == "-k":
+            hold = False
+        elif o == "-o":
+            output = a
+    if len(args) != 1:
+        print(__doc__)
+        return 64
+
+    f = open(args[0])
+    lines = [x.strip() for x in f if x.strip() and not x.startswith("#")]
+    f.close()
+    if xfer_every:
+        lines = [(i % xfer_every == xfer_every - 1) and "-xfer %s" % area or x for i, x in enumerate(lines)]
+
+    gen = LoadGenerator(host, port, lines, conns, rate, requests, duration, depth, limit, hold)
+    elapsed, results = gen.run()
+    text = json.dumps(report(gen, elapsed, results), indent=2, sort_keys=True)
+    if output:
+        f = open(output, "w")
+        f.write(text + "\n")
+        f.close()
+    else:
+        print(text)
+    if "query" in results.latency:
+        sys.stderr.write(
+            "%d requests in %.2f s (%.0f/s), query p50 %.3f ms p99 %.3f ms\n"
+            % (
+                results.count(),
+                elapsed,
+                results.count() / elapsed,
+                results.latency["query"].percentile(50) * 1000,
+                results.latency["query"].percentile(99) * 1000,
+            )
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,347 @@
+#! /usr/bin/env python
+
+# This file is part of python-rwhoisd
+#
+# Copyright (C) 2003, David E. Blacka
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+"""Replay a capture file (see config.capture_file) against a server.
+
+usage: replay.py [options] capture_file [schema_file data_file ...]
+
+  -H host:port  replay over TCP against a running server.  Without -H,
+                the sessions are replayed in process, through
+                QueryProcessor and DirectiveProcessor, against a
+                database loaded from schema_file and the data files.
+  -f            replay as fast as possible, instead of at the original
+                pacing
+  -s speed      replay at 'speed' times the original pacing (default 1)
+  -c sessions   the most sessions replayed at once (default 64)
+  -o file       write a digest of every response to 'file'
+  -C file       compare the responses with a digest file written by an
+                earlier run (with -o), and report the differences
+
+Each captured session is replayed in order, on a connection (or
+Session) of its own.  At the original pacing, each session starts,
+and each of its lines is sent, at the same time after the start of
+the replay as it was after the start of the capture; if the replay
+falls behind, the lag is reported.  Directives that change the server
+("-reload", "-profile") are skipped."""
+
+import getopt
+import hashlib
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import bench  # noqa: E402
+from bench import client  # noqa: E402
+
+# directives that are not replayed.
+skipped_directives = ("-reload", "-profile")
+
+
+def digest(lines, status):
+    """Return a digest of a response: its status, number of lines, and
+    a hash of the lines."""
+
+    h = hashlib.sha1()
+    for line in lines:
+        h.update(line.encode("utf-8", "replace"))
+        h.update(b"\n")
+    return "%s\t%d\t%s" % (status, len(lines), h.hexdigest()[:16])
+
+
+class Buffer:
+    """A write-only file collecting one response, in process."""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, s):
+        self.parts.append(s)
+
+    def flush(self):
+        pass
+
+    def response(self):
+        """Return the collected response as (lines, status), as
+        client.Response has them, and empty the buffer."""
+
+        lines = "".join(self.parts).split("\r\n")
+        self.parts = []
+        while lines and not lines[-1]:
+            lines.pop()
+        status = ""
+        if lines and (lines[-1] == "%ok" or lines[-1].startswith("%error")):
+            status = lines.pop()
+        return lines, status
+
+
+class InProcessTarget:
+    """Replays sessions through the query and directive processors."""
+
+    def __init__(self, db):
+        import DirectiveProcessor
+        import QueryParser
+        import QueryProcessor
+
+        QueryParser.db = db
+        QueryParser.init_parsers()
+        self.query_processor = QueryProcessor.QueryProcessor(db)
+        self.directive_processor = DirectiveProcessor.DirectiveProcessor(db)
+
+    def open(self):
+        import Session
+
+        session = Session.Context()
+        session.wfile = Buffer()
+        return session
+
+    def request(self, session, line):
+        import Rwhois
+
+        try:
+            if line.startswith("-"):
+                self.directive_processor.process_directive(session, line)
+            else:
+                self.query_processor.process_query(session, line)
+        except Rwhois.RwhoisError as e:
+            session.wfile.write(Rwhois.error_message(e))
+        return session.wfile.response()
+
+    def close(self, session):
+        import QueryParser
+
+        if session.queryparser:
+            QueryParser.release_parser(session.queryparser)
+
+
+class TCPTarget:
+    """Replays sessions over TCP."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+
+    def open(self):
+        return client.Connection(self.host, self.port)
+
+    def request(self, conn, line):
+        res = conn.request(line)
+        return res.lines, res.status
+
+    def close(self, conn):
+        conn.close()
+
+
+class Replay:
+    def __init__(self, sessions, target, pacing=1.0, concurrency=64):
+        self.sessions = sessions
+        self.target = target
+        # 0 means as fast as possible.
+        self.pacing = pacing
+        self.concurrency = concurrency
+        self.lock = threading.Lock()
+        self.next_session = 0
+        self.latencies = []
+        self.lags = []
+        self.errors = {}
+        # keys are (session number, line number), values are digests.
+        self.digests = {}
+
+    def _due(self, t):
+        if not self.pacing:
+            return None
+        return self.start + t / self.pacing
+
+    def _wait(self, t):
+        due = self._due(t)
+        if due is None:
+            return
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            self.lags.append(-delay)
+
+    def _replay_session(self, n, session):
+        self._wait(session["start"])
+        latencies = []
+        digests = {}
+        try:
+            conn = self.target.open()
+        except (OSError, client.ProtocolError) as e:
+            self._error(e)
+            return
+        try:
+            for i, (t, line) in enumerate(session["lines"]):
+                if line.startswith(skipped_directives):
+                    continue
+                self._wait(t)
+                if line.startswith("-quit"):
+                    break
+                start = time.perf_counter()
+                lines, status = self.target.request(conn, line)
+                latencies.append(time.perf_counter() - start)
+                digests[(n, i)] = digest(lines, status)
+        except (OSError, client.ProtocolError) as e:
+            self._error(e)
+        finally:
+            self.target.close(conn)
+        with self.lock:
+            self.latencies.extend(latencies)
+            self.digests.update(digests)
+
+    def _error(self, e):
+        desc = str(e) or e.__class__.__name__
+        with self.lock:
+            self.errors[desc] = self.errors.get(desc, 0) + 1
+
+    def _worker(self):
+        while True:
+            with self.lock:
+                n = self.next_session
+                if n >= len(self.sessions):
+                    return
+                self.next_session += 1
+            self._replay_session(n, self.sessions[n])
+
+    def run(self):
+        """Replay all of the sessions.  Returns a summary (see
+        bench.summarize()), with the lag and errors added."""
+
+        self.start = time.perf_counter()
+        threads = []
+        for i in range(min(self.concurrency, len(self.sessions))):
+            t = threading.Thread(target=self._worker)
+            t.daemon = True
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+        res = bench.summarize(self.latencies, time.perf_counter() - self.start)
+        lags = sorted(self.lags)
+        res["late"] = len(lags)
+        res["lag_p99"] = bench.percentile(lags, 99)
+        res["lag_max"] = lags and lags[-1] or 0.0
+        res["errors"] = self.errors
+        return res
+
+
+def write_digests(filename, digests):
+    f = open(filename, "w")
+    for (n, i), d in sorted(digests.items()):
+        f.write("%d\t%d\t%s\n" % (n, i, d))
+    f.close()
+
+
+def read_digests(filename):
+    res = {}
+    f = open(filename)
+    for line in f:
+        n, i, d = line.rstrip("\n").split("\t", 2)
+        res[(int(n), int(i))] = d
+    f.close()
+    return res
+
+
+def compare(sessions, old, new):
+    """Return a list of lines describing the responses that differ
+    between the digest dictionaries 'old' and 'new'."""
+
+    res = []
+    for key in sorted(set(old.keys()) | set(new.keys())):
+        if old.get(key) == new.get(key):
+            continue
+        n, i = key
+        line = sessions[n]["lines"][i][1] if n < len(sessions) and i < len(sessions[n]["lines"]) else "?"
+        res.append("session %d line %d %r: %s -> %s" % (n, i, line, old.get(key, "missing"), new.get(key, "missing")))
+    return res
+
+
+def main(argv):
+    import Capture
+
+    opts, args = getopt.getopt(argv[1:], "H:fs:c:o:C:")
+    remote = None
+    fast = False
+    pacing = 1.0
+    concurrency = 64
+    output = None
+    compare_file = None
+    for o, a in opts:
+        if o == "-H":
+            remote = a
+        elif o == "-f":
+            fast = True
+        elif o == "-s":
+            pacing = float(a)
+        elif o == "-c":
+            concurrency = int(a)
+        elif o == "-o":
+            output = a
+        elif o == "-C":
+            compare_file = a
+    if not args or (not remote and len(args) < 3):
+        print(__doc__)
+        return 64
+    if fast:
+        pacing = 0
+
+    sessions = Capture.read(args[0])
+    nlines = sum([len(s["lines"]) for s in sessions])
+    print("%d sessions, %d lines" % (len(sessions), nlines))
+
+    if remote:
+        host, port = remote.rsplit(":", 1)
+        target = TCPTarget(host, int(port))
+        label = "tcp"
+    else:
+        import Backend
+
+        start = time.perf_counter()
+        db = Backend.load(args[1], args[2:], True)
+        print("loaded %d objects in %.2f s" % (db.object_count(), time.perf_counter() - start))
+        target = InProcessTarget(db)
+        label = "in-process"
+
+    replay = Replay(sessions, target, pacing, concurrency)
+    res = replay.run()
+    print(bench.format_summary(label, res))
+    if pacing:
+        print("%d lines sent late, lag p99 %.3f ms, max %.3f ms" % (res["late"], res["lag_p99"] * 1000, res["lag_max"] * 1000))
+    if res["errors"]:
+        print("errors:", res["errors"])
+
+    if output:
+        write_digests(output, replay.digests)
+    if compare_file:
+        diffs = compare(sessions, read_digests(compare_file), replay.digests)
+        for line in diffs:
+            print(line)
+        print("%d responses differ" % len(diffs))
+        if diffs:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
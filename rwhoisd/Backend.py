@@ -0,0 +1,227 @@
+# This file is part of python-rwhoisd
+#
+# Copyright (C) 2003, David E. Blacka
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+# This module defines the interface between the protocol side of the
+# server (QueryParser, QueryProcessor, DirectiveProcessor) and the
+# databases that hold the objects, and the table of available
+# databases ("storage backends").
+#
+# A backend module provides a load(schema_file, data_files, startup)
+# function that returns a loaded, ready to search Backend instance.
+# 'startup' is True when the server is starting, and False on a
+# reload; a backend may use an existing on-disk database at startup
+# rather than building it again.
+
+import config
+
+# the known backends.  keys are the names used for
+# config.storage_backend, values are module names.  Any other name is
+# taken to be the name of a module itself.
+backends = {
+    "memory": "MemDB",
+    "sqlite": "SqliteDB",
+}
+
+
+class Backend:
+    """The base class for storage backends.  Subclasses must implement
+    the methods that raise NotImplementedError here; the rest are
+    written in terms of those and of the schema dictionaries, which
+    subclasses must maintain:
+
+      attrs: keys are lowercase attribute names, values are index
+        type characters ('N', 'C', 'A' or 'R') or None if the
+        attribute isn't indexed.
+      classes, authareas: keys are the lowercase class names and
+        authority area names seen in the data, values are None.
+      normal_indexes, cidr_indexes: the attributes searched by
+        search_normal() and search_cidr()."""
+
+    # the name of the backend, used in reports.
+    name = None
+
+    # schema
+
+    def init_schema(self, schema_file):
+        """Initialize the schema from a schema file."""
+        raise NotImplementedError
+
+    def is_attribute(self, attr):
+        return attr.lower() in self.attrs
+
+    def is_indexed_attr(self, attr):
+        if self.is_attribute(attr):
+            return self.attrs[attr.lower()]
+        return False
+
+    def is_objectclass(self, objectclass):
+        return objectclass.lower() in self.classes
+
+    def is_autharea(self, aa):
+        return aa.lower() in self.authareas
+
+    def get_authareas(self):
+        return self.authareas.keys()
+
+    # loading
+
+    def load_data_files(self, data_files, workers=None):
+        """Load a list of rwhoisd-style data files."""
+        raise NotImplementedError
+
+    def index_data(self):
+        """Prepare the database for searching, after loading."""
+        raise NotImplementedError
+
+    def can_update(self, schema_file):
+        """Returns True if update_data() can bring this database up to
+        date with the current data files (and 'schema_file')."""
+        return False
+
+    def copy(self):
+        """Return a copy of this database that update_data() can be
+        applied to while this one goes on answering queries.  Only
+        called if can_update() is True."""
+        raise NotImplementedError
+
+    def update_data(self, data_files):
+        """Apply changes in 'data_files' in place.  Returns an (added,
+        changed, removed) tuple of object counts.  Only called if
+        can_update() is True, and then on a copy() of the database in
+        use."""
+        raise NotImplementedError
+
+    # searching
+
+    def search_attr(self, attr, value, max=0):
+        """Search for a value in a particular attribute's index.
+        Returns an IndexResult of object ids."""
+        raise NotImplementedError
+
+    def search_normal(self, value, max=0):
+        """Search for a value in the 'normal' (string keyed) indexes.
+        Returns a list of object ids, or an empty list if nothing was
+        found."""
+
+        res = IndexResult()
+        for attr in self.normal_indexes:
+            res.extend(self.search_attr(attr, value, max))
+            if max:
+                if len(res) >= max:
+                    res.truncate(max)
+                    return res
+        return res
+
+    def search_cidr(self, value, max=0):
+        """Search for a value in the cidr indexes.  Returns a list of
+        object ids, or an empty list if nothing was found."""
+
+        res = IndexResult()
+        for attr in self.cidr_indexes:
+            res.extend(self.search_attr(attr, value, max))
+            if max:
+                if len(res) >= max:
+                    res.truncate(max)
+                    return res
+        return res
+
+    def search_referral(self, value, max=0):
+        """Given a heirarchal value, search for referrals.  Returns a
+        list of object ids or an empty list."""
+
+        return self.search_attr("referred-auth-area", value, max)
+
+    # objects
+
+    def fetch_objects(self, id_list):
+        """Return the rwhoisobjects with the given (lowercase) ids, in
+        the same order, skipping any that don't exist."""
+        raise NotImplementedError
+
+    def object_iterator(self):
+        """Return an iterator over every object in the database."""
+        raise NotImplementedError
+
+    def object_count(self):
+        raise NotImplementedError
+
+    # statistics
+
+    def index_sizes(self):
+        """Return a dictionary of the number of entries in each
+        attribute's index, keyed by attribute name."""
+
+        return {}
+
+    def stats(self):
+        """Return a dictionary describing the database, for status
+        reports and benchmarks."""
+
+        return {
+            "backend": self.name,
+            "objects": self.object_count(),
+            "attributes": len(self.attrs),
+            "indexes": len(self.normal_indexes) + len(self.cidr_indexes),
+            "classes": len(self.classes),
+            "authority areas": len(self.authareas),
+        }
+
+
+class IndexResult:
+    def __init__(self, list=None):
+        if not list:
+            list = []
+        self.data = list
+        self._dict = dict(zip(self.data, self.data))
+
+    def __len__(self):
+        return len(self.data)
+
+    def extend(self, list):
+        if isinstance(list, type(self)):
+            list = list.list()
+        new_els = [x for x in list if x not in self._dict]
+        self.data.extend(new_els)
+        self._dict.update(dict(zip(new_els, new_els)))
+
+    def list(self):
+        return self.data
+
+    def truncate(self, n=0):
+        to_del = self.data[n:]
+        for i in to_del:
+            del self._dict[i]
+        self.data = self.data[:n]
+
+
+def get_backend(name=None):
+    """Return the module implementing the backend called 'name' (by
+    default, config.storage_backend)."""
+
+    if name is None:
+        name = config.storage_backend
+    return __import__(backends.get(name, name))
+
+
+def load(schema_file, data_files, startup=False, name=None):
+    """Build a database using the backend called 'name' (by default,
+    config.storage_backend) from a schema file and a list of data
+    files."""
+
+    return get_backend(name).load(schema_file, data_files, startup)
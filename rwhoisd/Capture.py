@@ -0,0 +1,132 @@
+# This file is part of python-rwhoisd
+#
+# Copyright (C) 2003, David E. Blacka
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+# This module records the query and directive lines of every session
+# to a capture file, for replaying later (see bench/replay.py).  The
+# file starts with a header line:
+#
+#   #rwhoisd-capture 1 <start time, in seconds since the epoch>
+#
+# followed by one tab separated line per event:
+#
+#   <seconds since the start>  <session number>  <event>  <text>
+#
+# where the event is "o" (a session opened; the text is the client
+# address), "l" (the client sent a line; the text is the line) or "c"
+# (the session closed).  The arguments of "secret=" are blanked out.
+# A restarted server appends to the same file, starting with a new
+# header; the session numbers and times start again after each one.
+# The lines are written by a LogWriter, so capturing never holds up a
+# session; lines that don't fit in its queue are dropped (and counted).
+
+import itertools
+import re
+import time
+
+import LogWriter
+import Stats
+
+version = 1
+
+_secret_exp = re.compile(r"(secret=)\S*", re.I)
+
+
+class Capture:
+    """A capture file being written."""
+
+    def __init__(self, filename):
+        self.writer = LogWriter.LogWriter(filename, "capture", 10000)
+        self.start = time.monotonic()
+        self.sessions = itertools.count(1)
+        self._put("#rwhoisd-capture %d %.3f\n" % (version, time.time()))
+
+    def _put(self, line):
+        if not self.writer.put(line):
+            Stats.count("capture dropped")
+
+    def _event(self, session_no, event, text=""):
+        self._put("%.4f\t%d\t%s\t%s\n" % (time.monotonic() - self.start, session_no, event, text))
+
+    def open(self, client_address):
+        """Record a new session, returning its session number."""
+
+        session_no = next(self.sessions)
+        self._event(session_no, "o", client_address and client_address[0] or "")
+        return session_no
+
+    def line(self, session_no, line):
+        if "secret=" in line.lower():
+            line = _secret_exp.sub(r"\1", line)
+        self._event(session_no, "l", line.replace("\t", " "))
+
+    def close(self, session_no):
+        self._event(session_no, "c")
+
+
+def read(filename):
+    """Read a capture file.  Returns a list of sessions, in the order
+    they started, each a dictionary with the keys "client", "start"
+    and "end" (in seconds since the start of the capture), and "lines"
+    (a list of (time, line) tuples).  If the file holds several
+    captures (one per server run), they are read one after the other:
+    the times of each continue from the last event of the one
+    before."""
+
+    def check_header(text):
+        header = text.split()
+        if len(header) < 2 or header[0] != "#rwhoisd-capture":
+            raise ValueError("%s is not a capture file" % filename)
+        if int(header[1]) > version:
+            raise ValueError("%s has an unsupported capture version %s" % (filename, header[1]))
+
+    f = open(filename)
+    check_header(f.readline())
+
+    res = []
+    # the sessions of the current capture, keyed by session number.
+    sessions = {}
+    # what is added to the times of the current capture, and the
+    # latest time seen so far.
+    base = last = 0.0
+    for text in f:
+        if text.startswith("#rwhoisd-capture"):
+            check_header(text)
+            sessions = {}
+            base = last
+            continue
+        fields = text.rstrip("\n").split("\t", 3)
+        if len(fields) < 3:
+            continue
+        t = base + float(fields[0])
+        last = max(last, t)
+        session_no = int(fields[1])
+        event = fields[2]
+        s = sessions.get(session_no)
+        if s is None:
+            # the capture may have dropped the open event.
+            s = sessions[session_no] = {"client": None, "start": t, "end": None, "lines": []}
+            res.append(s)
+        if event == "o":
+            s["client"] = len(fields) > 3 and fields[3] or None
+        elif event == "l" and len(fields) > 3:
+            s["lines"].append((t, fields[3]))
+        elif event == "c":
+            s["end"] = t
+    f.close()
+    return res
@@ -0,0 +1,413 @@
+# This file is part of python-rwhoisd
+#
+# Copyright (C) 2003, David E. Blacka
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+# This module reads rwhoisd-style data files (attr:value lines,
+# records separated by blank or "---" lines), which may be gzip, bzip2
+# or xz compressed.  Records are returned
+# as lists of (attr, value) tuples, which are cheap to build and to
+# pass between processes.
+
+
+import os
+import queue
+import sys
+import threading
+
+# the size of the blocks read from data files.
+block_size = 1024 * 1024
+
+# the number of decompressed blocks that may be waiting to be parsed.
+readahead_blocks = 4
+
+# compressed file formats: (file suffix, magic number, module name).
+compressors = [
+    (".gz", b"\x1f\x8b", "gzip"),
+    (".bz2", b"BZh", "bz2"),
+    (".xz", b"\xfd7zXZ\x00", "lzma"),
+]
+
+# cache of normalized attribute names, see normalize_attr().  It
+# stops growing at max_attr_names entries, so data with a great many
+# distinct attribute names can't make it grow without bound.
+_attr_names = {}
+max_attr_names = 10000
+
+
+def _is_boundary(line):
+    line = line.strip()
+    return not line or line.startswith(b"---")
+
+
+def normalize_attr(attr):
+    """Return the normalized (stripped, lowercase) form of an
+    attribute name.  The results are cached and interned, so every
+    object shares a single copy of each attribute name."""
+
+    res = _attr_names.get(attr)
+    if res is None:
+        res = sys.intern(attr.strip().lower())
+        if len(_attr_names) < max_attr_names:
+            _attr_names[attr] = res
+    return res
+
+
+def compression(filename):
+    """Return the name of the module that can decompress 'filename'
+    (based on its suffix or, failing that, its first few bytes), or
+    None if it isn't compressed."""
+
+    for suffix, magic, module in compressors:
+        if filename.endswith(suffix):
+            return module
+    f = open(filename, "rb")
+    head = f.read(8)
+    f.close()
+    for suffix, magic, module in compressors:
+        if head.startswith(magic):
+            return module
+    return None
+
+
+class DecompressingReader:
+    """A read-only file-like object that decompresses a file on a
+    separate thread, so that decompression overlaps with parsing.
+    read() returns the next decompressed block (of up to block_size
+    bytes), regardless of the size asked for, or b"" at the end."""
+
+    def __init__(self, filename, module):
+        self.filename = filename
+        self.queue = queue.Queue(readahead_blocks)
+        self.closed = False
+        self.done = False
+        self.thread = threading.Thread(target=self._run, args=(__import__(module),), name="decompress")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self, module):
+        try:
+            f = module.open(self.filename, "rb")
+            try:
+                while not self.closed:
+                    block = f.read(block_size)
+                    self.queue.put(block)
+                    if not block:
+                        break
+            finally:
+                f.close()
+        except Exception as e:
+            self.queue.put(e)
+
+    def read(self, size=-1):
+        if self.done:
+            return b""
+        block = self.queue.get()
+        if isinstance(block, Exception):
+            self.done = True
+            raise block
+        if not block:
+            self.done = True
+        return block
+
+    def seek(self, offset, whence=0):
+        if offset or whence:
+            raise OSError("%s: compressed data files can't be seeked" % self.filename)
+
+    def close(self):
+        self.closed = True
+        # unblock the decompression thread, if it is waiting.
+        while self.thread.is_alive():
+            try:
+                self.queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+def open_data_file(filename):
+    """Open a data file for reading in binary mode, transparently
+    decompressing it if necessary."""
+
+    module = compression(filename)
+    if module:
+        return DecompressingReader(filename, module)
+    return open(filename, "rb")
+
+
+def read_blocks(f, start=0, end=None):
+    """Read the open binary file 'f' in large blocks, starting at byte
+    'start' and stopping at byte 'end' (if given), yielding the text
+    of each block.  Blocks are cut at line boundaries, and the last
+    one always ends with a newline."""
+
+    if start:
+        f.seek(start)
+    remaining = None
+    if end is not None:
+        remaining = end - start
+
+    buf = b""
+    while True:
+        if remaining is None:
+            block = f.read(block_size)
+        else:
+            block = f.read(min(block_size, remaining))
+            remaining -= len(block)
+
+        if not block:
+            if buf:
+                if not buf.endswith(b"\n"):
+                    buf += b"\n"
+                yield buf.decode("utf-8", "replace")
+            return
+
+        buf += block
+        nl = buf.rfind(b"\n")
+        if nl >= 0:
+            yield buf[: nl + 1].decode("utf-8", "replace")
+            buf = buf[nl + 1 :]
+
+
+def read_records(filename, start=0, end=None):
+    """Read the records in 'filename', yielding each one as a list of
+    (attribute, value) tuples.  Attribute names are not normalized
+    (see normalize_attr()).  If 'start' and 'end' are given, only the
+    records in that byte range are read; both must fall on record
+    boundaries (see split_ranges()).  Malformed lines are reported on
+    stderr, with their file name and line number, and otherwise
+    ignored."""
+
+    # The file is read in large blocks and each block split into
+    # lines in one go.  Most lines are plain "attr: value" lines, so
+    # those are picked out with as little work as possible, and
+    # everything else gets the careful treatment.
+
+    f = open_data_file(filename)
+    # the line number of the start of the range.  This is only worked
+    # out if it is needed to report a malformed line.
+    base = None
+    if start == 0:
+        base = 1
+
+    try:
+        rec = []
+        # the number of lines read so far, counting from 0.
+        n = -1
+        for text in read_blocks(f, start, end):
+            lines = text.split("\n")
+            # the text ends in a newline, so the last "line" is empty.
+            lines.pop()
+            for line in lines:
+                n += 1
+                a, sep, v = line.partition(":")
+                if sep and a[:1] not in "#- \t":
+                    rec.append((a, v.strip()))
+                    continue
+
+                line = line.strip()
+                if line.startswith("#"):
+                    continue
+                if not line or line.startswith("---"):
+                    # we've reached the end of a record.
+                    if rec:
+                        yield rec
+                        rec = []
+                    continue
+                a, sep, v = line.partition(":")
+                if sep:
+                    rec.append((a, v.lstrip()))
+                    continue
+
+                if base is None:
+                    base = _line_base(filename, start)
+                sys.stderr.write("%s:%d: malformed line ignored: %r\n" % (filename, base + n, line))
+
+        if rec:
+            yield rec
+    finally:
+        f.close()
+
+
+def parse_record(text, filename=None, lineno=1):
+    """Parse the text of a single record into a list of (attribute,
+    value) tuples, the same way read_records() does.  If 'filename'
+    is given, malformed lines are reported on stderr as being in
+    that file, counting lines from 'lineno'."""
+
+    rec = []
+    for i, line in enumerate(text.split("\n")):
+        a, sep, v = line.partition(":")
+        if sep and a[:1] not in "#- \t":
+            rec.append((a, v.strip()))
+            continue
+
+        line = line.strip()
+        if not line or line.startswith("#") or line.startswith("---"):
+            continue
+        a, sep, v = line.partition(":")
+        if sep:
+            rec.append((a, v.lstrip()))
+        elif filename:
+            sys.stderr.write("%s:%d: malformed line ignored: %r\n" % (filename, lineno + i, line))
+    return rec
+
+
+def read_record_spans(filename):
+    """Read the records in the (uncompressed) file 'filename',
+    yielding (start, end, record) tuples, where start and end are the
+    byte offsets of the record's text in the file.  The record can be
+    read again later with read_record_at()."""
+
+    f = open(filename, "rb")
+    try:
+        # the lines of the current record, and where it starts.
+        cur = []
+        start = start_line = 0
+        pos = lineno = 0
+        buf = b""
+        while True:
+            block = f.read(block_size)
+            if block:
+                buf += block
+                lines = buf.split(b"\n")
+                buf = lines.pop()
+            else:
+                # the last line might not end with a newline.
+                lines = buf and [buf] or []
+
+            for line in lines:
+                lineno += 1
+                if _is_boundary(line):
+                    if cur:
+                        rec = parse_record(b"\n".join(cur).decode("utf-8", "replace"), filename, start_line)
+                        if rec:
+                            yield start, pos, rec
+                        cur = []
+                else:
+                    if not cur:
+                        start, start_line = pos, lineno
+                    cur.append(line)
+                pos += len(line) + 1
+
+            if not block:
+                break
+
+        if cur:
+            rec = parse_record(b"\n".join(cur).decode("utf-8", "replace"), filename, start_line)
+            if rec:
+                yield start, pos, rec
+    finally:
+        f.close()
+
+
+def read_record_at(f, start, end):
+    """Read the record between byte offsets 'start' and 'end' of the
+    open binary file 'f', as found by read_record_spans().  This
+    doesn't move the file position, so it is safe to use from
+    several threads at once."""
+
+    return parse_record(os.pread(f.fileno(), end - start, start).decode("utf-8", "replace"))
+
+
+def _line_base(filename, start):
+    """Return the line number of the line starting at byte 'start'."""
+
+    f = open(filename, "rb")
+    n = 1
+    while start > 0:
+        block = f.read(min(block_size, start))
+        if not block:
+            break
+        n += block.count(b"\n")
+        start -= len(block)
+    f.close()
+    return n
+
+
+def split_ranges(filename, chunk_size):
+    """Split 'filename' into (filename, start, end) byte ranges of
+    roughly 'chunk_size' bytes, each starting and ending on a record
+    boundary.  Compressed files can't be split, and are returned as a
+    single range."""
+
+    if compression(filename):
+        return [(filename, 0, None)]
+
+    f = open(filename, "rb")
+    f.seek(0, 2)
+    size = f.tell()
+
+    ranges = []
+    start = 0
+    while start < size:
+        pos = start + chunk_size
+        if pos >= size:
+            ranges.append((filename, start, size))
+            break
+        # skip ahead to the end of the next boundary line.
+        f.seek(pos)
+        f.readline()
+        while True:
+            line = f.readline()
+            if not line or _is_boundary(line):
+                break
+        end = f.tell()
+        ranges.append((filename, start, end))
+        start = end
+    f.close()
+    return ranges
+
+
+def parse_range(r):
+    """Parse one (filename, start, end) range, returning the list of
+    its records.  This is the worker side of parse_files()."""
+
+    filename, start, end = r
+    return list(read_records(filename, start, end))
+
+
+def parse_files(filenames, workers, chunk_size):
+    """Parse 'filenames' using a pool of 'workers' processes, each
+    file having been split into ranges of about 'chunk_size' bytes.
+    Yields (filename, records) batches, in file order, so the records
+    arrive in exactly the order a serial read would produce."""
+
+    import multiprocessing
+
+    ranges = []
+    for fn in filenames:
+        ranges.extend(split_ranges(fn, chunk_size))
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        for r, batch in zip(ranges, pool.imap(parse_range, ranges)):
+            yield r[0], batch
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+# test driver
+if __name__ == "__main__":
+
+    for fn in sys.argv[1:]:
+        serial = list(read_records(fn))
+        ranges = split_ranges(fn, 256)
+        chunked = [x for r in ranges for x in parse_range(r)]
+        print("%s: %d records, %d ranges, chunked read matches: %s" % (fn, len(serial), len(ranges), serial == chunked))
+        parallel = [x for fn, batch in parse_files([fn], 2, 256) for x in batch]
+        print("%s: parallel read matches: %s" % (fn, serial == parallel))
@@ -17,18 +17,31 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
 # USA
 
+import hmac
 import re
+import threading
+import time
 
 import config
+import Profiler
 import Rwhois
+import Session
+import Stats
 
 
 class DirectiveProcessor:
 
     rwhois_dir_exp = re.compile(r"V-(\d+\.\d+)", re.I)
 
-    def __init__(self, db):
+    def __init__(self, db, reload_hook=None):
         self.db = db
+        # a callable that starts a database reload, returning False
+        # if one is already in progress.
+        self.reload_hook = reload_hook
+        # the last memory report, as a (time, lines) tuple, and the
+        # lock held while one is being made (see memory_directive()).
+        self.memory_report = None
+        self.memory_lock = threading.Lock()
         self.directives = {
             "rwhois": self.rwhois_directive,
             "limit": self.limit_directive,
@@ -36,25 +49,56 @@ class DirectiveProcessor:
             "directive": self.directive_directive,
             "xfer": self.xfer_directive,
             "status": self.status_directive,
+            "reload": self.reload_directive,
+            "stats": self.stats_directive,
+            "profile": self.profile_directive,
+            "memory": self.memory_directive,
         }
 
+    def write_error(self, session, error):
+        """Send an error response (see Rwhois.error_message()), and
+        count it in the statistics."""
+
+        code, msg = Rwhois.parse_error(error)
+        Stats.count("error %d" % code)
+        session.wfile.write(Rwhois.error_message((code, msg)))
+
     def process_directive(self, session, line):
         d_args = line.lstrip("-").split()
 
         if d_args[0] not in self.directives:
-            session.wfile.write(Rwhois.error_message(400))
+            Stats.count("directive unknown")
+            self.write_error(session, 400)
             return
 
+        Stats.count("directive " + d_args[0])
         self.directives[d_args[0]](session, d_args[1:])
 
+    def is_admin(self, session):
+        """Returns True if the session is allowed to use the
+        administrative directives.  Sessions without a client address
+        are local to the process (e.g., the test drivers)."""
+
+        if not session.client_address:
+            return True
+        return session.client_address[0] in config.admin_addresses
+
+    def check_secret(self, secret):
+        """Returns True if 'secret' (the argument of "secret=", or
+        None) matches config.admin_secret, or no secret is needed."""
+
+        if not config.admin_secret:
+            return True
+        return hmac.compare_digest(secret or "", config.admin_secret)
+
     def rwhois_directive(self, session, arglist):
         if not arglist:
-            session.wfile.write(Rwhois.error_message(338))
+            self.write_error(session, 338)
             return
 
         mo = DirectiveProcessor.rwhois_dir_exp.match(arglist[0])
         if not mo:
-            session.wfile.write(Rwhois.error_message(338))
+            self.write_error(session, 338)
             return
 
         # normally we would make sure that the version given was
@@ -67,7 +111,7 @@ class DirectiveProcessor:
         try:
             limit = int(arglist[0])
         except (IndexError, ValueError):
-            session.wfile.write(Rwhois.error_message(338))
+            self.write_error(session, 338)
             return
 
         if limit > config.max_limit:
@@ -80,7 +124,7 @@ class DirectiveProcessor:
 
     def hold_directive(self, session, arglist):
         if not arglist:
-            session.wfile.write(Rwhois.error_message(338))
+            self.write_error(session, 338)
             return
 
         arg = arglist[0].lower()
@@ -89,7 +133,7 @@ class DirectiveProcessor:
         elif arg == "off":
             session.holdconnect = False
         else:
-            session.wfile.write(Rwhois.error_message(338))
+            self.write_error(session, 338)
             return
 
         session.wfile.write(Rwhois.ok())
@@ -112,7 +156,7 @@ class DirectiveProcessor:
             session.wfile.write("%%directive directive:%s\r\n" % dir)
             session.wfile.write("%%directive description:%s directive\r\n" % desc)
         else:
-            session.wfile.write(Rwhois.error_message(400))
+            self.write_error(session, 400)
             return
         session.wfile.write(Rwhois.ok())
 
@@ -125,14 +169,172 @@ class DirectiveProcessor:
         session.wfile.write("%%status limit: %d\r\n" % session.limit)
         session.wfile.write("%%status holdconnect: %s\r\n" % hc_str)
         session.wfile.write("%status forward: off\r\n")
-        session.wfile.write("%%status objects: %d\r\n" % len(self.db.main_index))
+        session.wfile.write("%%status objects: %d\r\n" % self.db.object_count())
         session.wfile.write("%status display: dump\r\n")
         session.wfile.write("%status contact: N/A\r\n")
         session.wfile.write(Rwhois.ok())
 
+    def reload_directive(self, session, arglist):
+        if not self.is_admin(session):
+            self.write_error(session, 401)
+            return
+        if not self.reload_hook:
+            self.write_error(session, 400)
+            return
+
+        if not self.reload_hook():
+            self.write_error(session, (402, "reload already in progress"))
+            return
+        session.wfile.write(Rwhois.ok())
+
+    def stats_directive(self, session, arglist):
+        """Report the server's counters, session slot usage, database
+        statistics, and (if config.query_timing is on) query latency
+        percentiles, as "%stats name: value" lines."""
+
+        if not self.is_admin(session):
+            self.write_error(session, 401)
+            return
+
+        res = [("uptime", "%d" % (time.time() - Stats.started))]
+        counters = Stats.counters()
+        res.append(("queries", counters.pop("queries", 0)))
+        for name, n in sorted(counters.items()):
+            res.append((name.replace(" ", "-"), n))
+        for name, n in sorted(Session.slots.usage().items()):
+            res.append(("sessions-" + name, n))
+
+        db_stats = self.db.stats()
+        for name, v in sorted(db_stats.items()):
+            res.append(("db-" + name.replace(" ", "-"), v))
+        hits = db_stats.get("object cache hits", 0)
+        lookups = hits + db_stats.get("object cache misses", 0)
+        if lookups:
+            res.append(("db-object-cache-hit-ratio", "%.4f" % (float(hits) / lookups)))
+        for attr, n in sorted(self.db.index_sizes().items()):
+            res.append(("index-" + attr, n))
+
+        if Stats.timing:
+            for phase, h in sorted(Stats.phase_histograms().items(), key=lambda x: Stats.phases.index(x[0])):
+                res.append(
+                    (
+                        "latency-" + phase,
+                        "count=%d mean=%.3f p50=%.3f p90=%.3f p99=%.3f max=%.3f"
+                        % (
+                            h.count,
+                            h.mean() * 1000,
+                            h.percentile(50) * 1000,
+                            h.percentile(90) * 1000,
+                            h.percentile(99) * 1000,
+                            h.max * 1000,
+                        ),
+                    )
+                )
+        else:
+            res.append(("query-timing", "off"))
+
+        for name, v in res:
+            session.wfile.write("%%stats %s: %s\r\n" % (name, v))
+        session.wfile.write(Rwhois.ok())
+
+    def profile_directive(self, session, arglist):
+        """Start profiling the server (see Profiler.py).  The
+        arguments are the kind of profile ("sample" or "cprofile"),
+        and "seconds=<n>" or "queries=<n>"; "-profile stop" stops the
+        profile in progress early.  If config.admin_secret is set,
+        "secret=<admin_secret>" must be given too."""
+
+        if not self.is_admin(session):
+            self.write_error(session, 401)
+            return
+
+        kind = config.profile_mode
+        seconds = queries = None
+        secret = None
+        stop = False
+        try:
+            for arg in arglist:
+                name, eq, value = arg.partition("=")
+                if not eq and arg.lower() in Profiler.kinds:
+                    kind = arg.lower()
+                elif not eq and arg.lower() == "stop":
+                    stop = True
+                elif name == "seconds":
+                    seconds = float(value)
+                elif name == "queries":
+                    queries = int(value)
+                elif name == "secret":
+                    secret = value
+                else:
+                    raise ValueError(arg)
+        except ValueError:
+            self.write_error(session, 338)
+            return
+
+        if not self.check_secret(secret):
+            self.write_error(session, 401)
+            return
+
+        if stop:
+            Profiler.stop()
+            session.wfile.write(Rwhois.ok())
+            return
+        run = Profiler.start(kind, seconds, queries)
+        if run is None:
+            self.write_error(session, (402, "profile already in progress"))
+            return
+        session.wfile.write("%%profile kind: %s\r\n" % run.kind)
+        session.wfile.write("%%profile file: %s\r\n" % run.filename)
+        session.wfile.write(Rwhois.ok())
+
+    def memory_directive(self, session, arglist):
+        """Report where the database's memory goes (see MemReport.py),
+        as "%memory" lines.  Measuring walks every object in the
+        database, which takes a while on a large one and slows every
+        other session down, so only one report is made at a time, and
+        a report less than config.memory_report_interval seconds old
+        is given again rather than made afresh."""
+
+        if not self.is_admin(session):
+            self.write_error(session, 401)
+            return
+        secret = None
+        for arg in arglist:
+            name, eq, value = arg.partition("=")
+            if name != "secret" or not eq:
+                self.write_error(session, 338)
+                return
+            secret = value
+        if not self.check_secret(secret):
+            self.write_error(session, 401)
+            return
+        if self.db.name != "memory":
+            self.write_error(session, (402, "only the memory backend can be measured"))
+            return
+
+        report = self.memory_report
+        if report is None or time.time() - report[0] >= config.memory_report_interval:
+            if not self.memory_lock.acquire(False):
+                self.write_error(session, (402, "memory report in progress"))
+                return
+            try:
+                import MemReport
+
+                parts, sizer = MemReport.report(self.db)
+                report = self.memory_report = (time.time(), MemReport.format_report(parts, sizer))
+            finally:
+                self.memory_lock.release()
+
+        made, lines = report
+        session.wfile.write("%%memory made: %s\r\n" % time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(made)))
+        for line in lines:
+            session.wfile.write(("%%memory %s" % line).rstrip())
+            session.wfile.write("\r\n")
+        session.wfile.write(Rwhois.ok())
+
     def xfer_directive(self, session, arglist):
         if not arglist:
-            session.wfile.write(Rwhois.error_message(338))
+            self.write_error(session, 338)
             return
 
         aa = arglist[0].lower()
@@ -149,15 +351,15 @@ class DirectiveProcessor:
 
         # check the constraints
         if not self.db.is_autharea(aa):
-            session.wfile.write(Rwhois.error_message((340, aa)))
+            self.write_error(session, (340, aa))
             return
         if oc and not self.db.is_objectclass(oc):
-            session.wfile.write(Rwhois.error_message((341, oc)))
+            self.write_error(session, (341, oc))
             return
 
         for attr in attr_list:
             if not self.db.is_attribute(attr):
-                session.wfile.write(Rwhois.error_message((342, attr)))
+                self.write_error(session, (342, attr))
                 return
 
         # now iterate over the entire dataset looking for objects that
@@ -166,6 +368,7 @@ class DirectiveProcessor:
         objs = self.db.object_iterator()
 
         for obj in objs:
+            session.check_deadline()
             # Note: in theory, we should leverage QueryProcessors
             # filtering code.
             if obj.get_attr_value("auth-area").lower() != aa:
@@ -220,6 +423,7 @@ if __name__ == "__main__":
         "-xfer foo class=bar",
         "-xfer foo class=bar attribute=baz attribute=boo",
         "-foo baz bar",
+        "-stats",
     ]
 
     for dir in directives:
@@ -0,0 +1,72 @@
+# This file is part of python-rwhoisd
+#
+# Copyright (C) 2003, David E. Blacka
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+# This module contains a log file writer that doesn't block its
+# callers: lines are handed to a writer thread through a bounded
+# queue, so a slow disk never holds up a query.  If the queue is full,
+# the line is dropped instead.
+
+import queue
+import sys
+import threading
+
+
+class LogWriter:
+    """A thread appending the lines put on its queue to a file (or to
+    stdout, if 'filename' is None).  The file is opened here, so a
+    file that can't be written raises OSError to the caller rather
+    than failing in the thread."""
+
+    def __init__(self, filename=None, name="log", queue_size=1000):
+        self.filename = filename
+        self.name = name
+        if filename:
+            self.file = open(filename, "a")
+        else:
+            self.file = sys.stdout
+        self.queue = queue.Queue(queue_size)
+        self.thread = threading.Thread(target=self.run, name=name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, line):
+        """Queue 'line' (which should end with a newline) to be
+        written.  Returns False if it had to be dropped."""
+
+        try:
+            self.queue.put_nowait(line)
+        except queue.Full:
+            return False
+        return True
+
+    def run(self):
+        f = self.file
+        while True:
+            lines = [self.queue.get()]
+            # write whatever else has piled up in one go.
+            try:
+                while True:
+                    lines.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            try:
+                f.write("".join(lines))
+                f.flush()
+            except (OSError, ValueError) as e:
+                print("%s: write failed: %s" % (self.name, e))
@@ -16,12 +16,33 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
 # USA
+import collections
+import copy
+import hashlib
+import itertools
+import json
+import os
+import sys
+import threading
+from urllib.parse import quote
+
+import Backend
 import Cidr
+import config
+import DataFile
 import MemIndex
+import MmapIndex
+import Startup
+from Backend import IndexResult
 from Rwhois import rwhoisobject
 
 
-class MemDB:
+class MemDB(Backend.Backend):
+    """The default backend, which holds the objects and the attribute
+    indexes in memory."""
+
+    name = "memory"
+
     def __init__(self):
 
         # a dictonary holding the various attribute indexes.  The keys
@@ -30,7 +51,9 @@ class MemDB:
         self.indexes = {}
 
         # a dictonary holding the actual rwhoisobjects.  keys are
-        # string IDs, values are rwhoisobject instances.
+        # string IDs, values are rwhoisobject instances, or (if lazy
+        # is True) (file number, start, end) tuples locating the
+        # object's record in one of lazy_files.
         self.main_index = {}
 
         # dictionary holding all of the seen attributes.  keys are
@@ -54,6 +77,37 @@ class MemDB:
         # lowercase authority area names, value is always None.
         self.authareas = {}
 
+        # dictionary holding a fingerprint of each object's contents,
+        # used to find changed objects on reload.  keys are the same
+        # as main_index, values are SHA-1 digests.  Fingerprints are
+        # only kept if update_data() can be used (see can_update()).
+        self.fingerprints = {}
+
+        # dictionary describing each data file loaded.  keys are file
+        # names, values are (stamp, ids) tuples, where stamp is
+        # file_stamp() of the file when loaded, and ids is the set of
+        # object IDs it contained.
+        self.data_files = {}
+        self.schema_stamp = None
+
+        # True if the attribute indexes are read-only index files
+        # (see open_indexes()), rather than in-memory maps.
+        self.indexes_mapped = False
+
+        # True if objects are read from the data files on demand,
+        # rather than held in memory (see config.lazy_objects).  The
+        # data files are kept open, so that a reader always sees the
+        # file it was loaded from, even if it has since been
+        # replaced.
+        self.lazy = config.lazy_objects
+        self.lazy_files = []
+        self.object_cache = ObjectCache(config.object_cache_size)
+
+        # True if objects are fingerprinted as they are added.  A lazy
+        # database, or one whose indexes will be mapped from index
+        # files, can't be updated incrementally.
+        self.fingerprinted = config.incremental_reload and not self.lazy and not config.index_dir
+
     def init_schema(self, schema_file):
         """Initialize the schema from a schema file.  Currently the
         schema file is a list of 'attribute_name = index_type' pairs,
@@ -66,23 +120,8 @@ class MemDB:
         different authority area are actually autonomous and thus have
         separate schemas."""
 
-        # initialize base schema
-
-        self.attrs["id"] = "N"
-        self.attrs["auth-area"] = None
-        self.attrs["class-name"] = None
-        self.attrs["updated"] = None
-        self.attrs["referred-auth-area"] = "R"
-
-        sf = open(schema_file)
-
-        for line in sf:
-            line = line.strip()
-            if not line or line.startswith("#"):
-                continue
-
-            attr, it = line.split("=")
-            self.attrs[attr.strip().lower()] = it.strip()[0].upper()
+        self.schema_stamp = file_stamp(schema_file)
+        self.attrs.update(read_schema(schema_file))
 
         for attr, index_type in self.attrs.items():
             if index_type == "N":
@@ -104,9 +143,10 @@ class MemDB:
                 self.cidr_indexes.append(attr)
         return
 
-    def add_object(self, obj):
+    def add_object(self, obj, ref=None):
         """Add an rwhoisobject to the raw indexes, including the
-        master index."""
+        master index.  If 'ref' is given, it is stored in the master
+        index in place of the object (see lazy)."""
 
         # add the object to the main index
         id = obj.getid()
@@ -114,7 +154,14 @@ class MemDB:
             return
         id = id.lower()
 
-        self.main_index[id] = obj
+        if ref:
+            self.main_index[id] = ref
+        else:
+            self.main_index[id] = obj
+            if self.fingerprinted:
+                self.fingerprints[id] = fingerprint(obj)
+            if config.prerender_objects:
+                obj.prerender()
 
         for a, v in obj.items():
             # note the attribute.
@@ -126,33 +173,206 @@ class MemDB:
             elif a == "class-name":
                 self.classes.setdefault(v, None)
 
-            if index_type:
+            if index_type and not self.indexes_mapped:
                 index = self.indexes[a]
                 index.add(v, id)
 
+    def remove_object(self, id):
+        """Remove the object with the given ID from the master index
+        and the attribute indexes.  Returns the removed object, or
+        None if there was no such object."""
+
+        id = id.lower()
+        obj = self.main_index.get(id)
+        if isinstance(obj, tuple):
+            obj = self._materialize(id, obj)
+        self.main_index.pop(id, None)
+        if not obj:
+            return None
+        self.fingerprints.pop(id, None)
+
+        if self.indexes_mapped:
+            return obj
+        for a, v in obj.items():
+            if self.attrs.get(a):
+                self.indexes[a].remove(v.lower(), id)
+        return obj
+
+    def _load_objects(self, data_file, objs):
+        """Add the rwhoisobjects in 'objs', read from 'data_file', and
+        note which IDs came from that file."""
+
+        stamp = file_stamp(data_file)
+        stamp, ids = self.data_files.setdefault(data_file, (stamp, set()))
+        add_object = self.add_object
+        if Startup.current:
+            add_object = Startup.current.timed("add_object", add_object)
+        for obj in objs:
+            add_object(obj)
+            id = obj.getid()
+            if id:
+                ids.add(id.lower())
+
     def load_data(self, data_file):
         """Load data from rwhoisd-style TXT files (i.e., attr:value,
         records separated with a "---" bare line)."""
 
-        df = open(data_file)
-        obj = rwhoisobject()
+        self.data_files.pop(data_file, None)
+        if self.lazy and not DataFile.compression(data_file):
+            self._load_lazy(data_file)
+            return
+        self._load_objects(data_file, read_objects(data_file))
+        return
 
-        for line in df:
-            line = line.strip()
-            if line.startswith("#"):
-                continue
-            if not line or line.startswith("---"):
-                # we've reached the end of an object, so index it.
-                self.add_object(obj)
-                # reset obj
-                obj = rwhoisobject()
-                continue
+    def _load_lazy(self, data_file):
+        """Load 'data_file', keeping only the location of each
+        object's record in the master index."""
+
+        file_no = len(self.lazy_files)
+        self.lazy_files.append(open(data_file, "rb"))
+        ids = set()
+        self.data_files[data_file] = (file_stamp(data_file), ids)
+        add_object = self.add_object
+        if Startup.current:
+            add_object = Startup.current.timed("add_object", add_object)
+        for start, end, rec in DataFile.read_record_spans(data_file):
+            obj = record_to_object(rec)
+            add_object(obj, (file_no, start, end))
+            id = obj.getid()
+            if id:
+                ids.add(id.lower())
+
+    def _materialize(self, id, ref):
+        """Return the object with the id 'id', reading it from its
+        data file (see lazy) if it isn't in the object cache."""
+
+        obj = self.object_cache.get(id)
+        if obj:
+            return obj
+        obj = self._read_object(id, ref)
+        if obj:
+            self.object_cache.put(id, obj)
+        return obj
+
+    def _read_object(self, id, ref):
+        """Read the object with the id 'id' from its data file (see
+        lazy), bypassing the object cache."""
+
+        file_no, start, end = ref
+        obj = record_to_object(DataFile.read_record_at(self.lazy_files[file_no], start, end))
+        if (obj.getid() or "").lower() != id:
+            # the file has been changed in place since it was loaded.
+            sys.stderr.write("%s: object %s has moved, reload needed\n" % (self.lazy_files[file_no].name, id))
+            return None
+        return obj
+
+    def load_data_files(self, data_files, workers=None):
+        """Load a list of data files.  If 'workers' (by default,
+        config.load_workers) is more than one, the files are parsed
+        in that many processes, and the results merged here in file
+        order, giving the same database as loading them one by
+        one."""
+
+        if workers is None:
+            workers = config.load_workers
+        if workers <= 1 or self.lazy:
+            for df in data_files:
+                with Startup.phase("load_data " + os.path.basename(df)) as p:
+                    n = len(self.main_index)
+                    self.load_data(df)
+                    p["records"] = len(self.main_index) - n
+            return
 
-            a, v = line.split(":", 1)
-            obj.add_attr(a, v.lstrip())
+        for df in data_files:
+            self.data_files.pop(df, None)
+        # the batches arrive in file order, so each file gets a phase
+        # of its own.  The files are parsed in parallel, so a file's
+        # phase is the time spent merging it here, including any wait
+        # for the workers.
+        batches = DataFile.parse_files(data_files, workers, config.load_chunk_size)
+        for df, file_batches in itertools.groupby(batches, lambda x: x[0]):
+            with Startup.phase("load_data %s (%d workers)" % (os.path.basename(df), workers)) as p:
+                n = len(self.main_index)
+                for _, batch in file_batches:
+                    self._load_objects(df, [record_to_object(x) for x in batch])
+                p["records"] = len(self.main_index) - n
+
+    def can_update(self, schema_file):
+        if not self.fingerprinted or self.indexes_mapped:
+            return False
+        return self.schema_stamp == file_stamp(schema_file)
+
+    def copy(self):
+        """Return a copy of the database for update_data().  The
+        dictionaries and indexes are copied, so the update is not seen
+        by queries running against this database; the objects
+        themselves are shared."""
+
+        db = copy.copy(self)
+        db.indexes = dict([(attr, index.copy()) for attr, index in self.indexes.items()])
+        db.main_index = dict(self.main_index)
+        db.fingerprints = dict(self.fingerprints)
+        db.data_files = dict(self.data_files)
+        db.attrs = dict(self.attrs)
+        db.classes = dict(self.classes)
+        db.authareas = dict(self.authareas)
+        db.normal_indexes = self.normal_indexes[:]
+        db.cidr_indexes = self.cidr_indexes[:]
+        return db
+
+    def update_data(self, data_files):
+        """Bring the database up to date with 'data_files', applying
+        only the differences from what is currently loaded.  Files
+        whose size and modification time haven't changed are not
+        read at all.  Returns an (added, changed, removed) tuple of
+        object counts."""
+
+        # sort the files into unchanged, changed and dropped.
+        kept_ids = set()
+        old_ids = set()
+        changed_files = []
+        for df in data_files:
+            stamp = file_stamp(df)
+            if df in self.data_files and self.data_files[df][0] == stamp:
+                kept_ids.update(self.data_files[df][1])
+            else:
+                changed_files.append((df, stamp))
+        keep = set(data_files) - set([x[0] for x in changed_files])
+        for df in list(self.data_files.keys()):
+            if df not in keep:
+                old_ids.update(self.data_files.pop(df)[1])
+
+        # read the changed files.
+        new_objs = {}
+        for df, stamp in changed_files:
+            ids = set()
+            for obj in read_objects(df):
+                id = obj.getid()
+                if not id:
+                    continue
+                id = id.lower()
+                ids.add(id)
+                new_objs[id] = obj
+            self.data_files[df] = (stamp, ids)
+
+        # apply the differences.
+        removed = old_ids - kept_ids - set(new_objs.keys())
+        for id in removed:
+            self.remove_object(id)
+
+        added = changed = 0
+        for id, obj in new_objs.items():
+            old_fp = self.fingerprints.get(id)
+            if old_fp is None:
+                added += 1
+            elif old_fp == fingerprint(obj):
+                continue
+            else:
+                self.remove_object(id)
+                changed += 1
+            self.add_object(obj)
 
-        self.add_object(obj)
-        return
+        return (added, changed, len(removed))
 
     def index_data(self):
         """Prepare the indexes for searching.  Currently, this isn't
@@ -164,37 +384,83 @@ class MemDB:
             i.prepare()
         return
 
-    def is_attribute(self, attr):
-        return attr.lower() in self.attrs
-
-    def is_indexed_attr(self, attr):
-        if self.is_attribute(attr):
-            return self.attrs[attr.lower()]
-        return False
-
-    def is_objectclass(self, objectclass):
-        return objectclass.lower() in self.classes
-
-    def is_autharea(self, aa):
-        return aa.lower() in self.authareas
-
-    def get_authareas(self):
-        return self.authareas.keys()
+    def _index_basename(self, index_dir, attr):
+        return os.path.join(index_dir, quote(attr, safe=""))
+
+    def _index_manifest(self, data_files):
+        # what the index files were built from.  This goes through
+        # json, so the comparison in open_indexes() sees lists, not
+        # tuples.
+        stamps = [[df] + list(file_stamp(df)) for df in data_files]
+        return json.loads(json.dumps({"schema": self.schema_stamp, "data": stamps}))
+
+    def save_indexes(self, index_dir, data_files):
+        """Write the attribute indexes to index files in 'index_dir'
+        (see the MmapIndex module), along with a manifest recording
+        the schema and data files they were built from."""
+
+        if not os.path.isdir(index_dir):
+            os.makedirs(index_dir)
+        for attr, index in self.indexes.items():
+            MmapIndex.save_index(self._index_basename(index_dir, attr), index)
+
+        manifest = os.path.join(index_dir, "MANIFEST")
+        f = open(manifest + ".new", "w")
+        json.dump(self._index_manifest(data_files), f)
+        f.close()
+        os.replace(manifest + ".new", manifest)
+
+    def open_indexes(self, index_dir, data_files):
+        """Replace the attribute indexes with the index files in
+        'index_dir', if they were built from the current schema and
+        'data_files'.  Returns True if they were opened.  Once this
+        is done, objects can still be added, but the indexes won't
+        change, so it must be done before or after loading the same
+        data files."""
+
+        try:
+            f = open(os.path.join(index_dir, "MANIFEST"))
+            manifest = json.load(f)
+            f.close()
+        except (OSError, ValueError):
+            return False
+        if manifest != self._index_manifest(data_files):
+            return False
+
+        indexes = {}
+        try:
+            for attr in self.indexes:
+                indexes[attr] = MmapIndex.open_index(self._index_basename(index_dir, attr), self.attrs[attr])
+        except (OSError, ValueError):
+            return False
+        self.indexes = indexes
+        self.indexes_mapped = True
+        return True
 
     def fetch_objects(self, id_list):
-        return [self.main_index[x] for x in id_list if x in self.main_index]
+        if not self.lazy:
+            return [self.main_index[x] for x in id_list if x in self.main_index]
+
+        res = []
+        for id in id_list:
+            obj = self.main_index.get(id)
+            if isinstance(obj, tuple):
+                obj = self._materialize(id, obj)
+            if obj:
+                res.append(obj)
+        return res
 
     def search_attr(self, attr, value, max=0):
         """Search for a value in a particular attribute's index.  If
         the attribute is cidr indexed, an attempt to convert value
-        into a Cidr object will be made.  Returns a list of object ids
-        (or an empty list if nothing was found)"""
+        into a Cidr object will be made.  Returns an IndexResult of
+        object ids (which is empty if nothing was found)"""
 
         attr = attr.lower()
         index_type = self.attrs.get(attr)
         index = self.indexes.get(attr)
         if not index:
-            return []
+            return IndexResult()
 
         super_prefix_match = False
         if value.endswith("**"):
@@ -207,78 +473,174 @@ class MemDB:
 
         if index_type == "C" and not isinstance(value, Cidr.Cidr):
             value = Cidr.valid_cidr(value)
+            if not value:
+                return IndexResult()
         else:
             value = value.strip().lower()
 
         if index_type == "C" and super_prefix_match:
-            return index.find_subnets(value, max)
+            return IndexResult(index.find_subnets(value, max))
 
         res = index.find(value, prefix_match, max)
         return IndexResult(res)
 
-    def search_normal(self, value, max=0):
-        """Search for a value in the 'normal' (string keyed) indexes.
-        Returns a list of object ids, or an empty list if nothing was
-        found."""
+    def object_iterator(self):
+        if not self.lazy:
+            return self.main_index.itervalues()
+        return self._lazy_object_iterator()
+
+    def _lazy_object_iterator(self):
+        """Yield every object, reading each from its data file in turn.
+        The object cache is bypassed, so a walk over the whole
+        database (e.g., -xfer) neither holds every object in memory
+        nor pushes the objects queries use out of the cache."""
+
+        for id, obj in self.main_index.items():
+            if isinstance(obj, tuple):
+                obj = self._read_object(id, obj)
+            if obj:
+                yield obj
+
+    def object_count(self):
+        return len(self.main_index)
+
+    def index_sizes(self):
+        return dict([(attr, len(index)) for attr, index in self.indexes.items()])
+
+    def stats(self):
+        res = Backend.Backend.stats(self)
+        res["index entries"] = sum([len(x) for x in self.indexes.values()])
+        res["indexes mapped"] = self.indexes_mapped
+        if self.lazy:
+            res["object cache size"] = len(self.object_cache)
+            res["object cache hits"] = self.object_cache.hits
+            res["object cache misses"] = self.object_cache.misses
+        return res
+
 
-        res = IndexResult()
+class ObjectCache:
+    """A bounded cache of rwhoisobjects, keyed by id, that discards the
+    least recently used object when it is full."""
 
-        for attr in self.normal_indexes:
-            res.extend(self.search_attr(attr, value, max))
-            if max:
-                if len(res) >= max:
-                    res.truncate(max)
-                    return res
-        return res
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.objects = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
 
-    def search_cidr(self, value, max=0):
-        """Search for a value in the cidr indexes.  Returns a list of
-        object ids, or an empty list if nothing was found."""
-
-        res = IndexResult()
-        for attr in self.cidr_indexes:
-            res.extend(self.search_attr(attr, value, max))
-            if max:
-                if len(res) >= max:
-                    res.truncate(max)
-                    return res
-        return res
+    def __len__(self):
+        return len(self.objects)
+
+    def get(self, id):
+        with self.lock:
+            obj = self.objects.get(id)
+            if obj is None:
+                self.misses += 1
+                return None
+            self.objects.move_to_end(id)
+            self.hits += 1
+            return obj
+
+    def put(self, id, obj):
+        if self.size <= 0:
+            return
+        with self.lock:
+            self.objects[id] = obj
+            self.objects.move_to_end(id)
+            while len(self.objects) > self.size:
+                self.objects.popitem(last=False)
 
-    def search_referral(self, value, max=0):
-        """Given a heirarchal value, search for referrals.  Returns a
-        list of object ids or an empty list."""
 
-        return self.search_attr("referred-auth-area", value, max)
+def load(schema_file, data_files, startup=False):
+    """Build a MemDB from a schema file and a list of data files.  If
+    config.index_dir is set, the attribute indexes are kept in index
+    files there (see save_indexes()), which are reused if they are up
+    to date."""
 
-    def object_iterator(self):
-        return self.main_index.itervalues()
+    db = MemDB()
+    with Startup.phase("init_schema"):
+        db.init_schema(schema_file)
+    if config.index_dir:
+        with Startup.phase("open_indexes"):
+            opened = db.open_indexes(config.index_dir, data_files)
+        if opened:
+            # the index files are up to date, so only the objects need
+            # loading.  They are still parsed in full (or, with
+            # config.lazy_objects, scanned for their locations), as
+            # the index files don't hold them.
+            db.load_data_files(data_files)
+            return db
 
+    db.load_data_files(data_files)
+    with Startup.phase("index_data"):
+        db.index_data()
+    if config.index_dir:
+        with Startup.phase("save_indexes"):
+            db.save_indexes(config.index_dir, data_files)
+            db.open_indexes(config.index_dir, data_files)
+    return db
 
-class IndexResult:
-    def __init__(self, list=None):
-        if not list:
-            list = []
-        self.data = list
-        self._dict = dict(zip(self.data, self.data))
 
-    def __len__(self):
-        return len(self.data)
-
-    def extend(self, list):
-        if isinstance(list, type(self)):
-            list = list.list()
-        new_els = [x for x in list if x not in self._dict]
-        self.data.extend(new_els)
-        self._dict.update(dict(zip(new_els, new_els)))
-
-    def list(self):
-        return self.data
-
-    def truncate(self, n=0):
-        to_del = self.data[n:]
-        for i in to_del:
-            del self._dict[i]
-        self.data = self.data[:n]
+def read_schema(schema_file):
+    """Read a schema file, returning a dictionary of the attributes it
+    describes (including the base attributes every schema has).  Keys
+    are lowercase attribute names, values are index type characters,
+    or None for unindexed attributes."""
+
+    # the base schema
+    attrs = {
+        "id": "N",
+        "auth-area": None,
+        "class-name": None,
+        "updated": None,
+        "referred-auth-area": "R",
+    }
+
+    sf = open(schema_file)
+
+    for line in sf:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+
+        attr, it = line.split("=")
+        attrs[attr.strip().lower()] = it.strip()[0].upper()
+
+    sf.close()
+    return attrs
+
+
+def record_to_object(rec):
+    """Convert a record (a list of (attribute, value) tuples), as
+    produced by the DataFile module, into an rwhoisobject."""
+
+    obj = rwhoisobject()
+    obj.add_record(rec)
+    return obj
+
+
+def read_objects(data_file):
+    """Read rwhoisobjects from an rwhoisd-style data file, yielding
+    each one in turn."""
+
+    for rec in DataFile.read_records(data_file):
+        yield record_to_object(rec)
+
+
+def fingerprint(obj):
+    """Return a digest of an rwhoisobject's contents, suitable for
+    telling whether an object has changed."""
+
+    return hashlib.sha1(str(obj).encode("utf-8", "replace")).digest()
+
+
+def file_stamp(filename):
+    """Return a (size, mtime) tuple for 'filename', used to tell
+    whether a file has changed since it was loaded."""
+
+    st = os.stat(filename)
+    return (st.st_size, st.st_mtime)
 
 
 # test driver
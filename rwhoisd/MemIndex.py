@@ -18,6 +18,8 @@
 # USA
 
 import bisect
+import copy
+import heapq
 import types
 
 import Cidr
@@ -38,9 +40,46 @@ class MemIndex:
     # In the Cidr case, we would either have to use longs or strings,
     # as Python doesn't seem to have an unsigned 32-bit integer type.
 
+    # Updates to a prepared map are handled without disturbing the
+    # main sorted list: additions go into a small sorted 'pending'
+    # list, and removals are recorded as tombstones.  Searches merge
+    # the two lists and skip tombstoned elements.  When either reaches
+    # 'max_pending' entries, they are folded back into the main list
+    # by slicing it around their positions, so an update costs
+    # O(log N) plus a small share of one list copy.  A map must not be
+    # updated while it is being searched; update a copy() and swap it
+    # in instead (see MemDB.update_data()).
+
+    # the number of pending additions or tombstones that will trigger
+    # a compaction.
+    max_pending = 256
+
     def __init__(self):
         self.index = []
         self.sorted = False
+        # sorted list of elements added since the map was prepared.
+        self.pending = []
+        # tombstones, as returned by _tomb(), for elements removed
+        # from 'index', mapped to the positions of those elements.
+        self.removed = {}
+
+    def __len__(self):
+        return len(self.index) + len(self.pending) - len(self.removed)
+
+    def _tomb(self, key, value):
+        # Cidr objects don't hash by value, so use their string form.
+        return (str(key), value)
+
+    def _locate(self, list, el):
+        """Return the position of the element totally equal to 'el' in
+        the sorted 'list', or -1 if there isn't one."""
+
+        i = bisect.bisect_left(list, el)
+        while i < len(list) and list[i].key == el.key:
+            if list[i].value == el.value:
+                return i
+            i += 1
+        return -1
 
     def add(self, key, value=None):
         """Add a key-value pair to the map.  If the map is already in
@@ -54,25 +93,27 @@ class MemIndex:
         else:
             el = element(key, value)
 
-        if self.sorted:
-            i = bisect.bisect_left(self.index, el)
-            while i < len(self.index):
-                if self.index[i].total_equals(el):
-                    break
-                if self.index[i] != el:
-                    self.index.insert(i, el)
-                    break
-                i += 1
-            else:
-                self.index.append(el)
-        else:
+        if not self.sorted:
             self.index.append(el)
+            return
+
+        tomb = self._tomb(el.key, el.value)
+        if tomb in self.removed:
+            # the element is still in the main list, so just revive it.
+            del self.removed[tomb]
+            return
+        if self._locate(self.index, el) >= 0 or self._locate(self.pending, el) >= 0:
+            return
+
+        bisect.insort(self.pending, el)
+        self._maybe_compact()
 
     def addlist(self, list):
         """Add the entire list of elements to the map.  The elements
         of 'list' may be 2 element tuples or actual 'element' objects.
         Use this method to add many elements at once."""
 
+        self._compact()
         self.sorted = False
         for i in list:
             if isinstance(i, types.TupleType):
@@ -80,51 +121,143 @@ class MemIndex:
             elif isinstance(i, element):
                 self.index.append(i)
 
+    def remove(self, key, value=None):
+        """Remove a key-value pair from the map.  The 'key' argument
+        may be a 2 element tuple, in which case 'value' is ignored.
+        Returns True if the pair was found (and removed)."""
+
+        if isinstance(key, types.TupleType):
+            key, value = key[:2]
+
+        self.prepare()
+        el = element(key, value)
+
+        i = self._locate(self.pending, el)
+        if i >= 0:
+            del self.pending[i]
+            return True
+
+        tomb = self._tomb(key, value)
+        if tomb in self.removed:
+            return False
+        i = self._locate(self.index, el)
+        if i < 0:
+            return False
+        self.removed[tomb] = i
+        self._maybe_compact()
+        return True
+
+    def replace(self, old_key, new_key, value=None):
+        """Move 'value' from 'old_key' to 'new_key'.  Returns True if
+        the old key-value pair was present."""
+
+        res = self.remove(old_key, value)
+        self.add(new_key, value)
+        return res
+
+    def copy(self):
+        """Return a copy of the map that can be updated without
+        changing this one."""
+
+        res = copy.copy(self)
+        res.index = self.index[:]
+        res.pending = self.pending[:]
+        res.removed = self.removed.copy()
+        return res
+
+    def _maybe_compact(self):
+        if len(self.pending) >= self.max_pending or len(self.removed) >= self.max_pending:
+            self._compact()
+
+    def _compact(self):
+        """Fold the pending additions and tombstones into the main
+        list.  The new list is built from slices of the old one, so
+        this is a copy of the list rather than a pass over its
+        elements."""
+
+        if not self.pending and not self.removed:
+            return
+        index = self.index
+        if self.removed:
+            res = []
+            start = 0
+            for i in sorted(self.removed.values()):
+                res += index[start:i]
+                start = i + 1
+            res += index[start:]
+            index = res
+        if self.pending:
+            res = []
+            start = 0
+            for el in self.pending:
+                i = bisect.bisect_right(index, el, start)
+                res += index[start:i]
+                res.append(el)
+                start = i
+            res += index[start:]
+            index = res
+        self.index = index
+        self.pending = []
+        self.removed = {}
+
     def prepare(self):
         """Put the map in a prepared state, if necessary."""
 
-        n = len(self.index)
-        if not n:
+        if self.sorted or not self.index:
             return
-        if not self.sorted:
-            self.index.sort()
-            # unique the index
-            last = self.index[0]
-            lasti = i = 1
-            while i < n:
-                if not self.index[i].total_equals(last):
-                    self.index[lasti] = last = self.index[i]
-                    lasti += 1
-                i += 1
-            self.index[lasti:]
-            self.sorted = True
-
-    def _find(self, key):
-        """Return the (search_element, index) tuple.  Used internally
-        only."""
+        self.index.sort()
+        # unique the index.  The sort is on keys only, so duplicates
+        # need not be adjacent within a run of equal keys.
+        index = []
+        seen = set()
+        for el in self.index:
+            if index and el.key != index[-1].key:
+                seen = set()
+            if el.value in seen:
+                continue
+            seen.add(el.value)
+            index.append(el)
+        self.index = index
+        self.sorted = True
+
+    def items(self):
+        """Return the list of (key, value) pairs in the map, in sorted
+        order."""
+
+        self.prepare()
+        self._compact()
+        return [(el.key, el.value) for el in self.index]
+
+    def _scan(self, key):
+        """Yield the elements of the map in sorted order, starting with
+        the first one whose key is not less than 'key'.  Removed
+        elements are skipped.  Used internally only."""
 
         self.prepare()
         search_el = element(key, None)
-        i = bisect.bisect_left(self.index, search_el)
-        if i > len(self.index) or i < 0:
-            print("warning: bisect.bisect_left returned something " + "unexpected:", i, len(self.index))
-        return (search_el, i)
+        index, pending, removed = self.index, self.pending, self.removed
+
+        els = _iter_from(index, bisect.bisect_left(index, search_el))
+        if pending:
+            els = heapq.merge(els, _iter_from(pending, bisect.bisect_left(pending, search_el)))
+        for el in els:
+            if removed and self._tomb(el.key, el.value) in removed:
+                continue
+            yield el
 
     def find(self, key, prefix_match=False, max=0):
         """Return a list of values whose keys string match 'key'.  If
         prefix_match is True, then keys will match if 'key' is a
         prefix of the element key."""
 
-        search_el, i = self._find(key)
+        search_el = element(key, None)
         res = []
-        while i < len(self.index):
+        for el in self._scan(key):
             if max and len(res) == max:
                 break
-            if search_el.equals(self.index[i], prefix_match):
-                res.append(self.index[i].value)
-                i += 1
-            else:
+            if not search_el.equals(el, prefix_match):
                 break
+            res.append(el.value)
         return res
 
 
@@ -187,6 +320,23 @@ class CidrMemIndex(MemIndex):
         MemIndex.addlist(self, res_list)
         return
 
+    def remove(self, key, value=None):
+        if isinstance(key, types.TupleType):
+            l = self._conv_tuple(key)
+        else:
+            l = self._conv_key_value(key, value)
+
+        res = False
+        for k, v in l:
+            if MemIndex.remove(self, k, v):
+                res = True
+        return res
+
+    def replace(self, old_key, new_key, value=None):
+        res = self.remove(old_key, value)
+        self.add(new_key, value)
+        return res
+
     def is_netblock(self, key):
         if "-" in key:
             return True
@@ -202,13 +352,13 @@ class CidrMemIndex(MemIndex):
     def find_exact(self, key, max=0):
 
         key = Cidr.valid_cidr(key)
-        search_el, i = self._find(key)
         res = []
-        while i < len(self.index) and self.index[i].key == key:
-            res.append(self.index[i].value)
+        for el in self._scan(key):
+            if el.key != key:
+                break
+            res.append(el.value)
             if max and len(res) == max:
                 break
-            i += 1
         return res
 
     def find_subnets(self, key, max=0):
@@ -216,14 +366,14 @@ class CidrMemIndex(MemIndex):
         that match 'key' itself."""
 
         key = Cidr.valid_cidr(key)
-        search_el, i = self._find(key)
 
         res = set()
-        while i < len(self.index) and self.index[i].key.is_subnet(key):
+        for el in self._scan(key):
+            if not el.key.is_subnet(key):
+                break
             if max and len(res) == max:
                 break
-            res.add(self.index[i].value)
-            i += 1
+            res.add(el.value)
         return list(res)
 
     def find_supernets(self, key, max=0):
@@ -317,6 +467,38 @@ class ComboMemIndex:
             self.normal_index.addlist(normal_list)
         return
 
+    def remove(self, key, value=None):
+        """Remove a key,value pair from the correct map.  See MemIndex
+        for the behavior of this method"""
+
+        if isinstance(key, types.TupleType):
+            k = key[0]
+        else:
+            k = key
+        if Cidr.valid_cidr(k):
+            return self.cidr_index.remove(key, value)
+        return self.normal_index.remove(key, value)
+
+    def replace(self, old_key, new_key, value=None):
+        """Move 'value' from 'old_key' to 'new_key', in whichever maps
+        the keys belong to."""
+
+        res = self.remove(old_key, value)
+        self.add(new_key, value)
+        return res
+
+    def copy(self):
+        """Return a copy of the map that can be updated without
+        changing this one."""
+
+        res = ComboMemIndex()
+        res.normal_index = self.normal_index.copy()
+        res.cidr_index = self.cidr_index.copy()
+        return res
+
+    def __len__(self):
+        return len(self.normal_index) + len(self.cidr_index)
+
     def prepare(self):
         """Prepare the internally held maps for searching."""
 
@@ -361,6 +543,15 @@ class ComboMemIndex:
         return None
 
 
+def _iter_from(list, i):
+    """Iterate over 'list' starting at position 'i'."""
+
+    n = len(list)
+    while i < n:
+        yield list[i]
+        i += 1
+
+
 class element:
     """This is the base element class.  It basically exists to
     simplify sorting."""
@@ -433,6 +624,14 @@ if __name__ == "__main__":
     res = mi.find("b", 1)
     print(res)
 
+    print("removing bar, replacing baz with bazooka")
+    mi.remove("bar", "bar-id")
+    mi.replace("baz", "bazooka", "baz-id")
+
+    print("finding b*:")
+    res = mi.find("b", 1)
+    print(res)
+
     ci = CidrMemIndex()
 
     ci.add("127.0.0.1/24", "net-local-1")
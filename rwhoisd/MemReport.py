@@ -0,0 +1,249 @@
+#! /usr/bin/env python
+
+# This file is part of python-rwhoisd
+#
+# Copyright (C) 2003, David E. Blacka
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+"""Report where the memory of a loaded MemDB goes.
+
+usage: MemReport.py [-t] [-f frames] [-q query_file] schema_file data_file [data_file ...]
+
+  -t            also trace allocations with tracemalloc while loading,
+                indexing and (with -q) querying, and report the source
+                lines that allocated the most memory in each phase
+  -f frames     the number of stack frames tracemalloc keeps (default 1)
+  -q file       run the queries in 'file' after loading (with -t)
+
+The sizes are approximate: they are the sum of sys.getsizeof() over
+every object reachable from each part of the database.  An object
+shared by several parts (e.g., an interned string) is only counted in
+the first part that reaches it, in the order of the report.  Index
+files mapped with config.index_dir are reported separately, as they
+are paged in from the files rather than allocated."""
+
+import mmap
+import os
+import sys
+import types
+
+import MemDB
+import Stats
+
+# types that are never followed or counted.
+_skip_types = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType, type(None), bool)
+
+
+class Sizer:
+    """Measures the approximate deep size of objects, counting each
+    object only once across all measurements, and keeps totals by
+    type."""
+
+    def __init__(self):
+        self.seen = set()
+        # keys are type names, values are [bytes, count] lists.
+        self.by_type = {}
+
+    def measure(self, root):
+        """Return (bytes, mapped bytes) for everything reachable from
+        'root' not already measured."""
+
+        total = mapped = 0
+        stack = [root]
+        seen = self.seen
+        by_type = self.by_type
+        while stack:
+            o = stack.pop()
+            if id(o) in seen or isinstance(o, _skip_types):
+                continue
+            seen.add(id(o))
+            if isinstance(o, mmap.mmap):
+                mapped += len(o)
+                continue
+            size = sys.getsizeof(o)
+            total += size
+            t = by_type.get(type(o).__name__)
+            if t is None:
+                t = by_type[type(o).__name__] = [0, 0]
+            t[0] += size
+            t[1] += 1
+
+            if isinstance(o, dict):
+                stack.extend(o.keys())
+                stack.extend(o.values())
+            elif isinstance(o, (list, tuple, set, frozenset)):
+                stack.extend(o)
+            elif isinstance(o, (str, bytes, int, float)):
+                pass
+            else:
+                d = getattr(o, "__dict__", None)
+                if d is not None:
+                    stack.append(d)
+                for slot in getattr(type(o), "__slots__", ()):
+                    if hasattr(o, slot):
+                        stack.append(getattr(o, slot))
+        return total, mapped
+
+
+def report(db):
+    """Measure the parts of the MemDB 'db'.  Returns a list of (part,
+    bytes, mapped bytes) tuples, and the Sizer (for its totals by
+    type)."""
+
+    sizer = Sizer()
+    parts = [("objects", db.main_index)]
+    for attr in sorted(db.indexes.keys()):
+        parts.append(("index " + attr, db.indexes[attr]))
+    parts.append(("fingerprints", db.fingerprints))
+    parts.append(("object cache", db.object_cache))
+    parts.append(("schema", [db.attrs, db.classes, db.authareas, db.normal_indexes, db.cidr_indexes]))
+    # whatever else the database holds.
+    parts.append(("other", vars(db)))
+
+    res = []
+    for name, root in parts:
+        size, mapped = sizer.measure(root)
+        res.append((name, size, mapped))
+    return res, sizer
+
+
+def format_size(n):
+    for unit in ("B", "KB", "MB"):
+        if abs(n) < 1024:
+            return "%d %s" % (n, unit)
+        n /= 1024.0
+    return "%.1f GB" % n
+
+
+def format_report(parts, sizer, top=12):
+    """Format the result of report() as a list of lines."""
+
+    lines = []
+    total = sum([x[1] for x in parts])
+    for name, size, mapped in parts:
+        line = "%-32s %12s  %5.1f%%" % (name, format_size(size), total and 100.0 * size / total or 0)
+        if mapped:
+            line += "  (+%s mapped)" % format_size(mapped)
+        lines.append(line)
+    lines.append("%-32s %12s" % ("total", format_size(total)))
+    lines.append("")
+    lines.append("%-32s %12s  %10s" % ("by type", "bytes", "count"))
+    types = sorted(sizer.by_type.items(), key=lambda x: -x[1][0])
+    for name, (size, count) in types[:top]:
+        lines.append("%-32s %12s  %10d" % (name, format_size(size), count))
+    return lines
+
+
+def trace(schema_file, data_files, query_file=None, frames=1, top=10):
+    """Load (and query) a MemDB with tracemalloc on, and return the
+    lines of a report of the memory allocated by each phase:
+    "loader" (reading the data files, including adding the keys to
+    the indexes), "indexer" (preparing the indexes for searching),
+    and "query" (running the queries in 'query_file')."""
+
+    import tracemalloc
+
+    tracemalloc.start(frames)
+    snapshots = [("start", tracemalloc.take_snapshot())]
+
+    db = MemDB.MemDB()
+    db.init_schema(schema_file)
+    db.load_data_files(data_files)
+    snapshots.append(("loader", tracemalloc.take_snapshot()))
+    db.index_data()
+    snapshots.append(("indexer", tracemalloc.take_snapshot()))
+
+    if query_file:
+        import QueryParser
+        import QueryProcessor
+        import Session
+
+        QueryParser.db = db
+        QueryParser.init_parsers()
+        processor = QueryProcessor.QueryProcessor(db)
+        session = Session.Context()
+
+        class Sink:
+            def write(self, s):
+                pass
+
+        session.wfile = Sink()
+        f = open(query_file)
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#") and not line.startswith("-"):
+                processor.process_query(session, line)
+        f.close()
+        snapshots.append(("query", tracemalloc.take_snapshot()))
+
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    lines = []
+    key = frames > 1 and "traceback" or "lineno"
+    for (_, before), (phase, after) in zip(snapshots, snapshots[1:]):
+        stats = after.compare_to(before, key)
+        growth = sum([s.size_diff for s in stats])
+        lines.append("%s: %s allocated and kept" % (phase, format_size(growth)))
+        for s in stats[:top]:
+            # the most recent frame first.
+            where = ["%s:%d" % (os.path.basename(x.filename), x.lineno) for x in reversed(s.traceback)]
+            lines.append("  %12s  %8d blocks  %s" % (format_size(s.size_diff), s.count_diff, " < ".join(where)))
+        lines.append("")
+    lines.append("traced: %s now, %s at peak" % (format_size(current), format_size(peak)))
+    return db, lines
+
+
+def main(argv):
+    import getopt
+
+    opts, args = getopt.getopt(argv[1:], "tf:q:")
+    tracing = False
+    frames = 1
+    query_file = None
+    for o, a in opts:
+        if o == "-t":
+            tracing = True
+        elif o == "-f":
+            frames = int(a)
+        elif o == "-q":
+            query_file = a
+    if len(args) < 2:
+        print(__doc__)
+        return 64
+
+    if tracing:
+        db, lines = trace(args[0], args[1:], query_file, frames)
+        for line in lines:
+            print(line)
+        print("")
+    else:
+        db = MemDB.load(args[0], args[1:], True)
+
+    parts, sizer = report(db)
+    for line in format_report(parts, sizer):
+        print(line)
+
+    rss = Stats.peak_rss()
+    if rss is not None:
+        print("")
+        print("peak RSS %s (%d objects)" % (format_size(rss * 1024), db.object_count()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,217 @@
+# This file is part of python-rwhoisd
+#
+# Copyright (C) 2003, David E. Blacka
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+# This module serves the server's statistics over HTTP, at /metrics,
+# in the Prometheus text exposition format.  The listener runs in a
+# thread of its own, and only reads the statistics (see Stats.py), so
+# scrapes never hold up the threads answering queries.
+
+import http.server
+import threading
+import time
+
+import config
+import Session
+import Stats
+
+# the metric families of the Stats counters, keyed by the first word
+# of the counter name: (metric name, label for the rest of the name,
+# help text).
+counter_families = {
+    "queries": ("rwhoisd_queries_total", None, "Queries processed."),
+    "directive": ("rwhoisd_directives_total", "directive", "Directives processed, by directive."),
+    "error": ("rwhoisd_errors_total", "code", "Error responses sent, by error code."),
+    "reload": ("rwhoisd_reloads_total", "mode", "Database reloads, by mode."),
+    "capture": ("rwhoisd_capture_dropped_total", None, "Capture file lines dropped."),
+    "slow": ("rwhoisd_slow_queries_total", "outcome", "Slow queries, by whether they were logged or dropped."),
+}
+
+# the upper bounds of the latency histogram buckets, in seconds: a
+# bucket per octave, from 8 microseconds to about 17 seconds.  Each is
+# a bucket boundary of Stats.Histogram, so no counts are estimated.
+latency_buckets = [(4 * k - 1, 2.0**k / 1e6) for k in range(3, 25)]
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Exposition:
+    """A Prometheus text format document under construction."""
+
+    def __init__(self):
+        self.lines = []
+        self.declared = set()
+
+    def declare(self, name, kind, help):
+        if name in self.declared:
+            return
+        self.declared.add(name)
+        self.lines.append("# HELP %s %s" % (name, help))
+        self.lines.append("# TYPE %s %s" % (name, kind))
+
+    def sample(self, name, value, labels=None):
+        if labels:
+            label_str = ",".join(['%s="%s"' % (k, _escape(v)) for k, v in labels])
+            name = "%s{%s}" % (name, label_str)
+        if isinstance(value, float):
+            value = repr(value)
+        self.lines.append("%s %s" % (name, value))
+
+    def metric(self, name, kind, help, value, labels=None):
+        self.declare(name, kind, help)
+        self.sample(name, value, labels)
+
+    def text(self):
+        return "\n".join(self.lines) + "\n"
+
+
+def render(state):
+    """Return the metrics document for the server state 'state' (see
+    RwhoisServer.server_state())."""
+
+    doc = Exposition()
+    now = time.time()
+    doc.metric("rwhoisd_start_time_seconds", "gauge", "When the server started.", Stats.started)
+    doc.metric("rwhoisd_uptime_seconds", "gauge", "Seconds since the server started.", now - Stats.started)
+
+    counters = Stats.counters()
+    # make sure the main families are always present, even if zero.
+    counters.setdefault("queries", 0)
+    for name, n in sorted(counters.items()):
+        family, _, rest = name.partition(" ")
+        metric, label, help = counter_families.get(family, ("rwhoisd_%s_total" % family, "kind", "Events."))
+        labels = None
+        if label and rest:
+            labels = [(label, rest)]
+        doc.metric(metric, "counter", help, n, labels)
+
+    name = "rwhoisd_query_phase_seconds"
+    doc.declare(name, "histogram", "Time spent in each phase of query processing (see config.query_timing).")
+    for phase, h in sorted(Stats.phase_histograms().items(), key=lambda x: Stats.phases.index(x[0])):
+        seen = 0
+        b = 0
+        for last, bound in latency_buckets:
+            while b <= last:
+                seen += h.counts[b]
+                b += 1
+            doc.sample(name + "_bucket", seen, [("phase", phase), ("le", repr(bound))])
+        doc.sample(name + "_bucket", h.count, [("phase", phase), ("le", "+Inf")])
+        doc.sample(name + "_sum", h.total, [("phase", phase)])
+        doc.sample(name + "_count", h.count, [("phase", phase)])
+
+    usage = Session.slots.usage()
+    doc.metric("rwhoisd_sessions_active", "gauge", "Sessions in progress.", usage["active"])
+    doc.metric("rwhoisd_sessions_peak", "gauge", "The most sessions in progress at once.", usage["peak"])
+    doc.metric("rwhoisd_sessions_max", "gauge", "The session limit (0 is unlimited).", usage["max"])
+    doc.metric("rwhoisd_sessions_accepted_total", "counter", "Sessions accepted.", usage["accepted"])
+    doc.metric("rwhoisd_sessions_refused_total", "counter", "Sessions refused for lack of a slot.", usage["refused"])
+    doc.metric("rwhoisd_sessions_timeouts_total", "counter", "Sessions closed by a time limit.", usage["timeouts"])
+    doc.metric("rwhoisd_threads", "gauge", "Threads in the server process.", threading.active_count())
+
+    db = state.get("db")
+    if db is not None:
+        db_stats = db.stats()
+        doc.metric("rwhoisd_objects", "gauge", "Objects in the database.", db_stats["objects"])
+        for key, metric, help in (
+            ("object cache size", "rwhoisd_object_cache_objects", "Objects in the object cache."),
+            ("object cache hits", "rwhoisd_object_cache_hits_total", "Object cache hits."),
+            ("object cache misses", "rwhoisd_object_cache_misses_total", "Object cache misses."),
+        ):
+            if key in db_stats:
+                doc.metric(metric, metric.endswith("_total") and "counter" or "gauge", help, db_stats[key])
+        doc.declare("rwhoisd_index_entries", "gauge", "Entries in each attribute index.")
+        for attr, n in sorted(db.index_sizes().items()):
+            doc.sample("rwhoisd_index_entries", n, [("attribute", attr)])
+
+    load = state.get("load")
+    if load:
+        doc.metric("rwhoisd_load_duration_seconds", "gauge", "Time taken to load the database at startup.", load["duration"])
+    reload = state.get("reload")
+    if reload:
+        doc.metric(
+            "rwhoisd_last_reload_duration_seconds",
+            "gauge",
+            "Time taken by the last completed reload.",
+            reload["duration"],
+            [("mode", reload["mode"])],
+        )
+        doc.metric("rwhoisd_last_reload_time_seconds", "gauge", "When the last reload completed.", reload["time"])
+    return doc.text()
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+
+    # don't let a stalled scraper tie up the listener.
+    timeout = 10
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render(self.server.state()).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if config.verbose:
+            http.server.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class MetricsServer(http.server.HTTPServer):
+    """An HTTP server for /metrics.  'state' is a callable returning
+    the server state to report."""
+
+    allow_reuse_address = True
+
+    def __init__(self, server_address, state):
+        http.server.HTTPServer.__init__(self, server_address, MetricsHandler)
+        self.state = state
+
+
+def start(state, address=None, port=None):
+    """Start serving /metrics in a background thread, on 'address' and
+    'port' (by default, config.metrics_address and config.metrics_port).
+    Returns the MetricsServer."""
+
+    if address is None:
+        address = config.metrics_address
+    if port is None:
+        port = config.metrics_port
+    server = MetricsServer((address, port), state)
+    t = threading.Thread(target=server.serve_forever, name="metrics")
+    t.daemon = True
+    t.start()
+    return server
+
+
+# test driver
+if __name__ == "__main__":
+
+    for i in range(5):
+        Stats.count("queries")
+        Stats.count("directive status")
+        Stats.begin()
+        Stats.lap("search")
+        Stats.end()
+    Stats.count("error 330")
+    print(render({"load": {"duration": 1.5}}))
@@ -0,0 +1,346 @@
+# This file is part of python-rwhoisd
+#
+# Copyright (C) 2003, David E. Blacka
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+# This module contains read-only versions of the MemIndex maps that
+# are stored in files and searched in place through mmap, so that
+# opening one costs next to nothing, and the pages are shared (through
+# the OS page cache) by every process that has it open.
+#
+# An index file looks like this (all integers are little-endian):
+#
+#   header:        magic "RWIX", version (u32), kind (u32),
+#                  number of keys (u64), number of pairs (u64)
+#   key offsets:   (number of keys + 1) u64 offsets into the key block
+#   value offsets: (number of keys + 1) u64 offsets into the value block
+#   key block:     the keys, sorted, concatenated
+#   value block:   for each key, its values joined with newlines
+#
+# String keys are stored as UTF-8, which sorts in the same order as
+# the strings themselves.  CIDR keys are stored as 18 bytes: the
+# address family (0 for IPv4, 1 for IPv6), the address as a 16 byte
+# big-endian number, and the network length, so networks sort by
+# family, then address, then size (supernets first).
+
+import mmap
+import os
+import struct
+
+import Cidr
+
+magic = b"RWIX"
+version = 1
+
+KIND_STRING = 0
+KIND_CIDR = 1
+
+_header = struct.Struct("<4sIIQQ")
+_offset = struct.Struct("<Q")
+
+
+def cidr_key(c):
+    """Encode the Cidr object 'c' as an index key."""
+
+    return bytes([int(c.is_ipv6())]) + c.numaddr.to_bytes(16, "big") + bytes([c.netlen])
+
+
+def string_key(s):
+    """Encode the string 's' as an index key."""
+
+    return s.encode("utf-8")
+
+
+def write_index(filename, items, kind=KIND_STRING):
+    """Write an index file containing the (key, value) pairs in
+    'items', which need not be sorted.  Keys are strings or, if 'kind'
+    is KIND_CIDR, Cidr objects.  The file is written under a temporary
+    name and then renamed, so readers that have the old file open are
+    not disturbed."""
+
+    if kind == KIND_CIDR:
+        encode = cidr_key
+    else:
+        encode = string_key
+
+    # each key's values, in the order they were seen.  The values
+    # are dict keys (with values of None), so duplicates are found
+    # without a scan.
+    postings = {}
+    npairs = 0
+    for k, v in items:
+        vals = postings.setdefault(encode(k), {})
+        if v not in vals:
+            vals[v] = None
+            npairs += 1
+    keys = sorted(postings.keys())
+
+    key_offsets = [0]
+    for k in keys:
+        key_offsets.append(key_offsets[-1] + len(k))
+    value_data = [("\n".join(postings[k])).encode("utf-8") for k in keys]
+    value_offsets = [0]
+    for v in value_data:
+        value_offsets.append(value_offsets[-1] + len(v))
+
+    tmpname = filename + ".new"
+    f = open(tmpname, "wb")
+    f.write(_header.pack(magic, version, kind, len(keys), npairs))
+    f.write(struct.pack("<%dQ" % len(key_offsets), *key_offsets))
+    f.write(struct.pack("<%dQ" % len(value_offsets), *value_offsets))
+    f.write(b"".join(keys))
+    f.write(b"".join(value_data))
+    f.close()
+    os.replace(tmpname, filename)
+
+
+class MmapIndex:
+    """A read-only string keyed map stored in an index file.  It
+    supports the same searches as MemIndex."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        f = open(filename, "rb")
+        try:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+
+        m, v, self.kind, self.nkeys, self.npairs = _header.unpack_from(self.map, 0)
+        if m != magic or v != version:
+            raise ValueError("%s: not an index file (or the wrong version)" % filename)
+        n = self.nkeys + 1
+        self.key_offsets = _header.size
+        self.value_offsets = self.key_offsets + n * _offset.size
+        self.key_block = self.value_offsets + n * _offset.size
+        self.value_block = self.key_block + _offset.unpack_from(self.map, self.key_offsets + self.nkeys * _offset.size)[0]
+
+    def __len__(self):
+        return self.npairs
+
+    def close(self):
+        self.map.close()
+
+    def prepare(self):
+        """Index files are always prepared."""
+        return
+
+    def _key(self, i):
+        start, end = struct.unpack_from("<2Q", self.map, self.key_offsets + i * _offset.size)
+        return self.map[self.key_block + start : self.key_block + end]
+
+    def _values(self, i):
+        start, end = struct.unpack_from("<2Q", self.map, self.value_offsets + i * _offset.size)
+        return self.map[self.value_block + start : self.value_block + end].decode("utf-8").split("\n")
+
+    def _bisect(self, key):
+        """Return the position of the first key not less than 'key'."""
+
+        lo, hi = 0, self.nkeys
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _collect(self, i, match, max):
+        """Gather the values of the keys from position 'i' onwards,
+        for as long as match(key) is true."""
+
+        res = []
+        while i < self.nkeys:
+            k = self._key(i)
+            if not match(k):
+                break
+            res.extend(self._values(i))
+            if max and len(res) >= max:
+                return res[:max]
+            i += 1
+        return res
+
+    def find(self, key, prefix_match=False, max=0):
+        """Return a list of values whose keys string match 'key'.  If
+        prefix_match is True, then keys will match if 'key' is a
+        prefix of the element key."""
+
+        key = string_key(key)
+        if prefix_match:
+            match = lambda k: k.startswith(key)
+        else:
+            match = lambda k: k == key
+        return self._collect(self._bisect(key), match, max)
+
+
+class CidrMmapIndex(MmapIndex):
+    """A read-only CIDR keyed map stored in an index file.  It
+    supports the same searches as CidrMemIndex."""
+
+    def find_exact(self, key, max=0):
+        key = cidr_key(Cidr.valid_cidr(key))
+        return self._collect(self._bisect(key), lambda k: k == key, max)
+
+    def find_subnets(self, key, max=0):
+        """Return all values that are subnets of 'key', including any
+        that match 'key' itself."""
+
+        c = Cidr.valid_cidr(key)
+        first = cidr_key(c)
+        # every key from 'first' up to the last address of the block
+        # is a subnet; supernets sort before 'first'.
+        last = first[:1] + (c.numaddr + c.length() - 1).to_bytes(16, "big")
+        res = self._collect(self._bisect(first), lambda k: k[:17] <= last, 0)
+        res = list(dict.fromkeys(res))
+        if max:
+            return res[:max]
+        return res
+
+    def find_supernets(self, key, max=0):
+        """Return all values that are supernets of 'key', including
+        any that match 'key' itself."""
+
+        k = Cidr.valid_cidr(key).clone()
+        res = []
+        while k.netlen >= 0:
+            k.calc()
+            res += self.find_exact(k, max)
+            if max and len(res) >= max:
+                return res[:max]
+            k.netlen -= 1
+        return res
+
+    def find(self, key, prefix_match=0, max=0):
+        """Return either the exact match of 'key', or the closest
+        supernet of 'key'.  If prefix_match is True, then find all
+        supernets of 'key'"""
+
+        if prefix_match:
+            return self.find_supernets(key, max)
+
+        k = Cidr.valid_cidr(key).clone()
+        while k.netlen >= 0:
+            k.calc()
+            res = self.find_exact(k, max)
+            if res:
+                return res
+            k.netlen -= 1
+        return []
+
+
+class ComboMmapIndex:
+    """A read-only pair of string and CIDR index files, searched the
+    same way as a ComboMemIndex."""
+
+    def __init__(self, normal_index, cidr_index):
+        self.normal_index = normal_index
+        self.cidr_index = cidr_index
+
+    def __len__(self):
+        return len(self.normal_index) + len(self.cidr_index)
+
+    def close(self):
+        self.normal_index.close()
+        self.cidr_index.close()
+
+    def prepare(self):
+        return
+
+    def find(self, key, prefix_match=False, max=0):
+        c = Cidr.valid_cidr(key)
+        if c:
+            return self.cidr_index.find(c, prefix_match, max)
+        return self.normal_index.find(key, prefix_match, max)
+
+    def find_exact(self, key, max=0):
+        c = Cidr.valid_cidr(key)
+        if c:
+            return self.cidr_index.find_exact(c, max)
+        return self.normal_index.find(key, False, max)
+
+    def find_subnets(self, key, max=0):
+        c = Cidr.valid_cidr(key)
+        if c:
+            return self.cidr_index.find_subnets(c, max)
+        return None
+
+    def find_supernets(self, key, max=0):
+        c = Cidr.valid_cidr(key)
+        if c:
+            return self.cidr_index.find_supernets(c, max)
+        return None
+
+
+def _is_cidr_index(index):
+    return hasattr(index, "find_subnets")
+
+
+def save_index(basename, index):
+    """Write a MemIndex, CidrMemIndex or ComboMemIndex to index files
+    named after 'basename'."""
+
+    if hasattr(index, "normal_index"):
+        write_index(basename + ".idx", index.normal_index.items())
+        write_index(basename + ".cidr.idx", index.cidr_index.items(), KIND_CIDR)
+    elif _is_cidr_index(index):
+        write_index(basename + ".cidr.idx", index.items(), KIND_CIDR)
+    else:
+        write_index(basename + ".idx", index.items())
+
+
+def open_index(basename, index_type):
+    """Open the index files named after 'basename', written by
+    save_index(), for an index of type 'index_type' (one of the
+    schema index type characters)."""
+
+    if index_type == "N":
+        return MmapIndex(basename + ".idx")
+    if index_type == "C":
+        return CidrMmapIndex(basename + ".cidr.idx")
+    return ComboMmapIndex(MmapIndex(basename + ".idx"), CidrMmapIndex(basename + ".cidr.idx"))
+
+
+# test driver
+if __name__ == "__main__":
+
+    import tempfile
+
+    import MemIndex
+
+    d = tempfile.mkdtemp()
+
+    mi = MemIndex.MemIndex()
+    mi.addlist([("foo", "foo-id"), ("bar", "bar-id"), ("foobar", "foo-id-2"), ("baz", "baz-id")])
+    save_index(os.path.join(d, "n"), mi)
+    idx = open_index(os.path.join(d, "n"), "N")
+    print("%d pairs" % len(idx))
+    print("finding foo*:", idx.find("foo", True))
+    print("finding baz:", idx.find("baz"))
+    print("finding qux:", idx.find("qux"))
+
+    ci = MemIndex.CidrMemIndex()
+    ci.add("127.0.0.1/24", "net-local-1")
+    ci.add("127.0.0.1/32", "net-local-2")
+    ci.add("127.0.0.0/8", "net-local-3")
+    ci.add("3ffe:4:5::/48", "net-v6-1")
+    save_index(os.path.join(d, "c"), ci)
+    idx = open_index(os.path.join(d, "c"), "C")
+    print("finding 127.0.0.1:", idx.find("127.0.0.1"))
+    print("finding 127.0.0.2:", idx.find("127.0.0.2"))
+    print("finding supernets of 127.0.0.1:", idx.find("127.0.0.1", True))
+    print("finding subnets of 127.0.0.0/8:", idx.find_subnets("127.0.0.0/8"))
+    print("finding 3ffe:4:5:6::/64:", idx.find("3ffe:4:5:6::/64"))
@@ -0,0 +1,321 @@
+# This file is part of python-rwhoisd
+#
+# Copyright (C) 2003, David E. Blacka
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+# This module profiles the running server on demand, for a number of
+# seconds or a number of queries.  There are two kinds of profile:
+#
+#   cprofile  runs each query under cProfile, and writes the merged
+#             statistics of all the query threads as a pstats file
+#             (see the pstats module, or e.g. snakeviz).
+#   sample    samples the stacks of all threads every few milliseconds
+#             from a thread of its own, and writes them as collapsed
+#             stacks (the input format of flamegraph.pl).  This costs
+#             the query threads nothing, so it is the safer choice
+#             under heavy load.
+#
+# Only one profile runs at a time.  QueryProcessor checks 'current'
+# for each query, so an idle profiler costs a single test.
+
+import cProfile
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import time
+
+import config
+import Stats
+
+# the profile in progress, or None.
+current = None
+_lock = threading.Lock()
+
+kinds = ("sample", "cprofile")
+
+
+class ProfileRun:
+    """The common parts of a profile: when it stops, and where its
+    output goes."""
+
+    kind = None
+    extension = None
+    # whether the profile needs to run each query itself (see
+    # run_query()).
+    wants_queries = False
+
+    def __init__(self, seconds=None, queries=None, filename=None):
+        if not seconds and not queries:
+            seconds = config.profile_seconds
+        self.seconds = seconds
+        self.queries = queries
+        if not filename:
+            filename = os.path.join(
+                config.profile_dir or tempfile.gettempdir(),
+                "rwhoisd-%d-%s.%s" % (os.getpid(), time.strftime("%Y%m%d-%H%M%S"), self.extension),
+            )
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.stopped = False
+        self.timer = None
+
+    def start(self):
+        if self.seconds:
+            self.timer = threading.Timer(self.seconds, self.stop)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def _finished(self):
+        """Called once, when the output has been written."""
+
+        global current
+        if self.timer:
+            self.timer.cancel()
+        with _lock:
+            if current is self:
+                current = None
+        if not config.verbose:
+            return
+        if self.filename:
+            print("profile: %s profile written to %s" % (self.kind, self.filename))
+        else:
+            print("profile: %s profile stopped with nothing to write" % self.kind)
+
+
+class CProfileRun(ProfileRun):
+    """Profile queries with cProfile.  A cProfile.Profile only sees
+    the thread that enabled it, so each query thread gets its own,
+    and they are merged at the end.  From Python 3.12, only one
+    profiler can be enabled at a time in the whole process, so a
+    query that starts while another is being profiled is run without
+    the profiler."""
+
+    kind = "cprofile"
+    extension = "pstats"
+    wants_queries = True
+
+    def __init__(self, seconds=None, queries=None, filename=None):
+        ProfileRun.__init__(self, seconds, queries, filename)
+        # keys are thread idents, values are cProfile.Profiles.
+        self.profiles = {}
+        # the idents of the threads whose profiles have recorded at
+        # least one query.
+        self.profiled = set()
+        self.inflight = 0
+        self.count = 0
+        self.written = False
+
+    def run_query(self, func, *args):
+        """Call func(*args) (the processing of one query) under the
+        profiler."""
+
+        ident = threading.get_ident()
+        with self.lock:
+            if self.stopped:
+                profile = None
+            else:
+                profile = self.profiles.get(ident)
+                if profile is None:
+                    profile = self.profiles[ident] = cProfile.Profile()
+                self.inflight += 1
+        if profile is None:
+            return func(*args)
+
+        enabled = False
+        try:
+            try:
+                profile.enable()
+                enabled = True
+            except ValueError:
+                # another profiler is active (Python 3.12 and later).
+                pass
+            return func(*args)
+        finally:
+            if enabled:
+                profile.disable()
+            with self.lock:
+                if enabled:
+                    self.profiled.add(ident)
+                self.inflight -= 1
+                self.count += 1
+                if self.queries and self.count >= self.queries:
+                    self.stopped = True
+                write = self._should_write()
+            if write:
+                self._write()
+
+    def _should_write(self):
+        # must be called with self.lock held.
+        if self.stopped and not self.inflight and not self.written:
+            self.written = True
+            return True
+        return False
+
+    def stop(self):
+        """Stop profiling.  The output is written once the last
+        query being profiled finishes."""
+
+        with self.lock:
+            self.stopped = True
+            write = self._should_write()
+        if write:
+            self._write()
+
+    def _write(self):
+        profiles = [self.profiles[x] for x in self.profiled]
+        if profiles:
+            stats = pstats.Stats(profiles[0])
+            for p in profiles[1:]:
+                stats.add(p)
+            stats.dump_stats(self.filename)
+            self._finished()
+        else:
+            # pstats can't write an empty profile.
+            self.filename = None
+            self._finished()
+
+
+class SampleRun(ProfileRun):
+    """Profile by sampling the stacks of every thread."""
+
+    kind = "sample"
+    extension = "collapsed"
+
+    # frames (file name, function name) in which a thread is waiting
+    # rather than working.  Stacks ending in one of these are not
+    # counted.
+    idle_frames = set(
+        [
+            ("threading.py", "wait"),
+            ("selectors.py", "select"),
+            ("socket.py", "readinto"),
+            ("socket.py", "accept"),
+            ("socketserver.py", "serve_forever"),
+            ("SocketServer.py", "serve_forever"),
+            ("queue.py", "get"),
+        ]
+    )
+
+    def __init__(self, seconds=None, queries=None, filename=None, interval=None):
+        ProfileRun.__init__(self, seconds, queries, filename)
+        self.interval = interval or config.profile_interval
+        # keys are collapsed stacks, values are counts.
+        self.stacks = {}
+        self.samples = 0
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="profiler")
+        self.thread.daemon = True
+        self.thread.start()
+        ProfileRun.start(self)
+
+    def stop(self):
+        """Stop sampling.  The output is written by the sampling
+        thread."""
+
+        self.stopped = True
+
+    def _queries(self):
+        return Stats.counters().get("queries", 0)
+
+    def sample(self):
+        me = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            code = frame.f_code
+            if (os.path.basename(code.co_filename), code.co_name) in self.idle_frames:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append("%s:%s" % (os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            names.reverse()
+            stack = ";".join(names)
+            self.stacks[stack] = self.stacks.get(stack, 0) + 1
+        self.samples += 1
+
+    def run(self):
+        if self.queries:
+            last = self._queries() + self.queries
+        while not self.stopped:
+            self.sample()
+            # counting the queries means merging every thread's
+            # counters, so don't do it every sample.
+            if self.queries and self.samples % 20 == 0 and self._queries() >= last:
+                break
+            time.sleep(self.interval)
+        self._write()
+
+    def _write(self):
+        f = open(self.filename, "w")
+        for stack, n in sorted(self.stacks.items()):
+            f.write("%s %d\n" % (stack, n))
+        f.close()
+        self._finished()
+
+
+def start(kind="sample", seconds=None, queries=None, filename=None):
+    """Start a profile of 'kind' for 'seconds' seconds or 'queries'
+    queries (by default, config.profile_seconds seconds).  Returns
+    the profile, or None if one is already in progress."""
+
+    global current
+
+    if kind == "cprofile":
+        run = CProfileRun(seconds, queries, filename)
+    else:
+        run = SampleRun(seconds, queries, filename)
+    with _lock:
+        if current is not None:
+            return None
+        current = run
+    run.start()
+    if config.verbose:
+        print("profile: %s profile started, writing to %s" % (run.kind, run.filename))
+    return run
+
+
+def stop():
+    """Stop the profile in progress, if any."""
+
+    run = current
+    if run is not None:
+        run.stop()
+
+
+# test driver
+if __name__ == "__main__":
+
+    def busy(n):
+        return sum([i * i for i in range(n)])
+
+    config.verbose = True
+    kind = len(sys.argv) > 1 and sys.argv[1] or "sample"
+    run = start(kind, queries=200)
+    for i in range(200):
+        if run.wants_queries:
+            run.run_query(busy, 20000)
+        else:
+            Stats.count("queries")
+            busy(20000)
+    while current is not None:
+        time.sleep(0.1)
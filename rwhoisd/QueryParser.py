@@ -19,6 +19,10 @@ Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
 USA
 """
 
+import copy
+import threading
+
+import config
 import lex
 import Rwhois
 
@@ -27,6 +31,13 @@ import yacc
 
 db = None
 
+# The parser built by yacc.yacc().  Additional parsers share its
+# (read-only) tables rather than rebuilding them.
+_template_parser = None
+# Idle parsers available for reuse, and the lock protecting the pool.
+_parser_pool = []
+_parser_lock = threading.Lock()
+
 # Define the Lexer for the RWhois query language
 
 tokens = ("VALUE", "QUOTEDVALUE", "CLASS", "ATTR", "AND", "OR", "EQ", "NEQ")
@@ -43,10 +54,17 @@ t_NEQ = r"!="
 t_QUOTEDVALUE = r'["\']\*?[^"*\n]+\*{0,2}["\']'
 
 
+def _db(t):
+    """Return the database the token's lexer is working against,
+    falling back to the module-wide one."""
+
+    return getattr(t.lexer, "db", None) or db
+
+
 def t_firstvalue(t):
     r'^\*?[^\s"\'=*]+\*{0,2}'
 
-    if db.is_objectclass(t.value):
+    if _db(t).is_objectclass(t.value):
         t.type = "CLASS"
     else:
         t.type = "VALUE"
@@ -64,7 +82,7 @@ def t_VALUE(t):
         t.type = "OR"
         t.value = t.value.upper()
         return t
-    if db.is_attribute(t.value):
+    if _db(t).is_attribute(t.value):
         t.type = "ATTR"
     else:
         t.type = "VALUE"
@@ -78,8 +96,9 @@ def t_error(t):
     # t.skip(1)
 
 
-# initalize the lexer
-lex.lex()
+# initalize the lexer.  This master lexer is never fed input itself;
+# each parser gets its own clone of it (see _new_parser()).
+_master_lexer = lex.lex()
 
 # Define the parser for the query language
 
@@ -211,24 +230,81 @@ class Query:
         return
 
 
+def _new_parser():
+    """Create a new parser object.  The first call builds the parse
+    tables with yacc.yacc(); later calls just share them.  Each
+    parser carries its own clone of the lexer, so parsers in
+    different threads never share token state.  Must be called with
+    _parser_lock held."""
+
+    global _template_parser
+
+    if not _template_parser:
+        _template_parser = yacc.yacc()
+        _template_parser.lexer = copy.copy(_master_lexer)
+        return _template_parser
+
+    p = yacc.Parser("xyzzy")
+    p.lexer = copy.copy(_master_lexer)
+    p.productions = _template_parser.productions
+    p.errorfunc = _template_parser.errorfunc
+    p.action = _template_parser.action
+    p.goto = _template_parser.goto
+    p.method = _template_parser.method
+    p.require = _template_parser.require
+    return p
+
+
+def init_parsers(n=None):
+    """Pre-build 'n' parsers (by default, config.parser_pool_size) and
+    place them in the pool.  Calling this before serving keeps the
+    table setup off of the first query, and lets forked worker
+    processes inherit ready-made parsers."""
+
+    if n is None:
+        n = config.parser_pool_size
+    with _parser_lock:
+        while len(_parser_pool) < n:
+            _parser_pool.append(_new_parser())
+
+
 def get_parser():
-    """Return a parser instances.  Parser objects should not be shared
-    amongst threads."""
+    """Return a parser instance, taken from the pool if possible.
+    Parser objects should not be shared amongst threads, so a parser
+    obtained here should be returned with release_parser() when the
+    session is finished with it."""
+
+    with _parser_lock:
+        if _parser_pool:
+            return _parser_pool.pop()
+        return _new_parser()
+
+
+def release_parser(p):
+    """Return a parser obtained with get_parser() to the pool."""
 
-    return yacc.yacc()
+    with _parser_lock:
+        if len(_parser_pool) < config.parser_pool_size:
+            _parser_pool.append(p)
 
 
-def parse(p, query):
+def parse(p, query, querydb=None):
     """Parse a query, raising a RwhoisError in case of parse failure.
-    Returns a Query object."""
+    Returns a Query object.  If 'querydb' is given, the query is
+    parsed against that database rather than the module-wide one, so
+    that a query in progress is unaffected by a database reload."""
 
     # before using any parser objects, the database backend must be
     # set (and it shared by all parsers).
-    assert db
+    p.lexer.db = querydb or db
+    assert p.lexer.db
     try:
-        return p.parse(query)
+        return p.parse(query, lexer=p.lexer)
     except (lex.LexError, yacc.YaccError):
         raise Rwhois.RwhoisError(350)
+    finally:
+        # don't keep an old database alive from the parser pool.
+        p.lexer.db = None
 
 
 if __name__ == "__main__":
@@ -255,7 +331,7 @@ if __name__ == "__main__":
             continue
         print("inputting:", repr(line))
         try:
-            res = qp.parse(line)
+            res = qp.parse(line, lexer=qp.lexer)
             print(repr(res))
         except (lex.LexError, yacc.YaccError) as x:
             print("parse error occurred:", x)
@@ -21,14 +21,25 @@ import re
 import sys
 
 import Cidr
+import Profiler
 import QueryParser
 import Rwhois
+import SlowLog
+import Stats
 
 
 class QueryProcessor:
     def __init__(self, db):
         self.db = db
 
+    def write_error(self, session, error):
+        """Send an error response (see Rwhois.error_message()), and
+        count it in the statistics."""
+
+        code, msg = Rwhois.parse_error(error)
+        Stats.count("error %d" % code)
+        session.wfile.write(Rwhois.error_message((code, msg)))
+
     def _filter_obj_term(self, obj, term):
         """Given a rwhoisobject and a query term (a 3 element tuple:
         attr, operator, value), determine if the object satisfies the
@@ -75,12 +86,13 @@ class QueryProcessor:
             return reslist
         return [x for x in reslist if self._filter_obj(x, terms)]
 
-    def process_query_clause(self, clause, max=0):
+    def process_query_clause(self, clause, max=0, plan=None):
         """Process a query clause (a grouping of terms ANDed
         together).  This is where the indexed searches actually get
         done.  The technique used here is to search on one index and
         use the rest of the clause to filter the results.  Returns a
-        QueryResult object"""
+        QueryResult object.  If 'plan' is a list, a description of
+        the search is appended to it."""
 
         # the technique is to do an index search on the first (or
         # maybe best) indexed term (bare terms are always considered
@@ -116,21 +128,44 @@ class QueryProcessor:
 
         # if we have an attribute name, search on that.
         if st[0]:
+            index = st[0]
             res = self.db.search_attr(st[0], st[2], max)
         else:
             if Cidr.valid_cidr(st[2].strip("*")):
+                index = "cidr"
                 res = self.db.search_cidr(st[2], max)
             else:
+                index = "normal"
                 res = self.db.search_normal(st[2], max)
+        if Stats.timing:
+            Stats.lap("search")
 
-        objs = self._filter_results(self.db.fetch_objects(res.list()), clause)
+        ids = res.list()
+        objs = self.db.fetch_objects(ids)
+        if Stats.timing:
+            Stats.lap("fetch")
+        objs = self._filter_results(objs, clause)
+        if Stats.timing:
+            Stats.lap("filter")
 
         queryres = QueryResult(objs)
 
         # look for referrals
         refs = self.process_referral_search(orig_clause)
         queryres.add_referrals(refs)
-
+        if Stats.timing:
+            Stats.lap("referral")
+
+        if plan is not None:
+            plan.append(
+                {
+                    "term": "%s%s%s" % (st[0] or "", st[0] and st[1] or "", st[2]),
+                    "index": index,
+                    "candidates": len(ids),
+                    "results": len(objs),
+                    "referrals": len(refs),
+                }
+            )
         return queryres
 
     def _is_in_autharea(self, value):
@@ -224,19 +259,19 @@ class QueryProcessor:
 
         return referrals
 
-    def process_full_query(self, query, max=0):
+    def process_full_query(self, query, max=0, plan=None):
         """Given a parsed query object, process it by unioning the
         results of the various ORed together clauses"""
 
         # shortcut for the very common single clause case:
         if len(query.clauses) == 1:
-            res = self.process_query_clause(query.clauses[0], max)
+            res = self.process_query_clause(query.clauses[0], max, plan)
             return res
 
         # otherwise, union the results from all the causes
         res = QueryResult()
         for clause in query.clauses:
-            res.extend(self.process_query_clause(clause), max)
+            res.extend(self.process_query_clause(clause, plan=plan), max)
             if max and len(res) >= max:
                 res.truncate(max)
                 break
@@ -247,27 +282,62 @@ class QueryProcessor:
         """Given a session config and a query line, parse the query,
         perform any searches, return any referrals."""
 
+        Stats.count("queries")
+        prof = Profiler.current
+        if prof is not None and prof.wants_queries:
+            prof.run_query(self._timed_query, session, queryline)
+        else:
+            self._timed_query(session, queryline)
+
+    def _timed_query(self, session, queryline):
+        if not Stats.timing:
+            self._process_query(session, queryline)
+            return
+
+        # the plan is only gathered for the slow query log.
+        plan = None
+        if SlowLog.threshold is not None:
+            plan = {"clauses": []}
+        Stats.begin()
+        try:
+            self._process_query(session, queryline, plan)
+        finally:
+            times = Stats.end()
+        if plan is not None:
+            SlowLog.log(session, queryline, times, plan)
+
+    def _process_query(self, session, queryline, plan=None):
         if not session.queryparser:
             session.queryparser = QueryParser.get_parser()
 
         # parse the query
         try:
-            query = QueryParser.parse(session.queryparser, queryline)
+            query = QueryParser.parse(session.queryparser, queryline, self.db)
         except Rwhois.RwhoisError as x:
-            session.wfile.write(Rwhois.error_message(x))
+            if plan is not None:
+                plan["error"] = str(x)
+            self.write_error(session, x)
             return
+        if Stats.timing:
+            Stats.lap("parse")
 
         max = session.limit
         if max:
             max += 1
 
-        query_result = self.process_full_query(query, max)
+        clause_plan = None
+        if plan is not None:
+            clause_plan = plan["clauses"]
+        query_result = self.process_full_query(query, max, clause_plan)
 
         objects = query_result.objects()
         referrals = query_result.referrals()
+        if plan is not None:
+            plan["results"] = len(objects)
+            plan["referrals"] = len(referrals)
 
         if not objects and not referrals:
-            session.wfile.write(Rwhois.error_message(230))
+            self.write_error(session, 230)
             # session.wfile.write("\r\n")
             return
 
@@ -277,6 +347,7 @@ class QueryProcessor:
             limit_exceeded = True
 
         for obj in objects:
+            session.check_deadline()
             session.wfile.write(obj.to_wire_str())
             session.wfile.write("\r\n")
 
@@ -287,9 +358,11 @@ class QueryProcessor:
             session.wfile.write("\r\n")
 
         if limit_exceeded:
-            session.wfile.write(Rwhois.error_message(330))
+            self.write_error(session, 330)
         else:
             session.wfile.write(Rwhois.ok())
+        if Stats.timing:
+            Stats.lap("render")
 
 
 class QueryResult:
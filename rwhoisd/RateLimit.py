@@ -0,0 +1,200 @@
+# This file is part of python-rwhoisd
+#
+# Copyright (C) 2003, David E. Blacka
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+# This module contains the per-client admission control: token
+# bucket rate limits keyed by client address and by client network.
+
+import collections
+import threading
+import time
+
+import Cidr
+import config
+
+
+class TokenBuckets:
+    """A table of token buckets sharing a single rate and burst size.
+    Buckets are created on demand, and buckets that have been idle
+    long enough to refill completely are dropped, since they are
+    indistinguishable from new ones.  The table is kept in least
+    recently used order, so both lookups and expiry are O(1)
+    (amortized).  This class does no locking of its own."""
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(max(burst, 1))
+        # keys are client keys, values are [tokens, timestamp] lists.
+        self.buckets = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def expire(self, now):
+        """Drop the buckets that have refilled completely.  A bucket in
+        debt (see take()) takes longer than burst/rate to refill, and
+        is kept until it has, so its debt is still honored.  Expiry
+        stops at the least recently used bucket that is not yet full,
+        which holds up the others for at most the time it takes to
+        refill."""
+
+        buckets = self.buckets
+        while buckets:
+            key, bucket = next(iter(buckets.items()))
+            if bucket[0] + (now - bucket[1]) * self.rate < self.burst:
+                break
+            del buckets[key]
+
+    def _bucket(self, key, now):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = [self.burst, now]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            self.buckets.move_to_end(key)
+        return bucket
+
+    def wait_time(self, key, now):
+        """Return how long the client 'key' would have to wait for a
+        token.  0 means a token is available now."""
+
+        tokens = self._bucket(key, now)[0]
+        if tokens >= 1:
+            return 0.0
+        return (1 - tokens) / self.rate
+
+    def take(self, key, now):
+        """Take a token from the bucket for 'key'.  The bucket may go
+        into debt; this is how delayed clients reserve their turn."""
+
+        self._bucket(key, now)[0] -= 1
+
+
+class AdmissionControl:
+    """This class applies the per-address and per-network rate limits
+    described in the config module to new connections and to the
+    query and directive lines sent on them."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.allow = [Cidr.valid_cidr(x) for x in config.rate_limit_allow]
+        self.allow = [x for x in self.allow if x]
+        self.delay = config.rate_limit_action == "delay"
+
+        self.limits = {}
+        for kind in ("conn", "query"):
+            tables = []
+            for scope in ("ip", "prefix"):
+                rate = getattr(config, "%s_rate_per_%s" % (kind, scope))
+                burst = getattr(config, "%s_burst_per_%s" % (kind, scope))
+                if rate:
+                    tables.append((scope, TokenBuckets(rate, burst)))
+            self.limits[kind] = tables
+
+        # counts of clients delayed and rejected, by kind.
+        self.delayed = {"conn": 0, "query": 0}
+        self.rejected = {"conn": 0, "query": 0}
+
+    def is_allowed(self, address):
+        """Returns True if 'address' is on the allow-list, and thus
+        exempt from rate limiting."""
+
+        c = Cidr.valid_cidr(address)
+        if not c:
+            return False
+        for net in self.allow:
+            if net.is_ipv6() == c.is_ipv6() and net.is_supernet(c):
+                return True
+        return False
+
+    def _key(self, scope, address):
+        if scope == "ip":
+            return address
+        c = Cidr.valid_cidr(address)
+        if not c:
+            return address
+        if c.is_ipv6():
+            return str(Cidr.new(c.addr, config.rate_limit_v6_prefix))
+        return str(Cidr.new(c.addr, config.rate_limit_v4_prefix))
+
+    def admit(self, kind, address):
+        """Decide whether a 'kind' ("conn" or "query") event from
+        'address' is within limits.  Returns the number of seconds the
+        event should be delayed (0 for none), or None if it should be
+        rejected.  A token is only taken from the buckets if the event
+        is admitted."""
+
+        tables = self.limits[kind]
+        if not tables or self.is_allowed(address):
+            return 0.0
+
+        keys = [(table, self._key(scope, address)) for scope, table in tables]
+        with self.lock:
+            now = time.monotonic()
+            for table, key in keys:
+                table.expire(now)
+            wait = max([table.wait_time(key, now) for table, key in keys])
+            if wait and (not self.delay or wait > config.rate_limit_max_delay):
+                self.rejected[kind] += 1
+                return None
+            for table, key in keys:
+                table.take(key, now)
+            if wait:
+                self.delayed[kind] += 1
+        return wait
+
+    def admit_connection(self, address):
+        return self.admit("conn", address)
+
+    def admit_query(self, address):
+        return self.admit("query", address)
+
+    def bucket_count(self):
+        """Return the number of live buckets, across all limits."""
+
+        with self.lock:
+            return sum([len(t) for tables in self.limits.values() for s, t in tables])
+
+
+# test driver
+if __name__ == "__main__":
+
+    tb = TokenBuckets(2, 3)
+    now = 100.0
+    print("waits for a burst of 5:", end=" ")
+    for i in range(5):
+        w = tb.wait_time("a", now)
+        print(w, end=" ")
+        if not w:
+            tb.take("a", now)
+    print()
+    print("wait after 1 second:", tb.wait_time("a", now + 1))
+    tb.wait_time("b", now + 1)
+    print("buckets before expiry:", len(tb))
+    tb.expire(now + 5)
+    print("buckets after expiry:", len(tb))
+
+    # a bucket in debt outlives burst/rate.
+    tb.take("c", now)
+    for i in range(6):
+        tb.take("c", now)
+    tb.expire(now + 2)
+    print("bucket in debt kept:", "c" in tb.buckets)
+    tb.expire(now + 6)
+    print("bucket in debt expired once refilled:", "c" not in tb.buckets)
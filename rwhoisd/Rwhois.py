@@ -20,6 +20,8 @@
 # This modules contains classes that are fairly general to RWhois
 # server operation.
 
+from DataFile import normalize_attr
+
 
 class RwhoisError(Exception):
     pass
@@ -64,7 +66,10 @@ error_codes = {
 }
 
 
-def error_message(value):
+def parse_error(value):
+    """Return the (code, message) of an error given as for
+    error_message().  The message may be None."""
+
     try:
         code, msg = value
         code = int(code)
@@ -75,6 +80,14 @@ def error_message(value):
         except ValueError:
             msg = value
             code = 402
+    return code, msg
+
+
+def error_message(value):
+    """Format an error response.  'value' is an error code, a (code,
+    message) tuple, or just a message (which gets code 402)."""
+
+    code, msg = parse_error(value)
     if msg:
         return "%%error %d %s: %s\r\n" % (code, error_codes.get(code, 402), msg)
     else:
@@ -88,10 +101,22 @@ def ok():
 class rwhoisobject:
     """This is the standard class for RWhois data objects."""
 
+    # the memoized (unprefixed) wire rendering.  It is only set on an
+    # instance once the object has been rendered, and any change to
+    # the object must clear it (see _invalidate()).
+    _wire = None
+
     def __init__(self):
         self.data = {}
         self.attr_order = []
 
+    def _invalidate(self):
+        """Discard the cached wire rendering.  This must be called
+        whenever 'data' or 'attr_order' are modified."""
+
+        if self._wire is not None:
+            del self._wire
+
     def get_attr(self, attr, default=None):
         """This returns a list of values associated with a particular
         attribute.  The default value, if supplied, must be a single
@@ -120,6 +145,7 @@ class rwhoisobject:
         """Adds an attribute to the object."""
 
         attr = attr.strip().lower()
+        self._invalidate()
         if attr in self.data:
             self.data[attr].append(value)
         else:
@@ -131,6 +157,23 @@ class rwhoisobject:
         for attr, value in attr_list:
             self.add_attr(attr, value)
 
+    def add_record(self, rec):
+        """Adds a list of (attribute, value) tuples, as produced by
+        DataFile.parse_record(), to the object.  This is a faster
+        add_attrs() for bulk loading."""
+
+        self._invalidate()
+        data = self.data
+        order = self.attr_order
+        for attr, value in rec:
+            attr = normalize_attr(attr)
+            vals = data.get(attr)
+            if vals is None:
+                order.append(attr)
+                data[attr] = [value]
+            else:
+                vals.append(value)
+
     def items(self):
         """Returns the list of (attribute, value) tuples (actually 2
         elements lists).  Attributes with multiple values produce
@@ -169,9 +212,22 @@ class rwhoisobject:
         return res
 
     def to_wire_str(self, prefix=None):
-        """Return the response formatted string (classname:attr:value)"""
+        """Return the response formatted string (classname:attr:value).
+        The unprefixed rendering is memoized, since the same objects
+        tend to be returned over and over.  Prefixed renderings (e.g.,
+        for -xfer, which walks every object) are not kept."""
+
+        if prefix:
+            return self.attrs_to_wire_str(self.attr_order, prefix)
+        res = self._wire
+        if res is None:
+            res = self._wire = self.attrs_to_wire_str(self.attr_order)
+        return res
+
+    def prerender(self):
+        """Render (and cache) the wire form of this object."""
 
-        return self.attrs_to_wire_str(self.attr_order, prefix)
+        self.to_wire_str()
 
 
 # A basic test driver
@@ -189,3 +245,10 @@ if __name__ == "__main__":
 
     print("obj:\n", obj)
     print("wire:\n", obj.to_wire_str())
+    assert obj.to_wire_str() is obj.to_wire_str()
+    obj.add_attr("email", "aiden@example.com")
+    assert "aiden@example.com" in obj.to_wire_str()
+    print("xfer wire:\n", obj.to_wire_str("%xfer "))
+    assert "_wire" in obj.__dict__
+    obj.add_attr("email", "aq@example.net")
+    assert "_wire" not in obj.__dict__
@@ -16,54 +16,155 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
 # USA
+import signal
+import socket
 import sys
+import threading
+import time
 
+import Backend
+import Capture
 import config
 import DirectiveProcessor
+import Metrics
+import Profiler
 import QueryParser
 import QueryProcessor
+import RateLimit
 import Rwhois
 import Session
+import SlowLog
 import SocketServer
+import Startup
+import Stats
 
 # server-wide variables
 
 query_processor = None
 directive_processor = None
+# the Capture recording the sessions, if config.capture_file is set.
+capture = None
+# set by the --exit-after-load option.
+exit_after_load = False
+
+# the files the database is loaded from, used again on reload.
+schema_file = None
+data_files = []
+
+# held while a reload is in progress.
+reload_lock = threading.Lock()
+# statistics about the startup load, and the last completed reload.
+startup_load = {}
+last_reload = {}
+
+
+class LineTooLong(Exception):
+    """Raised when a client sends a line longer than
+    config.max_line_length."""
 
 
 class RwhoisTCPServer(SocketServer.ThreadingTCPServer):
     def __init__(self, server_address, RequestHandlerClass):
         self.allow_reuse_address = True
         SocketServer.TCPServer.__init__(self, server_address, RequestHandlerClass)
+        self.admission = RateLimit.AdmissionControl()
+        # connections admitted with a delay, keyed by client address.
+        # The delay is served in the handler thread, not here.
+        self.admission_delays = {}
 
     def verify_request(self, request, client_address):
-        # implement access control here
+        wait = self.admission.admit_connection(client_address[0])
+        if wait is None:
+            if config.verbose:
+                print("%s connection rate limit exceeded" % (client_address,))
+            return False
+        if wait:
+            self.admission_delays[client_address] = wait
         return True
 
 
 class RwhoisHandler(SocketServer.StreamRequestHandler):
-    def readline(self):
-        """Read a line of input from the client."""
-        # a simple way of doing this
-        # return self.rfile.readline()
-
-        data = self.request.recv(1024)
-        if not data:
+    def setup(self):
+        SocketServer.StreamRequestHandler.setup(self)
+        # input received from the client but not yet consumed.
+        self.inbuf = b""
+        self.session_deadline = None
+        if config.session_timeout:
+            self.session_deadline = time.monotonic() + config.session_timeout
+
+        # serve out any delay imposed by the connection rate limits.
+        delay = self.server.admission_delays.pop(self.client_address, 0)
+        if delay:
+            time.sleep(delay)
+
+    def _next_timeout(self, line_deadline):
+        """Return the socket timeout to use for the next read, given
+        the deadline for the line currently being read (if any).
+        Returns None if no limit applies.  Raises socket.timeout if a
+        limit has already expired."""
+
+        now = time.monotonic()
+        deadlines = []
+        if line_deadline:
+            deadlines.append(line_deadline)
+        elif config.idle_timeout:
+            deadlines.append(now + config.idle_timeout)
+        if self.session_deadline:
+            deadlines.append(self.session_deadline)
+        if not deadlines:
             return None
 
-        lines = data.splitlines(True)
+        timeout = min(deadlines) - now
+        if timeout <= 0:
+            raise socket.timeout("time limit exceeded")
+        return timeout
 
-        # ugh. this totally defeats any pipelining, not that rwhois
-        # clients should be doing that.
-        if len(lines) > 1 and config.verbose:
-            print("%s discarding additional input lines: %r") % (self.client_address, lines)
-        return lines[0]
+    def readline(self):
+        """Read a line of input from the client.  Returns None if the
+        client closed the connection.  Raises socket.timeout if the
+        client has exceeded the idle, read or session time limits, and
+        LineTooLong if the line exceeds config.max_line_length."""
+
+        line_deadline = None
+        if self.inbuf and config.read_timeout:
+            line_deadline = time.monotonic() + config.read_timeout
+
+        while True:
+            i = self.inbuf.find(b"\n")
+            if i > config.max_line_length or (i < 0 and len(self.inbuf) > config.max_line_length):
+                raise LineTooLong()
+            if i >= 0:
+                line = self.inbuf[: i + 1]
+                self.inbuf = self.inbuf[i + 1 :]
+                return line.decode("utf-8", "replace")
+
+            self.request.settimeout(self._next_timeout(line_deadline))
+            data = self.request.recv(1024)
+            if not data:
+                # hand back any unterminated final line.
+                line, self.inbuf = self.inbuf, b""
+                return line.decode("utf-8", "replace") or None
+
+            if line_deadline is None and config.read_timeout:
+                line_deadline = time.monotonic() + config.read_timeout
+            self.inbuf += data
 
     def handle(self):
 
         self.quit_flag = False
 
+        if not Session.slots.acquire():
+            self.write_error((501, "too many sessions"))
+            if config.verbose:
+                print("%s refused connection: no free session slots" % (self.client_address,))
+            return
+
+        try:
+            self.handle_session()
+        finally:
+            Session.slots.release()
+
+    def handle_session(self):
         # output a banner
         self.wfile.write(config.banner_string)
         self.wfile.write("\r\n")
@@ -72,11 +173,71 @@ class RwhoisHandler(SocketServer.StreamRequestHandler):
         session = Session.Context()
         session.rfile = self.rfile
         session.wfile = self.wfile
+        session.client_address = self.client_address
+
+        if config.verbose:
+            print("%s accepted connection (slots: %r)" % (self.client_address, Session.slots.usage()))
+
+        self.capture = capture
+        if self.capture:
+            self.capture_no = self.capture.open(self.client_address)
+        try:
+            self.session_loop(session)
+        except socket.timeout:
+            Session.slots.note_timeout()
+            if config.verbose:
+                print("%s time limit exceeded" % (self.client_address,))
+            self.send_final_error(503)
+        except LineTooLong:
+            if config.verbose:
+                print("%s line too long" % (self.client_address,))
+            self.send_final_error((350, "line too long"))
+        finally:
+            # hand the session's query parser back for reuse.
+            if session.queryparser:
+                QueryParser.release_parser(session.queryparser)
+                session.queryparser = None
+            if self.capture:
+                self.capture.close(self.capture_no)
 
         if config.verbose:
-            print("%s accepted connection") % (self.client_address,)
+            print("%s disconnected") % (self.client_address,)
+
+    def write_error(self, error):
+        """Send an error response, and count it in the statistics."""
+
+        code, msg = Rwhois.parse_error(error)
+        Stats.count("error %d" % code)
+        self.wfile.write(Rwhois.error_message((code, msg)))
+
+    def send_final_error(self, error):
+        """Send an error before closing the connection."""
+
+        try:
+            # don't let a client that has stopped reading hold us up
+            # any further.
+            self.request.settimeout(5)
+            self.write_error(error)
+        except OSError:
+            pass
+
+    def start_request(self, session):
+        """Set the deadline for answering the line just read (see
+        config.query_timeout).  The socket timeout is set to match, so
+        a client that stops reading can't hold up the response."""
+
+        deadline = None
+        if config.query_timeout:
+            deadline = time.monotonic() + config.query_timeout
+        if self.session_deadline and (deadline is None or self.session_deadline < deadline):
+            deadline = self.session_deadline
+        session.deadline = deadline
+        if deadline is not None:
+            self.request.settimeout(max(deadline - time.monotonic(), 0.001))
+        else:
+            self.request.settimeout(None)
 
-        c = 0
+    def session_loop(self, session):
         while True:
             line = self.readline()
             if not line:
@@ -86,7 +247,20 @@ class RwhoisHandler(SocketServer.StreamRequestHandler):
             # we can skip blank lines.
             if not line:
                 continue
+            if self.capture:
+                self.capture.line(self.capture_no, line)
+
+            wait = self.server.admission.admit_query(self.client_address[0])
+            if wait is None:
+                self.write_error((501, "rate limit exceeded"))
+                self.wfile.flush()
+                if not session.holdconnect:
+                    break
+                continue
+            if wait:
+                time.sleep(wait)
 
+            self.start_request(session)
             try:
                 if line.startswith("-"):
                     self.handle_directive(session, line)
@@ -103,9 +277,6 @@ class RwhoisHandler(SocketServer.StreamRequestHandler):
             if self.quit_flag:
                 break
 
-        if config.verbose:
-            print("%s disconnected") % (self.client_address,)
-
     def handle_directive(self, session, line):
         if config.verbose:
             print("%s directive %s") % (self.client_address, line)
@@ -123,53 +294,179 @@ class RwhoisHandler(SocketServer.StreamRequestHandler):
     def handle_error(self, session, error):
         code = error[0]
         msg = error[1]
-        session.wfile.write(Rwhois.error_message((code, msg)))
+        self.write_error((code, msg))
 
 
 def usage(pname):
     print(
         """
-        usage: %s [-v] schema_file data_file [data_file ...]
-        -v: verbose """
-    ) % pname
+        usage: %s [-v] [--exit-after-load] [--startup-report=file] schema_file data_file [data_file ...]
+        -v: verbose
+        --exit-after-load: exit once the data is loaded, instead of
+            serving it (implies printing the startup report)
+        --startup-report=file: write the startup report (the time
+            and memory taken by each phase of startup) to 'file' as
+            JSON ("-" for stdout) """
+        % pname
+    )
     sys.exit(64)
 
 
+def load_db(startup=False):
+    """Build a new database from the schema and data files given at
+    startup, using the configured storage backend."""
+
+    return Backend.load(schema_file, data_files, startup)
+
+
+def install_db(db):
+    """Make 'db' the database used to answer queries.  The processors
+    are replaced rather than modified, so queries already in progress
+    finish against the database they started with."""
+
+    global query_processor, directive_processor
+
+    QueryParser.db = db
+    query_processor = QueryProcessor.QueryProcessor(db)
+    directive_processor = DirectiveProcessor.DirectiveProcessor(db, reload)
+
+
+def _update_db(db):
+    """Apply changes in the data files to a copy of 'db', and swap it
+    in.  Returns False if that isn't possible (e.g., the schema has
+    changed)."""
+
+    if not db.can_update(schema_file):
+        return False
+
+    db = db.copy()
+    added, changed, removed = db.update_data(data_files)
+    db.index_data()
+    install_db(db)
+    if config.verbose:
+        print("reload: %d objects added, %d changed, %d removed" % (added, changed, removed))
+    return True
+
+
+def _reload():
+    try:
+        start = time.monotonic()
+        mode = "incremental"
+        if not config.incremental_reload or not _update_db(query_processor.db):
+            mode = "full"
+            db = load_db()
+            install_db(db)
+        elapsed = time.monotonic() - start
+        # this is the peak over the life of the process, not just
+        # this reload.
+        rss_peak = Stats.peak_rss()
+
+        last_reload.clear()
+        last_reload.update({"time": time.time(), "mode": mode, "duration": elapsed, "peak_rss": rss_peak})
+        Stats.count("reload " + mode)
+        if config.verbose:
+            if rss_peak is None:
+                print("reload: %s reload complete in %.2f seconds" % (mode, elapsed))
+            else:
+                print(
+                    "reload: %s reload complete in %.2f seconds, process peak RSS %d KB"
+                    % (mode, elapsed, rss_peak)
+                )
+    except Exception as e:
+        Stats.count("reload failed")
+        # always report this, so a failed reload isn't silent.
+        sys.stderr.write("reload: failed, continuing with the old data: %s\n" % e)
+    finally:
+        reload_lock.release()
+
+
+def reload():
+    """Start rebuilding the database from the data files in the
+    background.  The old database keeps answering queries until the
+    new one is ready, and then the two are swapped.  Returns False if
+    a reload is already in progress."""
+
+    if not reload_lock.acquire(False):
+        return False
+    t = threading.Thread(target=_reload, name="reload")
+    t.daemon = True
+    t.start()
+    return True
+
+
 def init(argv):
     import getopt
 
-    import MemDB
+    global schema_file, data_files, capture, exit_after_load
 
     pname = argv[0]
-    opts, argv = getopt.getopt(argv[1:], "v")
+    opts, argv = getopt.getopt(argv[1:], "v", ["exit-after-load", "startup-report="])
+    report_file = None
     for o, a in opts:
         if o == "-v":
             config.verbose = True
+        elif o == "--exit-after-load":
+            exit_after_load = True
+        elif o == "--startup-report":
+            report_file = a
 
     if len(argv) < 2:
         usage(pname)
     schema_file = argv[0]
     data_files = argv[1:]
 
-    db = MemDB.MemDB()
+    # the startup report is only collected if it is wanted, as timing
+    # the load costs a little.  bin/pyrwhoisd starts it before
+    # importing this module, so the imports are included.
+    if Startup.current is None and (exit_after_load or report_file or config.verbose):
+        Startup.begin()
 
-    db.init_schema(schema_file)
-    for df in data_files:
-        db.load_data(df)
-    db.index_data()
+    start = time.monotonic()
+    db = load_db(startup=True)
+    startup_load["duration"] = time.monotonic() - start
+    install_db(db)
+    with Startup.phase("init_parsers"):
+        QueryParser.init_parsers()
 
-    QueryParser.db = db
+    report = Startup.end()
+    if report is not None:
+        if config.verbose or exit_after_load:
+            print("\n".join(report.format()))
+        if report_file == "-":
+            print(report.to_json())
+        elif report_file:
+            f = open(report_file, "w")
+            f.write(report.to_json() + "\n")
+            f.close()
 
-    global query_processor, directive_processor
+    # open the log files now, so that a bad path is reported at
+    # startup.
+    if config.slow_query_threshold is not None:
+        SlowLog.start()
+    if config.capture_file:
+        capture = Capture.Capture(config.capture_file)
 
-    query_processor = QueryProcessor.QueryProcessor(db)
-    directive_processor = DirectiveProcessor.DirectiveProcessor(db)
+
+def server_state():
+    """Return the server state reported by the metrics listener."""
+
+    return {"db": query_processor.db, "load": startup_load, "reload": dict(last_reload)}
 
 
 def serve():
     # initialize the TCP server
     server = RwhoisTCPServer((config.server_address, config.port), RwhoisHandler)
 
+    if config.metrics_port:
+        Metrics.start(server_state)
+
+    # SIGHUP reloads the data files.
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, lambda signum, frame: reload())
+    # SIGUSR1 starts a profile (see config.profile_mode).
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: Profiler.start(config.profile_mode))
+
     # and handle incoming connections
     if config.verbose:
         if not config.server_address:
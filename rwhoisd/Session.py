@@ -17,6 +17,10 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
 # USA
 
+import socket
+import threading
+import time
+
 import config
 
 
@@ -24,13 +28,94 @@ class Context:
     """This class is used to hold session specific variables."""
 
     def __init__(self):
-        # each session gets its own query parser.
+        # each session borrows a query parser from the shared pool
+        # (see QueryParser.get_parser()) for its lifetime.
         self.queryparser = None
 
         # these should be set by the handler
         rfile = None
         wfile = None
 
+        # the remote address of the client, if any.
+        self.client_address = None
+        # when the session started, on the time.monotonic() clock.
+        self.start_time = time.monotonic()
+
+        # when the request being processed must be answered by (see
+        # config.query_timeout), on the time.monotonic() clock, or
+        # None for no limit.
+        self.deadline = None
+
         # set some default values.
         self.limit = config.default_limit
         self.holdconnect = False
+
+    def check_deadline(self):
+        """Raise socket.timeout if the request being processed has
+        run past its deadline."""
+
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise socket.timeout("query time limit exceeded")
+
+
+class SessionSlots:
+    """This class keeps track of the connection slots in use, so that
+    the number of simultaneous sessions can be capped and
+    monitored."""
+
+    def __init__(self, max_sessions=0):
+        self.lock = threading.Lock()
+        # the maximum number of simultaneous sessions, 0 means no
+        # limit.
+        self.max_sessions = max_sessions
+        self.active = 0
+        self.peak = 0
+        # total sessions accepted, refused for lack of a slot, and
+        # closed because a time limit expired.
+        self.accepted = 0
+        self.refused = 0
+        self.timeouts = 0
+
+    def acquire(self):
+        """Claim a slot for a new session.  Returns False if all
+        slots are in use."""
+
+        with self.lock:
+            if self.max_sessions and self.active >= self.max_sessions:
+                self.refused += 1
+                return False
+            self.active += 1
+            self.accepted += 1
+            if self.active > self.peak:
+                self.peak = self.active
+            return True
+
+    def release(self):
+        """Give back a slot claimed with acquire()."""
+
+        with self.lock:
+            self.active -= 1
+
+    def note_timeout(self):
+        """Record a session that was closed for exceeding a time
+        limit."""
+
+        with self.lock:
+            self.timeouts += 1
+
+    def usage(self):
+        """Return a dictionary describing the current slot usage."""
+
+        with self.lock:
+            return {
+                "active": self.active,
+                "max": self.max_sessions,
+                "peak": self.peak,
+                "accepted": self.accepted,
+                "refused": self.refused,
+                "timeouts": self.timeouts,
+            }
+
+
+# the server-wide slot table.
+slots = SessionSlots(config.max_sessions)
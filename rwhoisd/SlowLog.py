@@ -0,0 +1,77 @@
+# This file is part of python-rwhoisd
+#
+# Copyright (C) 2003, David E. Blacka
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+# This module writes the slow query log: one JSON object per line for
+# each query that took longer than config.slow_query_threshold.  The
+# entries are written by a LogWriter, so a slow disk never holds up a
+# query; if its queue is full, the entry is dropped (and counted)
+# instead.
+
+import json
+import threading
+import time
+
+import config
+import LogWriter
+import Stats
+
+# the slowest a query may be without being logged, in seconds, or
+# None to log nothing.  This may be changed at any time.
+threshold = config.slow_query_threshold
+
+_writer = None
+_lock = threading.Lock()
+
+
+def _get_writer():
+    global _writer
+    with _lock:
+        if _writer is None:
+            _writer = LogWriter.LogWriter(config.slow_query_log, "slowlog")
+    return _writer
+
+
+def start():
+    """Open the slow query log now, rather than at the first slow
+    query, so that a log file that can't be written is reported at
+    startup.  Raises OSError if it can't be opened."""
+
+    _get_writer()
+
+
+def log(session, queryline, times, plan):
+    """Log the query 'queryline' if it was slow.  'times' are its
+    phase times (from Stats.end()) and 'plan' describes how it was
+    processed (see QueryProcessor.process_query())."""
+
+    total = times.get("total", 0.0)
+    if threshold is None or total < threshold:
+        return
+
+    entry = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime()),
+        "query": queryline,
+        "client": session.client_address and session.client_address[0] or None,
+        "ms": dict([(p, round(t * 1000, 3)) for p, t in times.items()]),
+    }
+    entry.update(plan)
+    if _get_writer().put(json.dumps(entry, sort_keys=True) + "\n"):
+        Stats.count("slow logged")
+    else:
+        Stats.count("slow dropped")
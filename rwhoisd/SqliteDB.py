@@ -0,0 +1,439 @@
+# This file is part of python-rwhoisd
+#
+# Copyright (C) 2003, David E. Blacka
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+# This module contains an on-disk database, built on SQLite, that can
+# be used in place of MemDB when the data won't comfortably fit in
+# memory.  Only the schema and the lists of seen attributes, classes
+# and authority areas are held in memory; objects and index keys live
+# in the database file, and are found through its B-tree indexes.
+
+import os
+import sqlite3
+import sys
+import threading
+
+import Backend
+import Cidr
+import config
+import MemDB
+import Startup
+from Backend import IndexResult
+
+# the number of objects inserted per executemany() call when loading.
+load_batch_size = 10000
+
+_tables = """
+CREATE TABLE objects (id TEXT PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE strkeys (attr TEXT NOT NULL, key TEXT NOT NULL, id TEXT NOT NULL);
+CREATE TABLE cidrkeys (attr TEXT NOT NULL, v6 INTEGER NOT NULL,
+                       start BLOB NOT NULL, end BLOB NOT NULL,
+                       netlen INTEGER NOT NULL, id TEXT NOT NULL);
+CREATE TABLE meta (kind TEXT NOT NULL, name TEXT NOT NULL, value TEXT);
+"""
+
+_indexes = """
+CREATE INDEX strkeys_key ON strkeys (attr, key);
+CREATE INDEX cidrkeys_start ON cidrkeys (attr, v6, start, netlen);
+"""
+
+
+def _addr_blob(numaddr):
+    """Convert a numeric address into a 16 byte big-endian string.
+    IPv6 addresses don't fit in SQLite's 64 bit integers, but fixed
+    width big-endian blobs compare in the same order as the numbers
+    they hold."""
+
+    return numaddr.to_bytes(16, "big")
+
+
+def _cidr_row(attr, c, id):
+    return (attr, int(c.is_ipv6()), _addr_blob(c.numaddr), _addr_blob(c.numaddr + c.length() - 1), c.netlen, id)
+
+
+def _prefix_end(prefix):
+    """Return the smallest string greater than every string starting
+    with 'prefix', or None if there is no such string."""
+
+    while prefix:
+        last = ord(prefix[-1])
+        if last < sys.maxunicode:
+            return prefix[:-1] + chr(last + 1)
+        prefix = prefix[:-1]
+    return None
+
+
+class SqliteDB(Backend.Backend):
+    """An rwhoisd database stored in an SQLite file.  A database is
+    either built from scratch, using init_schema(), load_data() and
+    index_data() just like MemDB, or opened (read only) from a file
+    built earlier; see open()."""
+
+    name = "sqlite"
+
+    def __init__(self, filename):
+
+        self.filename = filename
+        # connections can't be shared between threads, so each thread
+        # gets its own.
+        self.local = threading.local()
+
+        # these have the same meaning as in MemDB.
+        self.attrs = {}
+        self.normal_indexes = []
+        self.cidr_indexes = []
+        self.classes = {}
+        self.authareas = {}
+        self.schema_stamp = None
+        # the number of index keys for each attribute, worked out
+        # when the database is built.
+        self.sizes = {}
+
+        # the connection used while building the database.
+        self.builder = None
+        self.count = 0
+
+    def _conn(self):
+        if self.builder:
+            return self.builder
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            uri = "file:%s?mode=ro" % self.filename
+            conn = self.local.conn = sqlite3.connect(uri, uri=True)
+        return conn
+
+    def _query(self, sql, args=()):
+        return self._conn().execute(sql, args).fetchall()
+
+    def init_schema(self, schema_file):
+        """Initialize the schema from a schema file, and start
+        building a new database.  The database is written to a
+        temporary file, which replaces 'filename' when index_data() is
+        called."""
+
+        self.schema_stamp = MemDB.file_stamp(schema_file)
+        self.attrs.update(MemDB.read_schema(schema_file))
+        self._init_index_lists()
+
+        tmpname = self.filename + ".new"
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+        self.builder = sqlite3.connect(tmpname)
+        self.builder.execute("PRAGMA journal_mode = OFF")
+        self.builder.execute("PRAGMA synchronous = OFF")
+        self.builder.executescript(_tables)
+
+    def _init_index_lists(self):
+        for attr, index_type in self.attrs.items():
+            if index_type in ("N", "A"):
+                self.normal_indexes.append(attr)
+            if index_type in ("C", "A"):
+                self.cidr_indexes.append(attr)
+
+    def open(self):
+        """Open a database file previously built by index_data()."""
+
+        for kind, name, value in self._query("SELECT kind, name, value FROM meta"):
+            if kind == "attr":
+                self.attrs[name] = value
+            elif kind == "class":
+                self.classes[name] = None
+            elif kind == "autharea":
+                self.authareas[name] = None
+            elif kind == "size":
+                self.sizes[name] = int(value)
+        self._init_index_lists()
+        self.count = self._query("SELECT count(*) FROM objects")[0][0]
+
+    def _index_rows(self, obj, id, strrows, cidrrows):
+        """Work out the index rows for 'obj', appending them to
+        'strrows' and 'cidrrows'.  An object may repeat a value (or
+        hold overlapping netblocks), so its rows are uniqued."""
+
+        strkeys = {}
+        cidrkeys = {}
+        for a, v in obj.items():
+            index_type = self.attrs.setdefault(a, None)
+            v = v.lower()
+            if a == "auth-area":
+                self.authareas.setdefault(v, None)
+            elif a == "class-name":
+                self.classes.setdefault(v, None)
+
+            if not index_type:
+                continue
+            if index_type == "N":
+                strkeys[(a, v, id)] = None
+                continue
+            if index_type == "C":
+                if "-" in v:
+                    start, end = v.split("-", 1)
+                    cidrs = Cidr.netblock_to_cidr(start.strip(), end.strip()) or []
+                else:
+                    cidrs = [Cidr.valid_cidr(v)]
+                for c in cidrs:
+                    if c:
+                        cidrkeys[_cidr_row(a, c, id)] = None
+                continue
+            # "A" and "R" indexes hold both kinds of key.
+            c = Cidr.valid_cidr(v)
+            if c:
+                cidrkeys[_cidr_row(a, c, id)] = None
+            else:
+                strkeys[(a, v, id)] = None
+        strrows.extend(strkeys)
+        cidrrows.extend(cidrkeys)
+
+    def _insert(self, objrows, strrows, cidrrows):
+        conn = self.builder
+        conn.executemany("INSERT OR REPLACE INTO objects VALUES (?, ?)", objrows)
+        conn.executemany("INSERT INTO strkeys VALUES (?, ?, ?)", strrows)
+        conn.executemany("INSERT INTO cidrkeys VALUES (?, ?, ?, ?, ?, ?)", cidrrows)
+
+    def load_data(self, data_file):
+        """Load data from rwhoisd-style TXT files (i.e., attr:value,
+        records separated with a "---" bare line).  Returns the
+        number of objects loaded."""
+
+        count = 0
+        objrows, strrows, cidrrows = [], [], []
+        for obj in MemDB.read_objects(data_file):
+            id = obj.getid()
+            if not id:
+                continue
+            id = id.lower()
+            count += 1
+            objrows.append((id, str(obj)))
+            self._index_rows(obj, id, strrows, cidrrows)
+            if len(objrows) >= load_batch_size:
+                self._insert(objrows, strrows, cidrrows)
+                objrows, strrows, cidrrows = [], [], []
+        self._insert(objrows, strrows, cidrrows)
+        return count
+
+    def load_data_files(self, data_files, workers=None):
+        """Load a list of data files, one by one."""
+
+        for df in data_files:
+            self.load_data(df)
+
+    def index_data(self):
+        """Finish building the database: create the indexes, record
+        the schema, and move the new file into place."""
+
+        conn = self.builder
+        conn.executescript(_indexes)
+        # a "C" or "A" attribute may have keys in both tables.
+        self.sizes = {}
+        for table in ("strkeys", "cidrkeys"):
+            for attr, n in conn.execute("SELECT attr, count(*) FROM %s GROUP BY attr" % table):
+                self.sizes[attr] = self.sizes.get(attr, 0) + n
+        rows = [("attr", k, v) for k, v in self.attrs.items()]
+        rows += [("class", k, None) for k in self.classes]
+        rows += [("autharea", k, None) for k in self.authareas]
+        rows += [("size", k, str(v)) for k, v in self.sizes.items()]
+        conn.executemany("INSERT INTO meta VALUES (?, ?, ?)", rows)
+        conn.commit()
+        conn.execute("ANALYZE")
+        self.count = conn.execute("SELECT count(*) FROM objects").fetchone()[0]
+        conn.close()
+        self.builder = None
+        os.replace(self.filename + ".new", self.filename)
+
+    def _to_object(self, data):
+        return MemDB.record_to_object([line.partition(":")[::2] for line in data.split("\n")])
+
+    def fetch_objects(self, id_list):
+        res = []
+        for id in id_list:
+            rows = self._query("SELECT data FROM objects WHERE id = ?", (id,))
+            if rows:
+                res.append(self._to_object(rows[0][0]))
+        return res
+
+    def _limit(self, sql, max):
+        if max:
+            return sql + " LIMIT %d" % max
+        return sql
+
+    def _find_str(self, attr, value, prefix_match, max):
+        if not prefix_match:
+            sql = "SELECT DISTINCT id FROM strkeys WHERE attr = ? AND key = ? ORDER BY key"
+            args = (attr, value)
+        else:
+            end = _prefix_end(value)
+            if end is None:
+                sql = "SELECT DISTINCT id FROM strkeys WHERE attr = ? AND key >= ? ORDER BY key"
+                args = (attr, value)
+            else:
+                sql = "SELECT DISTINCT id FROM strkeys WHERE attr = ? AND key >= ? AND key < ? ORDER BY key"
+                args = (attr, value, end)
+        return [x[0] for x in self._query(self._limit(sql, max), args)]
+
+    def _find_cidr_exact(self, attr, c, max):
+        sql = "SELECT DISTINCT id FROM cidrkeys WHERE attr = ? AND v6 = ? AND start = ? AND netlen = ?"
+        args = (attr, int(c.is_ipv6()), _addr_blob(c.numaddr), c.netlen)
+        return [x[0] for x in self._query(self._limit(sql, max), args)]
+
+    def _find_cidr_subnets(self, attr, c, max):
+        sql = (
+            "SELECT DISTINCT id FROM cidrkeys WHERE attr = ? AND v6 = ? "
+            "AND start >= ? AND start <= ? AND netlen >= ? ORDER BY start, netlen"
+        )
+        args = (attr, int(c.is_ipv6()), _addr_blob(c.numaddr), _addr_blob(c.numaddr + c.length() - 1), c.netlen)
+        return [x[0] for x in self._query(self._limit(sql, max), args)]
+
+    def _find_cidr(self, attr, c, prefix_match, max):
+        """Find the exact match of 'c', or its closest supernet, or
+        (if prefix_match is True) all of its supernets, the same way
+        CidrMemIndex.find() does."""
+
+        k = c.clone()
+        res = []
+        while k.netlen >= 0:
+            k.calc()
+            found = self._find_cidr_exact(attr, k, max)
+            if found and not prefix_match:
+                return found
+            res += found
+            if max and len(res) >= max:
+                return res[:max]
+            k.netlen -= 1
+        return res
+
+    def search_attr(self, attr, value, max=0):
+        """Search for a value in a particular attribute's index.  If
+        the attribute is cidr indexed, an attempt to convert value
+        into a Cidr object will be made.  Returns a list of object ids
+        (or an empty list if nothing was found)"""
+
+        attr = attr.lower()
+        index_type = self.attrs.get(attr)
+        if not index_type:
+            return IndexResult()
+
+        super_prefix_match = value.endswith("**")
+        prefix_match = False
+        if value.endswith("*"):
+            value = value.rstrip("*")
+            prefix_match = True
+
+        if index_type == "N":
+            return IndexResult(self._find_str(attr, value.strip().lower(), prefix_match, max))
+
+        c = Cidr.valid_cidr(value.strip())
+        if index_type == "C":
+            if not c:
+                return IndexResult()
+            if super_prefix_match:
+                return IndexResult(self._find_cidr_subnets(attr, c, max))
+            return IndexResult(self._find_cidr(attr, c, prefix_match, max))
+
+        # "A" and "R" indexes.
+        if c:
+            return IndexResult(self._find_cidr(attr, c, prefix_match, max))
+        return IndexResult(self._find_str(attr, value.strip().lower(), prefix_match, max))
+
+    def object_iterator(self):
+        # use a private cursor, so the iteration can be interleaved
+        # with other queries.
+        cur = self._conn().cursor()
+        for (data,) in cur.execute("SELECT data FROM objects ORDER BY id"):
+            yield self._to_object(data)
+
+    def object_count(self):
+        return self.count
+
+    def index_sizes(self):
+        # counting the keys means scanning both tables, so this uses
+        # the counts recorded when the database was built.
+        return dict(self.sizes)
+
+    def stats(self):
+        res = Backend.Backend.stats(self)
+        res["file"] = self.filename
+        res["file size"] = os.path.getsize(self.filename)
+        return res
+
+
+def load(schema_file, data_files, startup=False):
+    """Build the database in config.sqlite_file from a schema file
+    and a list of data files.  At startup, an existing file is used
+    as is if config.sqlite_rebuild is false."""
+
+    if startup and not config.sqlite_rebuild and os.path.exists(config.sqlite_file):
+        return open_db(config.sqlite_file)
+    return build(config.sqlite_file, schema_file, data_files)
+
+
+def build(filename, schema_file, data_files):
+    """Build (or rebuild) the database file 'filename' from a schema
+    file and a list of data files, returning the opened database."""
+
+    db = SqliteDB(filename)
+    with Startup.phase("init_schema"):
+        db.init_schema(schema_file)
+    for df in data_files:
+        with Startup.phase("load_data " + os.path.basename(df)) as p:
+            p["records"] = db.load_data(df)
+    with Startup.phase("index_data"):
+        db.index_data()
+    return db
+
+
+def open_db(filename):
+    """Open an existing database file."""
+
+    db = SqliteDB(filename)
+    db.open()
+    return db
+
+
+# test driver
+if __name__ == "__main__":
+
+    if len(sys.argv) < 4:
+        print("usage: %s db_file schema_file data_file..." % sys.argv[0])
+        sys.exit(64)
+
+    db = build(sys.argv[1], sys.argv[2], sys.argv[3:])
+    db = open_db(sys.argv[1])
+
+    # the same data in a MemDB, to check the search results against.
+    memdb = MemDB.MemDB()
+    memdb.init_schema(sys.argv[2])
+    for df in sys.argv[3:]:
+        memdb.load_data(df)
+    memdb.index_data()
+    print("objects:", db.object_count())
+    print("attributes:", db.attrs)
+    print("authority areas:", list(db.get_authareas()))
+
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        attr, value = line.split("=", 1)
+        res = db.search_attr(attr, value)
+        print("%s=%s: %s" % (attr, value, res.list()))
+        expected = memdb.search_attr(attr, value).list()
+        if sorted(res.list()) != sorted(expected):
+            print("MISMATCH: MemDB found %s" % expected)
+        for obj in db.fetch_objects(res.list()):
+            print(obj)
+            print()
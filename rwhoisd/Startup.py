@@ -0,0 +1,170 @@
+# This file is part of python-rwhoisd
+#
+# Copyright (C) 2003, David E. Blacka
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+# This module times the phases of server startup (importing the
+# modules, reading the schema, loading each data file, preparing the
+# indexes, and so on), for the startup report.  The loading code marks
+# its phases with phase(), which does nothing unless a report has been
+# started with begin().
+
+import contextlib
+import json
+import time
+
+import config
+import Stats
+
+# the report being collected, or None.
+current = None
+
+
+class StartupReport:
+    def __init__(self):
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        # a list of dictionaries, one per phase, in the order they
+        # finished.
+        self.phases = []
+        # time charged to parts of phases (see charge()): keys are
+        # names, values are [seconds, count] lists.
+        self.charged = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time the phase 'name'.  The phase's dictionary is yielded,
+        so the caller can add to it (e.g., the number of "records"
+        it handled)."""
+
+        res = {"name": name}
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield res
+        finally:
+            res["wall"] = time.perf_counter() - wall
+            res["cpu"] = time.process_time() - cpu
+            if res.get("records") and res["wall"] > 0:
+                res["records_per_sec"] = res["records"] / res["wall"]
+            res["peak_rss_kb"] = Stats.peak_rss()
+            self.phases.append(res)
+
+    def timed(self, name, func):
+        """Return a version of 'func' that charges the time spent in
+        it to 'name'.  This is for work that is spread through other
+        phases, such as adding objects to the indexes while loading."""
+
+        entry = self.charged.setdefault(name, [0.0, 0])
+        clock = time.perf_counter
+
+        def timed_func(*args):
+            t = clock()
+            try:
+                return func(*args)
+            finally:
+                entry[0] += clock() - t
+                entry[1] += 1
+
+        return timed_func
+
+    def to_dict(self):
+        included = []
+        for name, (seconds, count) in sorted(self.charged.items()):
+            entry = {"name": name, "wall": seconds, "calls": count}
+            if seconds > 0:
+                entry["calls_per_sec"] = count / seconds
+            included.append(entry)
+        return {
+            "phases": self.phases,
+            "included": included,
+            "total": {
+                "wall": time.perf_counter() - self.start_wall,
+                "cpu": time.process_time() - self.start_cpu,
+                "peak_rss_kb": Stats.peak_rss(),
+            },
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+    def format(self):
+        """Return the report as a list of lines of text."""
+
+        d = self.to_dict()
+        lines = ["%-40s %9s %9s %12s %12s" % ("startup phase", "wall s", "cpu s", "records/s", "peak RSS KB")]
+
+        def line(name, wall, cpu=None, rate=None, rss=None):
+            return "%-40s %9.3f %9s %12s %12s" % (
+                name[:40],
+                wall,
+                cpu is not None and "%.3f" % cpu or "",
+                rate is not None and "%.0f" % rate or "",
+                rss is not None and "%d" % rss or "",
+            )
+
+        for p in d["phases"]:
+            lines.append(line(p["name"], p["wall"], p["cpu"], p.get("records_per_sec"), p["peak_rss_kb"]))
+        for p in d["included"]:
+            lines.append(line("  (in the above) " + p["name"], p["wall"], None, p.get("calls_per_sec")))
+        t = d["total"]
+        lines.append(line("total", t["wall"], t["cpu"], None, t["peak_rss_kb"]))
+        return lines
+
+
+def requested(argv):
+    """Returns True if the server's command line 'argv' (see
+    RwhoisServer.init()) asks for the startup report, or
+    config.verbose is set.  This lets the report be started before
+    the server is imported, so the imports are included."""
+
+    for arg in argv[1:]:
+        if arg == "--" or not arg.startswith("-"):
+            break
+        if arg == "-v":
+            return True
+        # getopt accepts any unambiguous prefix of a long option.
+        name = arg.split("=", 1)[0]
+        if len(name) > 2 and ("--exit-after-load".startswith(name) or "--startup-report".startswith(name)):
+            return True
+    return bool(config.verbose)
+
+
+def begin():
+    """Start collecting a startup report."""
+
+    global current
+    current = StartupReport()
+    return current
+
+
+def end():
+    """Stop collecting the startup report, and return it (or None if
+    none was started)."""
+
+    global current
+    report, current = current, None
+    return report
+
+
+def phase(name):
+    """Time the phase 'name' in the current report, if there is
+    one."""
+
+    if current is None:
+        return contextlib.nullcontext({})
+    return current.phase(name)
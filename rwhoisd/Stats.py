@@ -0,0 +1,284 @@
+# This file is part of python-rwhoisd
+#
+# Copyright (C) 2003, David E. Blacka
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+# This module collects server statistics: counts of events (queries,
+# directives, errors) and timings of the phases of query processing.
+# Each thread records into its own counters and histograms, so
+# recording needs no locks; readers merge the records of all threads.
+# Callers check the module's 'timing' flag before calling the timing
+# functions, so timing costs a single attribute test per phase when
+# it is off.
+
+import math
+import sys
+import threading
+import time
+
+import config
+
+# whether queries are being timed.  This may be changed at any time.
+# The slow query log needs the timings.
+timing = config.query_timing or config.slow_query_threshold is not None
+
+# when the server started, on the time.time() clock.
+started = time.time()
+
+# the phases of a query, in the order they happen.  "total" is the
+# whole query.
+phases = ("parse", "search", "fetch", "filter", "referral", "render", "total")
+
+
+class Histogram:
+    """A histogram of durations with logarithmic buckets, a quarter of
+    an octave (about 19%) wide, from 1 microsecond up to about 17
+    minutes.  The benchmark tools (see bench/) use it too."""
+
+    nbuckets = 120
+
+    def __init__(self):
+        self.counts = [0] * self.nbuckets
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+
+    def add(self, seconds):
+        us = seconds * 1e6
+        b = 0
+        if us > 1:
+            b = min(int(math.log2(us) * 4), self.nbuckets - 1)
+        self.counts[b] += 1
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        counts = self.counts
+        for b, n in enumerate(other.counts):
+            if n:
+                counts[b] += n
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+
+    def upper(self, b):
+        """Return the upper bound of bucket 'b', in seconds."""
+
+        return 2 ** ((b + 1) / 4.0) / 1e6
+
+    def percentile(self, p):
+        """Return (an upper bound on) the 'p'th percentile, in
+        seconds."""
+
+        if not self.count:
+            return 0.0
+        rank = max(1, int(self.count * p / 100.0 + 0.999999))
+        seen = 0
+        for b, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(self.upper(b), self.max)
+        return self.max
+
+    def mean(self):
+        if not self.count:
+            return 0.0
+        return self.total / self.count
+
+    def to_dict(self):
+        """Return the histogram as a dictionary (for JSON), with times
+        in milliseconds."""
+
+        res = {"count": self.count}
+        if not self.count:
+            return res
+        res["min"] = self.min * 1000
+        res["mean"] = self.mean() * 1000
+        res["max"] = self.max * 1000
+        for p in (50, 90, 99, 99.9):
+            res["p%s" % str(p).replace(".", "")] = self.percentile(p) * 1000
+        res["buckets"] = [[self.upper(b) * 1000, n] for b, n in enumerate(self.counts) if n]
+        return res
+
+
+class ThreadStats:
+    """The event counts and phase histograms of one thread, and the
+    phase times of the query it is working on."""
+
+    def __init__(self):
+        self.thread = threading.current_thread()
+        self.counts = {}
+        self.histograms = dict([(p, Histogram()) for p in phases])
+        self.active = False
+        self.start = self.last = 0.0
+        self.current = {}
+
+    def begin(self):
+        self.active = True
+        self.current = {}
+        self.start = self.last = time.perf_counter()
+
+    def lap(self, phase):
+        if not self.active:
+            return
+        now = time.perf_counter()
+        self.current[phase] = self.current.get(phase, 0.0) + now - self.last
+        self.last = now
+
+    def end(self):
+        if not self.active:
+            return {}
+        self.active = False
+        self.current["total"] = time.perf_counter() - self.start
+        for phase, t in self.current.items():
+            self.histograms[phase].add(t)
+        return self.current
+
+
+_local = threading.local()
+_lock = threading.Lock()
+# the ThreadStats of the live threads.
+_tables = []
+# the merged records of threads that have exited.
+_retired = ThreadStats()
+
+
+def _retire_dead():
+    """Fold the tables of threads that have exited into _retired.
+    Must be called with _lock held."""
+
+    global _tables
+    live = []
+    for t in _tables:
+        if t.thread.is_alive():
+            live.append(t)
+        else:
+            for p in phases:
+                _retired.histograms[p].merge(t.histograms[p])
+            for name, n in t.counts.items():
+                _retired.counts[name] = _retired.counts.get(name, 0) + n
+    _tables = live
+
+
+def _stats():
+    t = getattr(_local, "stats", None)
+    if t is None:
+        t = _local.stats = ThreadStats()
+        with _lock:
+            _retire_dead()
+            _tables.append(t)
+    return t
+
+
+def count(name, n=1):
+    """Add 'n' to the counter 'name'."""
+
+    counts = _stats().counts
+    counts[name] = counts.get(name, 0) + n
+
+
+def counters():
+    """Return a dictionary of all counters, merged from every
+    thread."""
+
+    res = {}
+    with _lock:
+        _retire_dead()
+        tables = [_retired] + _tables
+    for t in tables:
+        for name, n in list(t.counts.items()):
+            res[name] = res.get(name, 0) + n
+    return res
+
+
+def begin():
+    """Start timing a query in this thread."""
+    _stats().begin()
+
+
+def lap(phase):
+    """Charge the time since the last lap (or the start of the query)
+    to 'phase'."""
+    _stats().lap(phase)
+
+
+def end():
+    """Finish timing the query in this thread, and return a dictionary
+    of its phase times (in seconds)."""
+    return _stats().end()
+
+
+def phase_histograms():
+    """Return a dictionary of histograms, keyed by phase, merged from
+    every thread."""
+
+    res = dict([(p, Histogram()) for p in phases])
+    with _lock:
+        _retire_dead()
+        tables = [_retired] + _tables
+    for t in tables:
+        for p in phases:
+            res[p].merge(t.histograms[p])
+    return res
+
+
+def peak_rss():
+    """Return the peak resident set size of this process in
+    kilobytes, or None if it can't be determined on this platform."""
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # MacOS reports bytes, everything else kilobytes.
+    if sys.platform == "darwin":
+        rss //= 1024
+    return rss
+
+
+# test driver
+if __name__ == "__main__":
+
+    def work():
+        for i in range(1000):
+            count("queries")
+            begin()
+            time.sleep(0.0001)
+            lap("parse")
+            lap("search")
+            end()
+
+    threads = [threading.Thread(target=work) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    print("counters:", counters())
+    for p, h in sorted(phase_histograms().items()):
+        print(
+            "%-8s count %5d  mean %8.3f ms  p50 %8.3f ms  p99 %8.3f ms"
+            % (p, h.count, h.mean() * 1000, h.percentile(50) * 1000, h.percentile(99) * 1000)
+        )
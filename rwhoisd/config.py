@@ -40,6 +40,165 @@ max_limit = 256
 # if this is zero, you are allowing clients to disable query limits.
 min_limit = 0
 
+# If this is true, the wire form of every object is rendered when the
+# data is loaded, instead of the first time the object is returned.
+# This trades memory for a faster first response.
+prerender_objects = False
+
+# the number of idle query parsers to keep around for reuse by new
+# sessions.  This should be about the number of concurrent sessions
+# expected.
+parser_pool_size = 16
+
+# session time limits, in seconds.  0 means no limit.  idle_timeout
+# is how long to wait for a client to start sending a line.
+# read_timeout is how long a client may take to finish sending a line
+# once it has started.  query_timeout is how long a query or directive
+# may take to be answered, including sending the response to the
+# client; it is checked as each object is written, so a single slow
+# search is not interrupted.  session_timeout caps the total lifetime
+# of a connection, including holdconnect sessions.  Sessions that
+# exceed a limit are sent "%error 503" and closed.
+idle_timeout = 60
+read_timeout = 30
+query_timeout = 0
+session_timeout = 0
+
+# the longest line a client may send, in bytes.  A client sending a
+# longer line is sent "%error 350" and disconnected.
+max_line_length = 4096
+
+# the maximum number of simultaneous sessions.  0 means no limit.
+max_sessions = 0
+
+# per-client rate limits.  Rates are in events per second, and bursts
+# are the number of events a client may have in hand at once.  "conn"
+# limits apply to new connections, "query" limits to each query or
+# directive line.  "ip" limits apply per client address, "prefix"
+# limits per client network (see the prefix lengths below).  A rate
+# of 0 disables that limit.
+conn_rate_per_ip = 0
+conn_burst_per_ip = 10
+conn_rate_per_prefix = 0
+conn_burst_per_prefix = 40
+query_rate_per_ip = 0
+query_burst_per_ip = 20
+query_rate_per_prefix = 0
+query_burst_per_prefix = 80
+
+# the network sizes used to group clients for the "prefix" limits.
+rate_limit_v4_prefix = 24
+rate_limit_v6_prefix = 48
+
+# clients within these networks (CIDR strings) are never rate limited.
+rate_limit_allow = ["127.0.0.0/8", "::1/128"]
+
+# what to do with a client that is over a limit: "reject" it, or
+# "delay" it until it is back within the limit.  Clients that would
+# have to wait longer than rate_limit_max_delay seconds are rejected.
+rate_limit_action = "reject"
+rate_limit_max_delay = 2.0
+
+# the number of processes used to parse the data files at startup.
+# Large files are split into pieces of about load_chunk_size bytes,
+# so even a single file can be parsed in parallel.  1 means parse in
+# this process.
+load_workers = 1
+load_chunk_size = 16 * 1024 * 1024
+
+# If this is true, a reload only reads the data files that have
+# changed, and applies just the added, changed and removed objects to
+# a copy of the running database, which is then swapped in.
+# Otherwise (or if the schema file has changed, or lazy_objects or
+# index_dir are set), the whole database is rebuilt and swapped in.
+incremental_reload = True
+
+# The storage backend holding the objects and indexes: "memory" (the
+# default) keeps everything in memory; "sqlite" keeps it in an SQLite
+# database file (see sqlite_file), which is slower but allows data
+# sets larger than memory to be served.  Any other value is taken as
+# the name of a module providing a backend (see Backend.py).
+storage_backend = "memory"
+
+# The file used by the "sqlite" backend.  It is (re)built from the
+# data files at startup and on every reload.
+sqlite_file = "rwhoisd.sqlite"
+
+# If this is false, and sqlite_file already exists at startup, it is
+# served as is rather than rebuilt.  Use this for large databases
+# built ahead of time with SqliteDB.py.
+sqlite_rebuild = True
+
+# If this is true, the "memory" backend keeps only the location of
+# each object's record in the data files, and reads objects from the
+# files when a query returns them, which greatly reduces the memory
+# used.  Data files must then be replaced (not rewritten in place)
+# when they change, and reloads are always full reloads.  Compressed
+# data files are always held in memory.
+lazy_objects = False
+
+# The number of objects read on demand (see lazy_objects) that are
+# cached in memory.
+object_cache_size = 10000
+
+# If this is set to a directory, the attribute indexes are written
+# there as index files, and searched in place through mmap rather
+# than held in memory.  At startup, index files that are up to date
+# with the schema and data files are opened without being rebuilt.
+# The data files are still read and parsed at startup, since the
+# objects are not kept in the index files.  Index files can't be
+# updated, so reloads are always full reloads.
+index_dir = None
+
+# If this is true, the time spent in each phase of each query
+# (parsing, index search, fetching objects, filtering, referral
+# search and rendering) is recorded, for the statistics reports.
+query_timing = False
+
+# If this is set to a port number, the server's statistics are served
+# over HTTP at /metrics on that port, in the Prometheus text format.
+metrics_port = None
+
+# The address the metrics listener binds to.  By default, only local
+# clients can scrape it.
+metrics_address = "127.0.0.1"
+
+# If this is set (to a number of seconds), queries that take at least
+# that long are logged, with the details of how they were processed,
+# to slow_query_log.  This turns on query_timing.
+slow_query_threshold = None
+
+# The file the slow queries are appended to, one JSON object per
+# line.  If this is None, they are written to stdout.
+slow_query_log = None
+
+# If this is set, the lines sent by every client are recorded, with
+# their timings, in this file, for replaying with bench/replay.py.
+# See Capture.py for the format.
+capture_file = None
+
+# The profiler (see Profiler.py) started by SIGUSR1 or the "-profile"
+# directive: the kind of profile ("sample" or "cprofile"), how long it
+# runs for unless told otherwise, how often the "sample" profiler
+# samples (in seconds), and the directory the profiles are written to
+# (None means the system's temporary directory).
+profile_mode = "sample"
+profile_seconds = 30
+profile_interval = 0.005
+profile_dir = None
+
+# client addresses allowed to use the administrative directives
+# (e.g., "-reload" and "-stats").
+admin_addresses = ["127.0.0.1", "::1"]
+
+# If this is set, the "-profile" and "-memory" directives must also
+# be given "secret=<admin_secret>".
+admin_secret = None
+
+# the "-memory" directive gives the last report again, rather than
+# making a new one, if it is less than this many seconds old.
+memory_report_interval = 60
+
 # If this is true, some logging will be done to stdout.
 verbose = False
 
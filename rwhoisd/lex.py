@@ -248,13 +248,16 @@ class Lexer:
         c.lexdata = self.lexdata
         c.lexpos = self.lexpos
         c.lexlen = self.lexlen
-        c.lenindexfunc = self.lexindexfunc
+        c.lexindexfunc = self.lexindexfunc
         c.lexerrorf = self.lexerrorf
         c.lextokens = self.lextokens
         c.lexignore = self.lexignore
         c.lineno = self.lineno
+        c.debug = self.debug
         c.optimize = self.optimize
-        c.token = c.realtoken
+        if c.lexdata is not None:
+            c.token = c.realtoken
+        return c
 
     # ------------------------------------------------------------
     # input() - Push a new string into the lexer